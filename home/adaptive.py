@@ -0,0 +1,207 @@
+"""
+Adaptive batch sizing for the dispatcher
+
+A fixed batch size is wrong both ways: small batches waste round trips while
+a backlog drains, and large ones hold long write-back transactions for
+little gain when the queue is nearly empty. ``AdaptiveBatchSizer`` watches
+every batch (as a dispatcher hook) and picks the size and send concurrency
+of the next one within configured bounds:
+
+- ``errors``: the share of transient send failures reached
+  ``max_error_rate``. Halve the batch and drop one concurrent send.
+- ``latency``: the send phase took longer than ``target_send_seconds``.
+  Shrink the batch by a quarter.
+- ``backlog``: the batch came back full and its oldest row was already
+  ``backlog_seconds`` overdue. Double the batch (as far as the last send time
+  says still fits in ``target_send_seconds``) and add one concurrent send.
+- ``idle``: the queue ran dry. Move back towards the initial size (halving
+  or doubling) and the lowest concurrency.
+
+Every change is logged and counted in
+``notification_dispatch_adjustments_total``. The current size, concurrency
+and backlog are exported as gauges. Sizers are kept per process and per
+backend, so the dispatcher loop and web workers keep what they learned
+between runs.
+"""
+
+import logging
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+
+from .dispatcher import DispatchHooks
+from .metrics import dispatch_adjustments, dispatch_backlog, dispatch_batch_target, dispatch_concurrency
+
+logger = logging.getLogger(__name__)
+
+_sizers = {}
+_sizers_lock = threading.Lock()
+
+
+def adaptive_enabled():
+    return getattr(settings, 'DISPATCH_ADAPTIVE', {}).get('enabled', False)
+
+
+def reset_batch_sizers():
+    """Forget what every sizer learned, e.g. between benchmark rounds"""
+    with _sizers_lock:
+        _sizers.clear()
+
+
+def get_batch_sizer(backend, initial_size=None):
+    """Return the process-wide sizer for ``backend``, configured from settings"""
+    with _sizers_lock:
+        sizer = _sizers.get(backend.name)
+        if sizer is None:
+            options = dict(getattr(settings, 'DISPATCH_ADAPTIVE', {}))
+            options.pop('enabled', None)
+            if options.get('max_concurrency') is None:
+                options['max_concurrency'] = backend.max_concurrency
+            if initial_size is not None:
+                options['initial_size'] = initial_size
+            sizer = _sizers[backend.name] = AdaptiveBatchSizer(backend.name, **options)
+        return sizer
+
+
+class AdaptiveBatchSizer(DispatchHooks):
+    """
+    Pick the next batch size and send concurrency from the last batch
+
+    Args:
+        name: Backend name, used for metrics labels
+        initial_size: Batch size to start from and return to when idle
+        min_batch_size: Smallest batch size
+        max_batch_size: Largest batch size
+        min_concurrency: Fewest concurrent send calls
+        max_concurrency: Most concurrent send calls
+        target_send_seconds: Longest acceptable send phase per batch
+        max_error_rate: Share of transient failures that triggers a back-off
+        backlog_seconds: Overdue time of the oldest row that counts as a backlog
+    """
+
+    def __init__(self, name='default', initial_size=500, min_batch_size=50, max_batch_size=5000,
+                 min_concurrency=1, max_concurrency=1, target_send_seconds=2.0, max_error_rate=0.1,
+                 backlog_seconds=30.0):
+        self.name = name
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max(max_batch_size, min_batch_size)
+        self.initial_size = self._clamp_size(initial_size)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.target_send_seconds = target_send_seconds
+        self.max_error_rate = max_error_rate
+        self.backlog_seconds = backlog_seconds
+        self.batch_size = self.initial_size
+        self.concurrency = self.min_concurrency
+        self._lock = threading.Lock()
+        self._reset_batch()
+        dispatch_batch_target.set(self.batch_size, backend=self.name)
+        dispatch_concurrency.set(self.concurrency, backend=self.name)
+
+    def _clamp_size(self, size):
+        return max(self.min_batch_size, min(self.max_batch_size, int(size)))
+
+    def _reset_batch(self):
+        self._requested = 0
+        self._fetched = 0
+        self._lag = 0.0
+        self._send_seconds = 0.0
+        self._results = 0
+        self._transient = 0
+
+    def next_batch_size(self, cap=None):
+        """Size to request for the next batch, at most ``cap`` (run limit, breaker probe)"""
+        with self._lock:
+            self._requested = self.batch_size if cap is None else min(self.batch_size, cap)
+            return self._requested
+
+    # Dispatcher hooks may run on send worker threads and in several dispatchers
+    # sharing this sizer, so every hook that changes state holds the lock
+
+    def batch_fetched(self, batch_number, notifications):
+        lag = 0.0
+        if notifications:
+            oldest = min(notification.scheduled_at for notification in notifications)
+            lag = max(0.0, (timezone.now() - oldest).total_seconds())
+        with self._lock:
+            self._fetched = len(notifications)
+            self._lag = lag
+        dispatch_backlog.set(round(lag, 3), backend=self.name)
+
+    def phase_finished(self, batch_number, phase, seconds):
+        if phase == 'send':
+            with self._lock:
+                self._send_seconds = seconds
+
+    def notification_processed(self, notification, result):
+        # Collapsed, expired and grouped rows were not sent themselves
+        if result is not None and not any(result.get(flag) for flag in ('collapsed', 'expired', 'grouped')):
+            with self._lock:
+                self._results += 1
+                if result.get('transient'):
+                    self._transient += 1
+
+    def batch_finished(self, batch_number, size):
+        with self._lock:
+            if self._requested:
+                self._adjust()
+            self._reset_batch()
+
+    def _adjust(self):
+        error_rate = self._transient / self._results if self._results else 0.0
+        size, concurrency = self.batch_size, self.concurrency
+        if self._results and error_rate >= self.max_error_rate:
+            reason = 'errors'
+            size = self._clamp_size(size // 2)
+            concurrency = max(self.min_concurrency, concurrency - 1)
+        elif self._send_seconds > self.target_send_seconds:
+            reason = 'latency'
+            size = self._clamp_size(size * 3 // 4)
+        elif self._fetched >= self._requested and self._lag >= self.backlog_seconds:
+            reason = 'backlog'
+            if self._send_seconds:
+                # Grow no further than the last send time says fits in the
+                # target, with some headroom, and skip steps under 10%
+                fits = int(self._fetched * self.target_send_seconds * 0.9 / self._send_seconds)
+                size = min(size * 2, fits)
+                if size < self.batch_size * 1.1:
+                    size = self.batch_size
+            else:
+                size *= 2
+            size = self._clamp_size(size)
+            concurrency = min(self.max_concurrency, concurrency + 1)
+        elif self._fetched < self._requested:
+            reason = 'idle'
+            if size > self.initial_size:
+                size = max(self.initial_size, size // 2)
+            else:
+                size = min(self.initial_size, size * 2)
+            concurrency = max(self.min_concurrency, concurrency - 1)
+        else:
+            return
+
+        if (size, concurrency) == (self.batch_size, self.concurrency):
+            return
+        logger.info(
+            'Adaptive batching (%s): %s, batch size %d -> %d, concurrency %d -> %d '
+            '(send %.3fs, transient errors %.1f%%, oldest row %.1fs overdue)',
+            self.name, reason, self.batch_size, size, self.concurrency, concurrency,
+            self._send_seconds, error_rate * 100, self._lag,
+        )
+        self.batch_size, self.concurrency = size, concurrency
+        dispatch_adjustments.inc(backend=self.name, reason=reason)
+        dispatch_batch_target.set(size, backend=self.name)
+        dispatch_concurrency.set(concurrency, backend=self.name)
+
+    def snapshot(self):
+        """Current settings for stats endpoints and command output"""
+        with self._lock:
+            batch_size, concurrency = self.batch_size, self.concurrency
+        return {
+            'batch_size': batch_size,
+            'concurrency': concurrency,
+            'min_batch_size': self.min_batch_size,
+            'max_batch_size': self.max_batch_size,
+            'max_concurrency': self.max_concurrency,
+        }
@@ -1,17 +1,133 @@
+import json
+
+from django import forms
+from django.conf import settings
 from django.contrib import admin
-from .models import UserFCMToken, ScheduledNotification
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+
+from .models import (
+    UserFCMToken, ScheduledNotification, NotificationHistory, NotificationEvent, NotificationContent, token_digest
+)
+
+
+def estimated_count(queryset):
+    """Planner row estimate for ``queryset`` on PostgreSQL, None elsewhere"""
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    try:
+        plan = json.loads(queryset.order_by().explain(format='json'))
+    except (DatabaseError, ValueError):
+        return None
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that does not run ``COUNT(*)`` over large result sets
+
+    On PostgreSQL the planner's estimate is used once it reaches
+    ``ADMIN_COUNT_ESTIMATE_THRESHOLD`` rows; smaller results (and other
+    databases) are counted exactly, so short filtered lists stay accurate.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate >= getattr(settings, 'ADMIN_COUNT_ESTIMATE_THRESHOLD', 100000):
+            return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist defaults for tables with millions of rows"""
+    paginator = EstimatedCountPaginator
+    # Skip the second, unfiltered COUNT(*) next to the filtered one
+    show_full_result_count = False
+
 
 @admin.register(UserFCMToken)
-class UserFCMTokenAdmin(admin.ModelAdmin):
+class UserFCMTokenAdmin(LargeTableAdmin):
     list_display = ('token', 'is_active', 'created_at', 'updated_at')
-    list_filter = ('is_active', 'created_at')
+    list_filter = ('is_active',)
     search_fields = ('token',)
     readonly_fields = ('created_at', 'updated_at')
 
+    def get_search_results(self, request, queryset, search_term):
+        # Exact match on the indexed digest instead of LIKE '%...%' over every token
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(token_hash=token_digest(search_term)), False
+
+class ScheduledNotificationForm(forms.ModelForm):
+    """Edit the text directly; the shared content row is picked in save_model()"""
+    title = forms.CharField(max_length=NotificationContent._meta.get_field('title').max_length)
+    body = forms.CharField(widget=forms.Textarea)
+
+    class Meta:
+        model = ScheduledNotification
+        exclude = ('content',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.content_id is not None:
+            self.initial.setdefault('title', self.instance.title)
+            self.initial.setdefault('body', self.instance.body)
+
 @admin.register(ScheduledNotification)
-class ScheduledNotificationAdmin(admin.ModelAdmin):
+class ScheduledNotificationAdmin(LargeTableAdmin):
+    form = ScheduledNotificationForm
+    fields = (
+        'fcm_token', 'title', 'body', 'scheduled_at', 'priority', 'status', 'collapse_key', 'expires_at',
+        'sent_at', 'error_message', 'created_at',
+    )
     list_display = ('title', 'fcm_token', 'scheduled_at', 'priority', 'status', 'sent_at')
-    list_filter = ('status', 'priority', 'scheduled_at', 'created_at')
-    search_fields = ('title', 'body')
+    # status and scheduled_at are served by the (status, scheduled_at) and
+    # (scheduled_at, id) indexes; the changelist pages along the latter
+    list_filter = ('status', 'priority', 'scheduled_at')
+    list_select_related = ('content', 'fcm_token')
+    ordering = ('scheduled_at', 'id')
+    search_fields = ('content__title', 'content__body')
     readonly_fields = ('created_at', 'sent_at')
-    date_hierarchy = 'scheduled_at'
+    # A <select> of every token would not render
+    raw_id_fields = ('fcm_token',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer(
+            'error_message', 'content__body', 'fcm_token__user_agent'
+        )
+
+    def save_model(self, request, obj, form, change):
+        # Runs inside the admin's transaction, so a purge cannot drop the content before the row refers to it
+        obj.content = NotificationContent.objects.intern(form.cleaned_data['title'], form.cleaned_data['body'])
+        super().save_model(request, obj, form, change)
+
+@admin.register(NotificationHistory)
+class NotificationHistoryAdmin(LargeTableAdmin):
+    list_display = ('title', 'fcm_token_id', 'scheduled_at', 'priority', 'status', 'sent_at', 'archived_at')
+    list_filter = ('status', 'priority')
+    list_select_related = ('content',)
+    search_fields = ('content__title',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('error_message', 'content__body')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(NotificationEvent)
+class NotificationEventAdmin(LargeTableAdmin):
+    list_display = ('notification_id', 'event', 'occurred_at')
+    list_filter = ('event',)
+    search_fields = ('=notification_id',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,259 @@
+"""
+Pluggable push delivery backends
+
+A backend turns ``(token, title, body, priority)`` into a provider message
+with ``build_message()`` and delivers lists of them with ``send_batch()``,
+returning one result dict per message (``{'success': True, 'messageId',
+'sent_at'}`` or ``{'success': False, 'error'}``). Messages carry the
+notification id in their data so the service worker can report receipts and
+clicks. Failures caused by the provider or the network rather than the token
+(timeouts, 5xx, quota) also carry ``'transient': True``, which feeds the
+dispatcher's circuit breaker. Backends declare how many messages one
+``send_batch()`` call accepts and how many calls may run at once, and the
+dispatcher sizes its sends accordingly.
+
+The backend is selected with the ``NOTIFICATION_BACKEND`` setting (a dotted
+path) and constructed with ``NOTIFICATION_BACKEND_OPTIONS`` as keyword
+arguments:
+
+- ``home.notification_service.FCMNotificationService`` (default): Firebase
+  Cloud Messaging through the Admin SDK's ``send_each``.
+- ``home.notification_service.FCMHttpV1Service``: FCM through a direct
+  HTTP v1 client on pooled HTTP/2 connections (needs httpx[http2]).
+- ``home.backends.WebPushBackend``: direct VAPID Web Push (needs pywebpush).
+- ``home.backends.MemoryBackend`` / ``home.backends.FileBackend``: record
+  messages instead of delivering them, for tests, benchmarks and local runs.
+"""
+
+import base64
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'home.notification_service.FCMNotificationService'
+
+_backend = None
+
+
+def get_backend():
+    """Return the configured delivery backend, constructing it once"""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'NOTIFICATION_BACKEND', DEFAULT_BACKEND)
+        options = getattr(settings, 'NOTIFICATION_BACKEND_OPTIONS', {})
+        if path == DEFAULT_BACKEND and not options:
+            # Reuse the module-level instance instead of initializing Firebase twice
+            from .notification_service import fcm_service
+            _backend = fcm_service
+        else:
+            _backend = import_string(path)(**options)
+    return _backend
+
+
+@contextmanager
+def override_backend(backend):
+    """Temporarily make ``backend`` the configured backend (benchmarks, tests)"""
+    global _backend
+    previous, _backend = _backend, backend
+    try:
+        yield backend
+    finally:
+        _backend = previous
+
+
+class DeliveryBackend:
+    """Base class for delivery backends"""
+
+    name = 'base'
+    # Most messages one send_batch() call accepts (None: no limit)
+    max_batch_size = 1
+    # send_batch() calls the dispatcher may run concurrently
+    max_concurrency = 1
+
+    def build_message(self, token, title, body, priority='high', notification_id=None, collapse_key=None,
+                      ttl=None):
+        """Build the provider message for a single notification
+
+        Messages with the same ``collapse_key`` replace each other while
+        waiting for delivery, where the provider supports it. ``ttl`` is how
+        many seconds the provider may hold the message for an offline
+        device (None: the provider's default).
+        """
+        raise NotImplementedError
+
+    def send_batch(self, messages):
+        """Deliver ``messages`` and return one result dict per message, in order"""
+        raise NotImplementedError
+
+    def send_message(self, message):
+        """Send a prebuilt message and return a result dict"""
+        return self.send_batch([message])[0]
+
+    def send_notification(self, token, title, body, priority='high', notification_id=None):
+        """Build and send a single notification"""
+        try:
+            message = self.build_message(token, title, body, priority, notification_id)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+        return self.send_message(message)
+
+
+def web_push_topic(collapse_key):
+    """Web Push ``Topic`` header for a collapse key (at most 32 URL-safe base64 characters)"""
+    digest = hashlib.blake2b(collapse_key.encode('utf-8'), digest_size=24).digest()
+    return base64.urlsafe_b64encode(digest).decode('ascii')
+
+
+class WebPushBackend(DeliveryBackend):
+    """
+    Deliver directly to browser push services with VAPID, bypassing FCM
+
+    Tokens are serialized ``PushSubscription`` objects (the JSON from
+    ``pushManager.subscribe()``). Each message is a separate HTTP request to
+    the subscription's push service, so the dispatcher runs several batches
+    at once; they share one pooled ``requests`` session.
+    """
+
+    name = 'webpush'
+    max_batch_size = 100
+
+    def __init__(self, vapid_private_key=None, vapid_subject=None, ttl=86400, max_concurrency=8, timeout=10):
+        try:
+            import pywebpush
+            import requests
+        except ImportError:
+            raise ImproperlyConfigured('WebPushBackend requires pywebpush (pip install pywebpush)')
+
+        self.vapid_private_key = vapid_private_key or getattr(settings, 'WEBPUSH_VAPID_PRIVATE_KEY', None)
+        self.vapid_subject = vapid_subject or getattr(settings, 'WEBPUSH_VAPID_SUBJECT', None)
+        if not self.vapid_private_key or not self.vapid_subject:
+            raise ImproperlyConfigured(
+                'WebPushBackend needs WEBPUSH_VAPID_PRIVATE_KEY and WEBPUSH_VAPID_SUBJECT (mailto: or https: URL)'
+            )
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._webpush = pywebpush.webpush
+        self._webpush_error = pywebpush.WebPushException
+        self._session = requests.Session()
+
+    def build_message(self, token, title, body, priority='high', notification_id=None, collapse_key=None,
+                      ttl=None):
+        try:
+            subscription = json.loads(token)
+        except ValueError:
+            subscription = None
+        if not isinstance(subscription, dict) or 'endpoint' not in subscription or 'keys' not in subscription:
+            raise ValueError('Web Push token must be a PushSubscription JSON object')
+        payload = {'notification': {'title': title, 'body': body}}
+        if notification_id is not None:
+            payload['data'] = {'notification_id': str(notification_id)}
+        headers = {'Urgency': 'high' if priority == 'high' else 'normal'}
+        if collapse_key:
+            headers['Topic'] = web_push_topic(collapse_key)
+        return {
+            'subscription_info': subscription,
+            'data': json.dumps(payload),
+            'headers': headers,
+            'ttl': self.ttl if ttl is None else min(ttl, self.ttl),
+        }
+
+    def _send(self, message):
+        try:
+            response = self._webpush(
+                subscription_info=message['subscription_info'],
+                data=message['data'],
+                vapid_private_key=self.vapid_private_key,
+                # webpush() adds aud/exp to the claims it is given, so pass a fresh dict
+                vapid_claims={'sub': self.vapid_subject},
+                ttl=message['ttl'],
+                timeout=self.timeout,
+                headers=message['headers'],
+                requests_session=self._session,
+            )
+        except self._webpush_error as e:
+            status = getattr(e.response, 'status_code', None)
+            if status in (404, 410):
+                return {
+                    'success': False,
+                    'error': 'Push subscription is no longer valid'
+                }
+            return {
+                'success': False,
+                'error': str(e),
+                'transient': status is None or status >= 500 or status == 429
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'transient': True
+            }
+        return {
+            'success': True,
+            'messageId': response.headers.get('Location', ''),
+            'sent_at': timezone.now()
+        }
+
+    def send_batch(self, messages):
+        return [self._send(message) for message in messages]
+
+
+class MemoryBackend(DeliveryBackend):
+    """Record messages in ``outbox`` instead of delivering them"""
+
+    name = 'memory'
+    max_batch_size = None
+
+    def __init__(self):
+        self.outbox = []
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def build_message(self, token, title, body, priority='high', notification_id=None, collapse_key=None,
+                      ttl=None):
+        return {
+            'token': token, 'title': title, 'body': body, 'priority': priority,
+            'notification_id': notification_id, 'collapse_key': collapse_key, 'ttl': ttl,
+        }
+
+    def _store(self, messages, sent_at):
+        self.outbox.extend(messages)
+
+    def send_batch(self, messages):
+        results = []
+        with self._lock:
+            sent_at = timezone.now()
+            self._store(messages, sent_at)
+            for _ in messages:
+                self.sent += 1
+                results.append({
+                    'success': True,
+                    'messageId': f'{self.name}/{self.sent}',
+                    'sent_at': sent_at
+                })
+        return results
+
+
+class FileBackend(MemoryBackend):
+    """Append messages to an NDJSON file instead of delivering them"""
+
+    name = 'file'
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path or getattr(settings, 'NOTIFICATION_FILE_BACKEND_PATH', 'sent_notifications.ndjson')
+
+    def _store(self, messages, sent_at):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for message in messages:
+                f.write(json.dumps({**message, 'sent_at': sent_at.isoformat()}, ensure_ascii=False) + '\n')
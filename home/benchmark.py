@@ -0,0 +1,252 @@
+"""
+Helpers for offline dispatcher benchmarks
+
+Provides an in-process stand-in for ``firebase_admin.messaging.send`` and
+``send_each`` with configurable latency and error rates, a loopback HTTP
+stand-in for the FCM v1 API built on it, plus seeding and query counting
+utilities used by the ``benchmark_dispatch`` management command.
+"""
+
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import firebase_admin
+from firebase_admin import exceptions, messaging
+from django.db import connection
+from django.utils import timezone
+
+from .models import NotificationContent, ScheduledNotification, UserFCMToken
+
+
+class FakeFCM:
+    """Drop-in replacement for ``messaging.send``/``send_each`` that never leaves the process"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0,
+                 unregistered_rate=0.0, seed=None):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.error_rate = error_rate
+        self.unregistered_rate = unregistered_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def __call__(self, message, dry_run=False):
+        with self._lock:
+            self.calls += 1
+            call_id = self.calls
+            roll = self._random.random()
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+        if delay:
+            time.sleep(delay)
+
+        if roll < self.unregistered_rate:
+            self._count_error()
+            raise messaging.UnregisteredError('Requested entity was not found.')
+        if roll < self.unregistered_rate + self.error_rate:
+            self._count_error()
+            raise exceptions.UnavailableError('The service is currently unavailable.')
+
+        return f'projects/benchmark/messages/{call_id}'
+
+    def send_each(self, messages, dry_run=False, app=None):
+        """Stand-in for ``messaging.send_each``, sending in parallel like the SDK does"""
+        def send(message):
+            try:
+                return messaging.SendResponse({'name': self(message, dry_run)}, exception=None)
+            except exceptions.FirebaseError as e:
+                return messaging.SendResponse(None, exception=e)
+
+        if not messages:
+            return messaging.BatchResponse([])
+        if self.latency or self.jitter:
+            with ThreadPoolExecutor(max_workers=len(messages)) as executor:
+                return messaging.BatchResponse(list(executor.map(send, messages)))
+        return messaging.BatchResponse([send(message) for message in messages])
+
+    def _count_error(self):
+        with self._lock:
+            self.errors += 1
+
+    @contextmanager
+    def installed(self):
+        """Patch the Admin SDK so every send goes through this fake"""
+        apps_patch = mock.patch.dict(firebase_admin._apps)
+        send_each_patch = mock.patch.object(messaging, 'send_each', self.send_each)
+        with apps_patch, mock.patch.object(messaging, 'send', self), send_each_patch:
+            if not firebase_admin._apps:
+                # The service refuses to send without an initialized app
+                firebase_admin._apps[firebase_admin._DEFAULT_APP_NAME] = object()
+            yield self
+
+
+class _StandInHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections when a client opens its whole pool at once
+    request_queue_size = 1024
+
+
+class FakeFCMServer:
+    """
+    Local stand-in for the FCM HTTP v1 endpoint, answering through a ``FakeFCM``
+
+    Serves ``POST /v1/projects/<project>/messages:send`` on a loopback port
+    with the same latency and error behaviour as the in-process fake, and
+    counts requests and TCP connections so connection reuse can be checked.
+    Use as a context manager; ``base_url`` points ``FCMHttpV1Service`` at it.
+    """
+
+    def __init__(self, fake=None, host='127.0.0.1', port=0):
+        self.fake = fake or FakeFCM()
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self.server = _StandInHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _count(self, attribute):
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+    def _handler_class(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; avoid Nagle/delayed-ACK stalls on keep-alive
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                stand_in._count('connections')
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _error(self, status, code, message, error_code=None):
+                error = {'code': status, 'message': message, 'status': code}
+                if error_code:
+                    error['details'] = [{
+                        '@type': 'type.googleapis.com/google.firebase.fcm.v1.FcmError',
+                        'errorCode': error_code,
+                    }]
+                self._reply(status, {'error': error})
+
+            def do_POST(self):
+                stand_in._count('requests')
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if not self.path.endswith('/messages:send'):
+                    return self._error(404, 'NOT_FOUND', 'Unknown endpoint')
+                if not self.headers.get('Authorization', '').startswith('Bearer '):
+                    return self._error(401, 'UNAUTHENTICATED', 'Missing access token')
+                if 'token' not in payload.get('message', {}):
+                    return self._error(400, 'INVALID_ARGUMENT', 'Message has no token', 'INVALID_ARGUMENT')
+                try:
+                    name = stand_in.fake(payload)
+                except messaging.UnregisteredError:
+                    return self._error(404, 'NOT_FOUND', 'Requested entity was not found.', 'UNREGISTERED')
+                except exceptions.FirebaseError as e:
+                    return self._error(503, 'UNAVAILABLE', str(e), 'UNAVAILABLE')
+                self._reply(200, {'name': name})
+
+        return Handler
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class QueryCounter:
+    """Count queries and their total duration on the default connection"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+    @contextmanager
+    def capture(self):
+        with connection.execute_wrapper(self):
+            yield self
+
+
+def seed_notifications(count, token_count=1000, chunk_size=5000, due=True):
+    """Bulk-create tokens and ``count`` scheduled notifications"""
+    now = timezone.now()
+    UserFCMToken.objects.bulk_create(
+        [
+            UserFCMToken(token=f'benchmark-token-{i:08d}', user_agent='benchmark')
+            for i in range(token_count)
+        ],
+        batch_size=chunk_size,
+    )
+    token_ids = list(
+        UserFCMToken.objects.filter(user_agent='benchmark').values_list('id', flat=True)
+    )
+    priorities = [choice for choice, _ in ScheduledNotification.PRIORITY_CHOICES]
+
+    # A handful of distinct payloads, like real campaign traffic
+    payloads = [(f'Benchmark notification {i}', 'Offline dispatch benchmark payload') for i in range(50)]
+    content_ids = list(NotificationContent.objects.intern_many(payloads).values())
+
+    created = 0
+    while created < count:
+        size = min(chunk_size, count - created)
+        ScheduledNotification.objects.bulk_create(
+            [
+                ScheduledNotification(
+                    content_id=content_ids[(created + i) % len(content_ids)],
+                    fcm_token_id=token_ids[(created + i) % len(token_ids)],
+                    scheduled_at=now - timedelta(seconds=(created + i) % 3600) if due
+                    else now + timedelta(days=1),
+                    priority=priorities[(created + i) % len(priorities)],
+                )
+                for i in range(size)
+            ],
+            batch_size=chunk_size,
+        )
+        created += size
+    return created
+
+
+def reset_notifications():
+    """Remove rows created by a previous benchmark round"""
+    # Plain set-based deletes; the ORM collector would load every row first
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {ScheduledNotification._meta.db_table}')
+        cursor.execute(f'DELETE FROM {UserFCMToken._meta.db_table}')
+        cursor.execute(f'DELETE FROM {NotificationContent._meta.db_table}')
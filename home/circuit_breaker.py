@@ -0,0 +1,153 @@
+"""
+Circuit breaker for the delivery path
+
+When the push provider (or our egress to it) degrades, every send waits out
+its timeout and fails. The breaker watches the outcome of sends over a
+sliding time window and opens once the share of transient failures (result
+dicts with ``'transient': True``: timeouts, connection errors, 5xx and
+quota responses) crosses ``failure_rate``. While open, the dispatcher stops
+sending and leaves due rows pending. After ``reset_timeout`` seconds it goes
+half-open and lets one probe of ``probe_size`` messages through: a healthy
+probe closes it again, a failing one reopens it.
+
+Per-token failures such as unregistered tokens count as healthy calls, since
+the provider answered. State is kept per process and per backend, which
+covers the long-running dispatcher loop and each web worker.
+"""
+
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .metrics import circuit_breaker_state, circuit_breaker_transitions
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Return the process-wide breaker for the backend called ``name``"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            options = dict(getattr(settings, 'CIRCUIT_BREAKER', {}))
+            breaker = _breakers[name] = CircuitBreaker(name, **options)
+        return breaker
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker driven by the error rate of recent sends
+
+    Args:
+        name: Backend name, used for metrics labels
+        failure_rate: Share of transient failures in the window that opens the breaker
+        min_calls: Calls the window must hold before the rate is trusted
+        window: Seconds of history the rate is computed over
+        reset_timeout: Seconds the breaker stays open before probing
+        probe_size: Most messages sent in one half-open probe
+        enabled: When False the breaker always stays closed
+    """
+
+    def __init__(self, name='default', failure_rate=0.5, min_calls=20, window=30.0,
+                 reset_timeout=30.0, probe_size=10, enabled=True, clock=time.monotonic):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.probe_size = probe_size
+        self.enabled = enabled
+        self.clock = clock
+        self.trips = 0
+        self._state = CLOSED
+        self._opened_at = None
+        self._probing = False
+        self._calls = deque()
+        self._lock = threading.Lock()
+        circuit_breaker_state.set(STATE_VALUES[CLOSED], backend=self.name)
+
+    def _transition(self, state):
+        self._state = state
+        self._probing = False
+        if state == OPEN:
+            self._opened_at = self.clock()
+            self.trips += 1
+        elif state == CLOSED:
+            self._calls.clear()
+        circuit_breaker_state.set(STATE_VALUES[state], backend=self.name)
+        circuit_breaker_transitions.inc(backend=self.name, state=state)
+
+    def _current_state(self):
+        if self._state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _window_totals(self):
+        cutoff = self.clock() - self.window
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+        calls = sum(total for _, total, _ in self._calls)
+        failures = sum(failed for _, _, failed in self._calls)
+        return calls, failures
+
+    def allow(self):
+        """Whether a send may go out now; in half-open only one probe at a time"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, calls, failures):
+        """Record the outcome of an allowed send of ``calls`` messages, ``failures`` of them transient"""
+        if not self.enabled or not calls:
+            return
+        with self._lock:
+            state = self._current_state()
+            if state == HALF_OPEN:
+                self._transition(OPEN if failures / calls >= self.failure_rate else CLOSED)
+                return
+            self._calls.append((self.clock(), calls, failures))
+            if state == CLOSED:
+                total, failed = self._window_totals()
+                if total >= self.min_calls and failed / total >= self.failure_rate:
+                    self._transition(OPEN)
+
+    def reset(self):
+        with self._lock:
+            self._transition(CLOSED)
+
+    def snapshot(self):
+        """Current state for stats endpoints and command output"""
+        with self._lock:
+            state = self._current_state()
+            calls, failures = self._window_totals()
+            retry_in = None
+            if state == OPEN:
+                retry_in = round(max(0.0, self._opened_at + self.reset_timeout - self.clock()), 1)
+        return {
+            'state': state,
+            'calls': calls,
+            'failures': failures,
+            'failure_rate': round(failures / calls, 3) if calls else 0.0,
+            'trips': self.trips,
+            'retry_in': retry_in,
+        }
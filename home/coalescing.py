@@ -0,0 +1,103 @@
+"""
+Coalescing of due notifications per token
+
+When a burst of notifications for one token falls due together, sending
+each of them buzzes the user repeatedly and costs one FCM call apiece. With
+``NOTIFICATION_COALESCE`` enabled, the dispatcher groups the rows of a batch
+that belong together:
+
+- rows with the same token and ``collapse_key`` (when ``collapse_keys`` is on)
+- rows with the same token and one of the configured ``priorities`` and no
+  collapse key
+
+and whose ``scheduled_at`` lie within ``window`` seconds of the group's first
+row. Each group is sent once, as its newest row (``mode='latest'``) or as a
+summary listing the group's titles (``mode='summary'``). Once it is sent,
+the other rows are marked ``collapsed`` with the id of the row that was
+sent; if it fails permanently, they are marked ``failed`` with the same
+error. Rows are only
+grouped within one dispatch batch; sharding keeps a token's rows in one
+process.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+
+MODES = ('latest', 'summary')
+
+
+def get_coalescer():
+    """Coalescer configured by NOTIFICATION_COALESCE, or None when disabled"""
+    options = dict(getattr(settings, 'NOTIFICATION_COALESCE', {}))
+    if not options.pop('enabled', False):
+        return None
+    return Coalescer(**options)
+
+
+class Coalescer:
+    """
+    Group the due notifications of a batch that should go out as one message
+
+    Args:
+        mode: 'latest' sends the newest row of a group, 'summary' a digest of all
+        window: Seconds between the first and last row of a group
+        priorities: Priorities whose rows are coalesced per token
+        collapse_keys: Coalesce rows sharing a token and ``collapse_key``
+        summary_lines: Titles listed in a summary before "+N more"
+    """
+
+    def __init__(self, mode='latest', window=300, priorities=(), collapse_keys=True, summary_lines=5):
+        if mode not in MODES:
+            raise ValueError(f'Coalescing mode must be one of {", ".join(MODES)}')
+        self.mode = mode
+        self.window = timedelta(seconds=window)
+        self.priorities = frozenset(priorities)
+        self.collapse_keys = collapse_keys
+        self.summary_lines = summary_lines
+
+    def group_key(self, notification):
+        """Key of the group ``notification`` may join, or None to always send it alone"""
+        if notification.collapse_key:
+            if self.collapse_keys:
+                return notification.fcm_token_id, 'key', notification.collapse_key
+            return None
+        if notification.priority in self.priorities:
+            return notification.fcm_token_id, 'priority', notification.priority
+        return None
+
+    def group(self, batch):
+        """
+        Split ``batch`` into groups to send as one message each
+
+        Returns:
+            Lists of notifications ordered by (scheduled_at, id), the last one
+            being the row that is sent
+        """
+        groups = []
+        open_groups = {}
+        for notification in sorted(batch, key=lambda n: (n.scheduled_at, n.id)):
+            key = self.group_key(notification)
+            group = open_groups.get(key) if key is not None else None
+            if group is None or notification.scheduled_at - group[0].scheduled_at > self.window:
+                group = [notification]
+                groups.append(group)
+                if key is not None:
+                    open_groups[key] = group
+            else:
+                group.append(notification)
+        return groups
+
+    def payload(self, group):
+        """(title, body) of the message sent for ``group``"""
+        latest = group[-1]
+        if self.mode == 'latest' or len(group) == 1:
+            return latest.title, latest.body
+        titles = []
+        for notification in reversed(group):
+            if notification.title not in titles:
+                titles.append(notification.title)
+        lines = titles[:self.summary_lines]
+        if len(titles) > len(lines):
+            lines.append(f'+{len(titles) - len(lines)} more')
+        return f'{len(group)} new notifications', '\n'.join(lines)
@@ -0,0 +1,205 @@
+"""
+Connection and write handling for code that runs outside the request cycle
+
+Django recycles persistent connections (CONN_MAX_AGE, health checks) and
+returns pooled ones only at the start and end of each request. Long-running
+loops and worker threads have to do the same themselves. Bulk writes from
+background jobs go through ``BatchedWriter`` so they coexist with SQLite's
+single writer lock, and high-volume inserts from requests are collected by a
+``WriteBehindBuffer`` and written in batches off the request path.
+"""
+
+import atexit
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import OperationalError, close_old_connections, connections, transaction
+
+from .metrics import db_flush_latency
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def worker_connections():
+    """
+    Run a worker thread's body with its own database connections
+
+    Django connections are per thread, so every worker gets its own (pooled,
+    when DB_POOL is on). They are closed on exit, which hands pooled
+    connections back instead of leaking one per finished thread.
+    """
+    close_old_connections()
+    try:
+        yield
+    finally:
+        connections.close_all()
+
+
+# One writer per process: in-process writers queue here instead of racing for
+# SQLite's single write lock (and each other's busy timeouts)
+_write_lock = threading.Lock()
+
+
+def is_locked_error(error):
+    return 'database is locked' in str(error) or 'database table is locked' in str(error)
+
+
+class BatchedWriter:
+    """
+    Persist changed rows with ``bulk_update`` through a single serialized writer
+
+    Each ``write()`` is one short transaction, chunked by ``batch_size``, taken
+    under a process-wide lock. If SQLite still reports the database as locked
+    (another process holds the write lock beyond the busy timeout), the
+    transaction is retried with exponential backoff rather than losing the
+    outcome of notifications that were already sent.
+    """
+
+    def __init__(self, model, fields, batch_size=500, retries=5, backoff=0.1):
+        self.model = model
+        self.fields = list(fields)
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.lock_retries = 0
+
+    def write(self, objs):
+        if not objs:
+            return 0
+        attempt = 0
+        while True:
+            try:
+                with _write_lock, transaction.atomic():
+                    return self.model.objects.bulk_update(objs, self.fields, batch_size=self.batch_size)
+            except OperationalError as e:
+                # Inside an outer transaction the whole unit of work has to be retried, not just this write
+                if not is_locked_error(e) or attempt >= self.retries or transaction.get_connection().in_atomic_block:
+                    raise
+                attempt += 1
+                self.lock_retries += 1
+                logger.warning(
+                    'Database locked while writing %d %s rows, retry %d/%d',
+                    len(objs), self.model._meta.model_name, attempt, self.retries
+                )
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+
+class WriteBehindBuffer:
+    """
+    Collect rows in memory and write them in batches from a background thread
+
+    ``add()`` only touches an in-memory dict, so a request that records a row
+    costs no query. A daemon thread flushes the buffer every
+    ``flush_interval`` seconds, or as soon as ``flush_size`` rows are
+    waiting, with one ``write`` call per flush (``bulk_create`` into
+    ``model`` by default); whatever is left is flushed at interpreter exit.
+    With a ``key`` function, rows with the same key coalesce and only the
+    latest one is written. A failed flush puts its rows back for the next
+    attempt. At most ``max_pending`` rows are held, after which ``add()``
+    refuses new ones. Each process (and each forked child) runs its own
+    buffer and thread.
+
+    Rows are lost if the process is killed before a flush, so this is for
+    data where losing the last ``flush_interval`` seconds is acceptable.
+    """
+
+    def __init__(self, model, flush_size=1000, flush_interval=0.5, max_pending=100000,
+                 batch_size=1000, ignore_conflicts=False, key=None, write=None, name=None):
+        self.model = model
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.ignore_conflicts = ignore_conflicts
+        self.key = key
+        self.write = write or self._bulk_create
+        self.name = name or model._meta.db_table
+        self.flushes = 0
+        self.written = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._items = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _bulk_create(self, items):
+        self.model.objects.bulk_create(items, batch_size=self.batch_size, ignore_conflicts=self.ignore_conflicts)
+
+    def add(self, obj):
+        """Queue ``obj`` for writing; returns False if the buffer is full"""
+        self._ensure_thread()
+        key = self.key(obj) if self.key else next(self._sequence)
+        with self._lock:
+            if key in self._items:
+                self.coalesced += 1
+            elif len(self._items) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._items[key] = obj
+            full = len(self._items) >= self.flush_size
+        if full:
+            self._wake.set()
+        return True
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked child inherits the parent's rows, which the parent writes itself
+                self._items = {}
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=f'write-behind-{self.name}', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception('Write-behind flush of %s failed', self.name)
+
+    def flush(self):
+        """Write everything queued so far; returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._items = self._items, {}
+            if not pending:
+                return 0
+            items = list(pending.values())
+            start = time.perf_counter()
+            try:
+                with _write_lock, transaction.atomic():
+                    self.write(items)
+            except Exception as e:
+                with self._lock:
+                    # Rows queued since the flush began are newer and win
+                    restored = [(key, obj) for key, obj in pending.items() if key not in self._items]
+                    room = max(0, self.max_pending - len(self._items))
+                    self._items = {**dict(restored[:room]), **self._items}
+                    self.dropped += len(restored) - len(restored[:room])
+                logger.warning(
+                    'Could not write %d buffered %s rows, retrying on the next flush: %s',
+                    len(items), self.name, e
+                )
+                return 0
+            db_flush_latency.observe(time.perf_counter() - start, operation=f'write_behind_{self.name}')
+            self.flushes += 1
+            self.written += len(items)
+            return len(items)
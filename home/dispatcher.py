@@ -0,0 +1,457 @@
+"""
+Dispatch loop for scheduled notifications
+
+``NotificationDispatcher`` picks up due notifications in batches and runs
+each batch through four phases: ``query`` (fetch due rows), ``build``
+(construct messages for the delivery backend), ``send`` (deliver them in
+chunks sized for the backend) and ``write_back`` (persist the outcome with
+one bulk update through ``BatchedWriter``). Instrumentation such as
+metrics, profiling and SQL tracing is attached through ``DispatchHooks``
+objects instead of being baked into the loop.
+
+Due notifications come from the configured ``NotificationQueue`` (see
+``home.queues``): settled rows are acknowledged to it, and rows left pending
+are released back into it. A dispatcher given a ``shard`` only serves the
+notifications of that shard's tokens (see ``home.sharding``). With a
+``sizer`` (see ``home.adaptive``), batch size and send concurrency follow
+observed latency, errors and backlog instead of staying fixed. With
+``NOTIFICATION_COALESCE`` enabled (see ``home.coalescing``), bursts of due
+rows for one token go out as a single message and the rest are marked
+``collapsed`` (or ``failed`` with the message when it could not be sent).
+
+Rows past their ``expires_at`` (or older than ``NOTIFICATION_MAX_STALENESS``
+when they have none) are not sent: each run first marks them ``expired``
+with one UPDATE, rows that expire during the run are skipped batch by batch,
+and messages that are sent carry the remaining lifetime as their TTL.
+
+Sends go through the backend's ``CircuitBreaker``. While it is open no
+batches are fetched, and rows whose send was refused or failed transiently
+stay pending for a later run instead of being marked failed.
+"""
+
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .backends import get_backend
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN, get_breaker
+from .coalescing import get_coalescer
+from .db import BatchedWriter
+from .metrics import (
+    db_flush_latency, dispatch_batch_size, dispatch_deferred, dispatch_expired, dispatch_phase_latency,
+    record_dispatch, registry
+)
+from .models import NotificationContent, ScheduledNotification
+from .queues import get_queue, queue_item, shard_filter
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('query', 'build', 'send', 'write_back')
+
+EXPIRED_MESSAGE = 'Expired before it could be sent'
+
+
+class DispatchHooks:
+    """Base class for dispatcher hooks; override only what you need"""
+
+    def batch_started(self, batch_number):
+        pass
+
+    def batch_fetched(self, batch_number, notifications):
+        pass
+
+    def phase_finished(self, batch_number, phase, seconds):
+        pass
+
+    def notification_processed(self, notification, result):
+        pass
+
+    def batch_finished(self, batch_number, size):
+        pass
+
+
+class MetricsHook(DispatchHooks):
+    """Feed dispatcher activity into the metrics registry"""
+
+    def __init__(self, source):
+        self.source = source
+
+    def batch_fetched(self, batch_number, notifications):
+        if notifications:
+            dispatch_batch_size.observe(len(notifications), source=self.source)
+
+    def phase_finished(self, batch_number, phase, seconds):
+        dispatch_phase_latency.observe(seconds, phase=phase)
+        if phase == 'write_back':
+            db_flush_latency.observe(seconds, operation='bulk_update')
+
+    def notification_processed(self, notification, result):
+        if result is not None:
+            record_dispatch(notification)
+
+
+class PhaseTimer(DispatchHooks):
+    """Accumulate time spent per dispatch phase"""
+
+    def __init__(self):
+        self.seconds = {phase: 0.0 for phase in PHASES}
+        self.calls = {phase: 0 for phase in PHASES}
+        self.batches = 0
+        self.notifications = 0
+
+    def phase_finished(self, batch_number, phase, seconds):
+        self.seconds[phase] += seconds
+        self.calls[phase] += 1
+
+    def batch_finished(self, batch_number, size):
+        if size:
+            self.batches += 1
+            self.notifications += size
+
+    def summary_lines(self):
+        total = sum(self.seconds.values()) or 1.0
+        lines = [f'{"phase":<12} {"seconds":>10} {"share":>7} {"ms/notif":>9}']
+        for phase in PHASES:
+            seconds = self.seconds[phase]
+            per_notification = seconds * 1000 / self.notifications if self.notifications else 0.0
+            lines.append(
+                f'{phase:<12} {seconds:>10.4f} {seconds / total:>6.1%} {per_notification:>9.3f}'
+            )
+        lines.append(f'{"total":<12} {sum(self.seconds.values()):>10.4f}')
+        return lines
+
+
+class SqlTraceHook(DispatchHooks):
+    """Count and time SQL queries per batch and per phase"""
+
+    def __init__(self, report=None):
+        self.report = report or logger.info
+        self._stack = None
+        self._reset()
+
+    def _reset(self):
+        self.count = 0
+        self.duration = 0.0
+        self.by_phase = {}
+        self._phase_mark = (0, 0.0)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+    def batch_started(self, batch_number):
+        self._reset()
+        self._stack = ExitStack()
+        self._stack.enter_context(connection.execute_wrapper(self))
+
+    def phase_finished(self, batch_number, phase, seconds):
+        count, duration = self._phase_mark
+        self.by_phase[phase] = (self.count - count, self.duration - duration)
+        self._phase_mark = (self.count, self.duration)
+
+    def batch_finished(self, batch_number, size):
+        if self._stack is not None:
+            self._stack.close()
+            self._stack = None
+        phases = ', '.join(
+            f'{phase}={count}q/{duration * 1000:.1f}ms'
+            for phase, (count, duration) in self.by_phase.items()
+        )
+        self.report(
+            f'batch {batch_number}: {size} notifications, {self.count} queries '
+            f'in {self.duration * 1000:.1f}ms ({phases})'
+        )
+
+
+class NotificationDispatcher:
+    """Send due notifications in batches and record the outcome"""
+
+    # Upper bound on cached payloads; content rows are immutable, so entries never go stale
+    CONTENT_CACHE_SIZE = 10000
+
+    def __init__(self, service=None, hooks=(), dry_run=False, source='command', breaker=None, queue=None,
+                 shard=None, sizer=None, coalescer=None):
+        self.service = service or get_backend()
+        self.breaker = breaker or get_breaker(self.service.name)
+        self.queue = queue or get_queue()
+        # None when NOTIFICATION_COALESCE is disabled: every row is sent on its own
+        self.coalescer = coalescer or get_coalescer()
+        # Lifetime of rows without expires_at (None: they never expire)
+        staleness = getattr(settings, 'NOTIFICATION_MAX_STALENESS', 0)
+        self.max_staleness = timedelta(seconds=staleness) if staleness else None
+        # (index, count): only notifications with fcm_token_id % count == index
+        self.shard = shard
+        self.dry_run = dry_run
+        # AdaptiveBatchSizer (or None for the fixed batch_size / max_concurrency)
+        self.sizer = sizer
+        self.hooks = [MetricsHook(source)] + list(hooks)
+        if sizer is not None:
+            self.hooks.append(sizer)
+        self.writer = BatchedWriter(ScheduledNotification, ['status', 'sent_at', 'error_message'])
+        self._contents = {}
+
+    def _notify(self, method, *args):
+        for hook in self.hooks:
+            getattr(hook, method)(*args)
+
+    @contextmanager
+    def _phase(self, batch_number, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._notify('phase_finished', batch_number, phase, time.perf_counter() - start)
+
+    def attach_contents(self, batch):
+        """Resolve shared payloads for a batch with at most one query"""
+        missing = {n.content_id for n in batch} - self._contents.keys()
+        if missing:
+            if len(self._contents) + len(missing) > self.CONTENT_CACHE_SIZE:
+                self._contents.clear()
+            self._contents.update(NotificationContent.objects.in_bulk(missing))
+        for notification in batch:
+            notification.content = self._contents[notification.content_id]
+
+    def _send_chunk(self, chunk):
+        if not self.breaker.allow():
+            return [{'success': False, 'error': 'Circuit breaker open', 'deferred': True} for _ in chunk]
+        try:
+            results = self.service.send_batch(chunk)
+        except Exception as e:
+            results = [{'success': False, 'error': str(e), 'transient': True} for _ in chunk]
+        self.breaker.record(len(results), sum(1 for result in results if result.get('transient')))
+        return results
+
+    def send_messages(self, messages):
+        """
+        Send built messages in chunks sized for the backend
+
+        Chunks hold at most ``max_batch_size`` messages and up to
+        ``max_concurrency`` of them are sent at once. Entries of ``messages``
+        that are exceptions (failed builds) become failed results without
+        being sent; chunks the circuit breaker refuses come back as
+        ``deferred`` results.
+        """
+        results = [None] * len(messages)
+        sendable = []
+        for index, message in enumerate(messages):
+            if isinstance(message, Exception):
+                results[index] = {'success': False, 'error': str(message)}
+            else:
+                sendable.append(index)
+
+        size = self.service.max_batch_size or len(sendable) or 1
+        chunks = [sendable[i:i + size] for i in range(0, len(sendable), size)]
+
+        def send(chunk):
+            return self._send_chunk([messages[index] for index in chunk])
+
+        concurrency = self.sizer.concurrency if self.sizer else self.service.max_concurrency
+        workers = min(concurrency, len(chunks))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                chunk_results = list(executor.map(send, chunks))
+        else:
+            chunk_results = [send(chunk) for chunk in chunks]
+
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            for index, result in zip(chunk, chunk_result):
+                results[index] = result
+        return results
+
+    def run(self, limit=None, batch_size=None):
+        """
+        Dispatch up to ``limit`` due notifications (all when ``None``)
+
+        Returns:
+            Dictionary with processed, sent, failed, collapsed, expired,
+            deferred and batches counts and the circuit breaker state
+        """
+        now = timezone.now()
+        batch_size = batch_size or limit or 500
+        summary = {
+            'processed': 0, 'sent': 0, 'failed': 0, 'collapsed': 0, 'expired': 0, 'deferred': 0, 'batches': 0,
+        }
+        if not self.dry_run:
+            summary['expired'] = self.expire_stale(now)
+
+        while limit is None or summary['processed'] < limit:
+            state = self.breaker.state
+            if state == OPEN and not self.dry_run:
+                break
+            cap = None if limit is None else limit - summary['processed']
+            if state == HALF_OPEN and not self.dry_run:
+                cap = self.breaker.probe_size if cap is None else min(cap, self.breaker.probe_size)
+            if self.sizer:
+                # The sizer records the capped size, so a short fetch is not read as idle
+                size = self.sizer.next_batch_size(cap)
+            else:
+                size = batch_size if cap is None else min(batch_size, cap)
+            deferred = summary['deferred']
+            processed = self._run_batch(summary['batches'] + 1, now, size, summary)
+            if not processed:
+                break
+            summary['batches'] += 1
+            # Dry runs and deferred rows stay pending, so the next query would return them again
+            if self.dry_run or summary['deferred'] > deferred:
+                break
+
+        summary['circuit_breaker'] = self.breaker.state
+        # Publish this run's metrics to other processes' /metrics (NOTIFICATION_METRICS_DIR)
+        registry.write_snapshot(force=True)
+        return summary
+
+    def expiry(self, notification):
+        """When ``notification`` stops being worth sending, or None"""
+        if notification.expires_at is not None:
+            return notification.expires_at
+        if self.max_staleness is not None:
+            return notification.scheduled_at + self.max_staleness
+        return None
+
+    def expire_stale(self, now):
+        """
+        Mark every pending row past its expiry as expired with one UPDATE
+
+        The rows are not loaded; queues drop their entries when they next
+        come up, since they are no longer pending.
+
+        Returns:
+            Number of rows expired
+        """
+        stale = Q(expires_at__lte=now)
+        if self.max_staleness is not None:
+            stale |= Q(expires_at__isnull=True, scheduled_at__lte=now - self.max_staleness)
+        queryset = shard_filter(ScheduledNotification.objects.filter(stale, status='pending'), self.shard)
+        expired = queryset.update(status='expired', error_message=EXPIRED_MESSAGE)
+        if expired:
+            dispatch_expired.inc(expired, backend=self.service.name)
+            logger.info('Expired %d stale notifications without sending them', expired)
+        return expired
+
+    def _run_batch(self, batch_number, now, size, summary):
+        self._notify('batch_started', batch_number)
+        batch = []
+        try:
+            with self._phase(batch_number, 'query'):
+                batch = self.queue.fetch_due(now, size, self.shard)
+                self.attach_contents(batch)
+            self._notify('batch_fetched', batch_number, batch)
+            if not batch:
+                return 0
+
+            if self.dry_run:
+                for notification in batch:
+                    self._notify('notification_processed', notification, None)
+                self._release(batch)
+                summary['processed'] += len(batch)
+                summary['sent'] += len(batch)
+                return len(batch)
+
+            settled = []
+            with self._phase(batch_number, 'build'):
+                # Rows that expired since the run started are settled without sending
+                build_time = timezone.now()
+                live = []
+                for notification in batch:
+                    expiry = self.expiry(notification)
+                    if expiry is not None and expiry <= build_time:
+                        notification.status = 'expired'
+                        notification.error_message = EXPIRED_MESSAGE
+                        result = {'success': False, 'expired': True, 'error': EXPIRED_MESSAGE}
+                        settled.append((notification, result))
+                    else:
+                        live.append(notification)
+                if settled:
+                    summary['expired'] += len(settled)
+                    dispatch_expired.inc(len(settled), backend=self.service.name)
+
+                # The last row of each group is sent on behalf of the whole group
+                groups = self.coalescer.group(live) if self.coalescer else [[n] for n in live]
+                messages = []
+                for group in groups:
+                    notification = group[-1]
+                    title, body = (
+                        self.coalescer.payload(group) if len(group) > 1
+                        else (notification.title, notification.body)
+                    )
+                    expiry = self.expiry(notification)
+                    try:
+                        messages.append(self.service.build_message(
+                            notification.fcm_token.token,
+                            title,
+                            body,
+                            notification.priority,
+                            notification_id=notification.id,
+                            collapse_key=notification.collapse_key,
+                            ttl=math.ceil((expiry - build_time).total_seconds()) if expiry is not None else None
+                        ))
+                    except Exception as e:
+                        messages.append(e)
+
+            with self._phase(batch_number, 'send'):
+                results = self.send_messages(messages)
+
+            breaker_closed = self.breaker.state == CLOSED
+            deferred = []
+            for group, result in zip(groups, results):
+                notification = group[-1]
+                if result['success']:
+                    notification.status = 'sent'
+                    notification.sent_at = result.get('sent_at', timezone.now())
+                    summary['sent'] += 1
+                elif result.get('deferred') or (result.get('transient') and not breaker_closed):
+                    # Left pending: the outage is not the notification's fault
+                    deferred.extend(group)
+                    continue
+                else:
+                    notification.status = 'failed'
+                    notification.error_message = result.get('error', 'Unknown error')
+                    summary['failed'] += 1
+                for member in group[:-1]:
+                    if result['success']:
+                        member.status = 'collapsed'
+                        member.error_message = f'Collapsed into notification {notification.id}'
+                        summary['collapsed'] += 1
+                        settled.append((member, {'success': False, 'collapsed': True, 'error': member.error_message}))
+                    else:
+                        # The group's message was never delivered, so its members failed with it
+                        member.status = 'failed'
+                        member.error_message = notification.error_message
+                        summary['failed'] += 1
+                        settled.append((member, {'success': False, 'grouped': True, 'error': member.error_message}))
+                settled.append((notification, result))
+            if deferred:
+                summary['deferred'] += len(deferred)
+                dispatch_deferred.inc(len(deferred), backend=self.service.name)
+                self._release(deferred)
+
+            with self._phase(batch_number, 'write_back'):
+                self.writer.write([notification for notification, _ in settled])
+            self.queue.ack([notification.id for notification, _ in settled])
+
+            summary['processed'] += len(settled)
+            for notification, result in settled:
+                self._notify('notification_processed', notification, result)
+            return len(batch)
+        except BaseException:
+            # Whatever was claimed goes back; rows already written are skipped on the next claim
+            self._release(batch)
+            raise
+        finally:
+            self._notify('batch_finished', batch_number, len(batch))
+
+    def _release(self, notifications):
+        self.queue.release([queue_item(notification) for notification in notifications])
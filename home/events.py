@@ -0,0 +1,64 @@
+"""
+Delivery receipts and clicks reported by the service worker
+
+Every displayed and clicked notification pings the API, so events are not
+written one row per request: ``record_event()`` appends them to a
+process-wide ``WriteBehindBuffer`` that inserts them into
+``notification_events`` with one ``bulk_create`` every
+``NOTIFICATION_EVENTS_FLUSH_INTERVAL_MS`` milliseconds or every
+``NOTIFICATION_EVENTS_FLUSH_SIZE`` events, whichever comes first.
+"""
+
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+
+from .db import WriteBehindBuffer
+from .metrics import notification_events
+from .models import NotificationEvent
+
+EVENT_TYPES = tuple(choice for choice, _ in NotificationEvent.EVENT_CHOICES)
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_event_buffer():
+    """Return the process-wide event buffer, configured from settings"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = WriteBehindBuffer(
+                    NotificationEvent,
+                    flush_size=getattr(settings, 'NOTIFICATION_EVENTS_FLUSH_SIZE', 1000),
+                    flush_interval=getattr(settings, 'NOTIFICATION_EVENTS_FLUSH_INTERVAL_MS', 500) / 1000,
+                    max_pending=getattr(settings, 'NOTIFICATION_EVENTS_MAX_PENDING', 100000),
+                    # Service workers retry; the unique (notification_id, event) constraint drops repeats
+                    ignore_conflicts=True,
+                )
+    return _buffer
+
+
+def record_event(notification_id, event):
+    """
+    Queue a receipt or click for ``notification_id``
+
+    Returns:
+        False if the buffer is full and the event was dropped
+    """
+    if event not in EVENT_TYPES:
+        raise ValueError(f'Unknown notification event: {event}')
+    accepted = get_event_buffer().add(NotificationEvent(
+        notification_id=notification_id,
+        event=event,
+        occurred_at=timezone.now(),
+    ))
+    notification_events.inc(event=event, outcome='accepted' if accepted else 'dropped')
+    return accepted
+
+
+def flush_events():
+    """Write queued events now (tests, benchmarks, shutdown hooks)"""
+    return get_event_buffer().flush()
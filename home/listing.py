@@ -0,0 +1,120 @@
+"""
+Keyset-paginated listing of scheduled notifications
+
+Pages are ordered by ``(scheduled_at, id)`` and each page starts right after
+the last row of the previous one (``WHERE scheduled_at >= ? AND (scheduled_at
+> ? OR id > ?)``) instead of skipping ``OFFSET`` rows, so page 10,000 costs the
+same index range scan as page 1. The position is handed to clients as an
+opaque cursor string; only the columns the listing shows are selected.
+"""
+
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+from .api import dumps, loads
+from .models import ScheduledNotification, UserFCMToken
+
+LIST_COLUMNS = (
+    'id', 'fcm_token_id', 'title', 'priority', 'status',
+    'scheduled_at', 'sent_at', 'error_message',
+)
+_SOURCE_FIELDS = (
+    'id', 'fcm_token_id', 'content__title', 'priority', 'status',
+    'scheduled_at', 'sent_at', 'error_message',
+)
+ORDERS = ('asc', 'desc')
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+STATUSES = tuple(choice for choice, _ in ScheduledNotification.STATUS_CHOICES)
+PRIORITIES = tuple(choice for choice, _ in ScheduledNotification.PRIORITY_CHOICES)
+
+
+def encode_cursor(order, scheduled_at, pk):
+    """Opaque cursor pointing just past the row ``(scheduled_at, pk)``"""
+    payload = dumps([order, scheduled_at.isoformat(), pk])
+    return base64.urlsafe_b64encode(payload).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return ``(order, scheduled_at, pk)``; raises ValueError for a malformed cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        order, scheduled_at, pk = loads(base64.urlsafe_b64decode(padded))
+        scheduled_at = datetime.fromisoformat(scheduled_at)
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if order not in ORDERS or not isinstance(pk, int) or isinstance(pk, bool):
+        raise ValueError('Invalid cursor')
+    return order, scheduled_at, pk
+
+
+def list_notifications(statuses=None, priorities=None, token=None, since=None, until=None,
+                       cursor=None, limit=DEFAULT_LIMIT, order='asc'):
+    """
+    Return one page of scheduled notifications
+
+    Args:
+        statuses: Only these statuses
+        priorities: Only these priorities
+        token: Only notifications for this FCM token
+        since: scheduled_at lower bound (inclusive)
+        until: scheduled_at upper bound (exclusive)
+        cursor: ``next_cursor`` of the previous page; its order wins over ``order``
+        limit: Rows per page, at most MAX_LIMIT
+        order: 'asc' (oldest first) or 'desc'
+
+    Returns:
+        (rows as dicts keyed by LIST_COLUMNS, cursor for the next page or None)
+    """
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {MAX_LIMIT}')
+    if order not in ORDERS:
+        raise ValueError(f'order must be one of {", ".join(ORDERS)}')
+    for value in statuses or ():
+        if value not in STATUSES:
+            raise ValueError(f'status must be one of {", ".join(STATUSES)}')
+    for value in priorities or ():
+        if value not in PRIORITIES:
+            raise ValueError(f'priority must be one of {", ".join(PRIORITIES)}')
+
+    queryset = ScheduledNotification.objects.all()
+    if statuses:
+        queryset = queryset.filter(status__in=list(statuses))
+    if priorities:
+        queryset = queryset.filter(priority__in=list(priorities))
+    if token:
+        # Resolved through the token digest index, then the fcm_token_id index
+        queryset = queryset.filter(fcm_token__in=UserFCMToken.objects.for_token(token).values('id'))
+    if since:
+        queryset = queryset.filter(scheduled_at__gte=since)
+    if until:
+        queryset = queryset.filter(scheduled_at__lt=until)
+
+    if cursor:
+        order, last_scheduled_at, last_id = decode_cursor(cursor)
+        # The range on scheduled_at alone keeps this an index range scan; the
+        # OR only breaks ties between rows at the same instant
+        if order == 'asc':
+            queryset = queryset.filter(
+                Q(scheduled_at__gt=last_scheduled_at) | Q(id__gt=last_id),
+                scheduled_at__gte=last_scheduled_at,
+            )
+        else:
+            queryset = queryset.filter(
+                Q(scheduled_at__lt=last_scheduled_at) | Q(id__lt=last_id),
+                scheduled_at__lte=last_scheduled_at,
+            )
+
+    ordering = ('scheduled_at', 'id') if order == 'asc' else ('-scheduled_at', '-id')
+    rows = list(queryset.order_by(*ordering).values_list(*_SOURCE_FIELDS)[:limit + 1])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(order, last[5], last[0])
+    return [dict(zip(LIST_COLUMNS, row)) for row in rows], next_cursor
@@ -0,0 +1,260 @@
+"""
+Chunked maintenance operations on the notification tables
+
+Large housekeeping jobs walk the primary key in fixed-size ranges and use
+set-based ``INSERT ... SELECT`` / ``DELETE`` statements, one short
+transaction per range, so they never load rows into Python and never hold
+locks long enough to stall the dispatcher.
+"""
+
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import NotificationContent, NotificationEvent, NotificationHistory, ScheduledNotification, UserFCMToken
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _adapt_datetime(value):
+    return connection.ops.adapt_datetimefield_value(value)
+
+
+def pk_ranges(table, chunk_size):
+    """Yield half-open ``(low, high)`` primary key ranges covering ``table``"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN(id), MAX(id) FROM {_quote(table)}')
+        low, high = cursor.fetchone()
+    if low is None:
+        return
+    while low <= high:
+        yield low, low + chunk_size
+        low += chunk_size
+
+
+def _month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def _next_month(value):
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+def ensure_history_partitions(start, end):
+    """Create monthly notification_history partitions covering [start, end] on PostgreSQL"""
+    if connection.vendor != 'postgresql' or start is None:
+        return []
+
+    created = []
+    month = _month_start(start)
+    with connection.cursor() as cursor:
+        while month <= end:
+            following = _next_month(month)
+            name = f'{NotificationHistory._meta.db_table}_y{month.year}m{month.month:02d}'
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {_quote(name)} '
+                f'PARTITION OF {_quote(NotificationHistory._meta.db_table)} '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+            )
+            created.append(name)
+            month = following
+    return created
+
+
+def _terminal_filter(statuses):
+    placeholders = ', '.join(['%s'] * len(statuses))
+    return f'id >= %s AND id < %s AND status IN ({placeholders}) AND scheduled_at < %s'
+
+
+def archive_notifications(cutoff, chunk_size=5000, sleep=0.0, statuses=None, progress=None):
+    """
+    Move terminal notifications scheduled before ``cutoff`` into notification_history
+
+    Args:
+        cutoff: Aware datetime; rows with an earlier scheduled_at are archived
+        chunk_size: Width of each primary key range
+        sleep: Seconds to pause between chunks
+        statuses: Terminal statuses to archive (default: TERMINAL_STATUSES)
+        progress: Optional callable receiving (low, high, moved) after each chunk
+
+    Returns:
+        Dictionary with the number of archived rows and processed chunks
+    """
+    statuses = list(statuses or NotificationHistory.TERMINAL_STATUSES)
+    source = ScheduledNotification._meta.db_table
+    target = NotificationHistory._meta.db_table
+    columns = [
+        field.column for field in NotificationHistory._meta.concrete_fields
+        if field.column != 'archived_at'
+    ]
+    column_sql = ', '.join(_quote(column) for column in columns)
+    where = _terminal_filter(statuses)
+
+    with connection.cursor() as cursor:
+        placeholders = ', '.join(['%s'] * len(statuses))
+        cursor.execute(
+            f'SELECT MIN(scheduled_at) FROM {_quote(source)} '
+            f'WHERE status IN ({placeholders}) AND scheduled_at < %s',
+            statuses + [_adapt_datetime(cutoff)]
+        )
+        oldest = cursor.fetchone()[0]
+    if oldest is None:
+        return {'archived': 0, 'chunks': 0}
+    if isinstance(oldest, str):
+        oldest = ScheduledNotification._meta.get_field('scheduled_at').to_python(oldest)
+    if timezone.is_naive(oldest):
+        oldest = timezone.make_aware(oldest, dt_timezone.utc)
+    ensure_history_partitions(oldest, cutoff)
+
+    archived_at = _adapt_datetime(timezone.now())
+    adapted_cutoff = _adapt_datetime(cutoff)
+    lock = ' FOR UPDATE' if connection.features.has_select_for_update else ''
+    archived = 0
+    chunks = 0
+    for low, high in pk_ranges(source, chunk_size):
+        params = [low, high] + statuses + [adapted_cutoff]
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Evaluate the filter once and move exactly those rows: a row that
+                # changes status in between is neither lost nor archived twice
+                cursor.execute(f'SELECT id FROM {_quote(source)} WHERE {where}{lock}', params)
+                ids = ', '.join(str(int(row_id)) for row_id, in cursor.fetchall())
+                moved = 0
+                if ids:
+                    cursor.execute(
+                        f'INSERT INTO {_quote(target)} ({column_sql}, archived_at) '
+                        f'SELECT {column_sql}, %s FROM {_quote(source)} WHERE id IN ({ids})',
+                        [archived_at]
+                    )
+                    cursor.execute(f'DELETE FROM {_quote(source)} WHERE id IN ({ids})')
+                    moved = cursor.rowcount
+        archived += moved
+        chunks += 1
+        if progress:
+            progress(low, high, moved)
+        if sleep and moved:
+            time.sleep(sleep)
+
+    return {'archived': archived, 'chunks': chunks}
+
+
+def purge_notifications(model, status, cutoff, chunk_size=5000, sleep=0.0, progress=None):
+    """
+    Delete ``model`` rows with ``status`` scheduled before ``cutoff`` in pk-ranged chunks
+
+    Works for both the dispatch table and the history archive. Returns the
+    number of deleted rows.
+    """
+    table = model._meta.db_table
+    deleted = 0
+    for low, high in pk_ranges(table, chunk_size):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {_quote(table)} '
+                    f'WHERE id >= %s AND id < %s AND status = %s AND scheduled_at < %s',
+                    [low, high, status, _adapt_datetime(cutoff)]
+                )
+                removed = cursor.rowcount
+        deleted += removed
+        if progress:
+            progress(table, low, high, removed)
+        if sleep and removed:
+            time.sleep(sleep)
+    return deleted
+
+
+def purge_notification_events(cutoff, chunk_size=5000, sleep=0.0, progress=None):
+    """Delete receipt and click events recorded before ``cutoff`` in pk-ranged chunks"""
+    table = NotificationEvent._meta.db_table
+    deleted = 0
+    for low, high in pk_ranges(table, chunk_size):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {_quote(table)} WHERE id >= %s AND id < %s AND occurred_at < %s',
+                    [low, high, _adapt_datetime(cutoff)]
+                )
+                removed = cursor.rowcount
+        deleted += removed
+        if progress:
+            progress(table, low, high, removed)
+        if sleep and removed:
+            time.sleep(sleep)
+    return deleted
+
+
+def purge_inactive_tokens(cutoff, chunk_size=5000, sleep=0.0, progress=None):
+    """
+    Delete inactive tokens last updated before ``cutoff`` together with their notifications
+
+    The ``ScheduledNotification.fcm_token`` cascade is applied with set-based
+    deletes per token id range instead of the ORM collector, which would load
+    every dependent row first.
+
+    Returns:
+        Dictionary with the number of deleted tokens, notifications and history rows
+    """
+    tokens = UserFCMToken._meta.db_table
+    token_where = 'id >= %s AND id < %s AND is_active = %s AND updated_at < %s'
+    adapted_cutoff = _adapt_datetime(cutoff)
+    totals = {'tokens': 0, 'notifications': 0, 'history': 0}
+
+    for low, high in pk_ranges(tokens, chunk_size):
+        params = [low, high, False, adapted_cutoff]
+        subquery = f'SELECT id FROM {_quote(tokens)} WHERE {token_where}'
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for key, model in (('notifications', ScheduledNotification), ('history', NotificationHistory)):
+                    cursor.execute(
+                        f'DELETE FROM {_quote(model._meta.db_table)} WHERE fcm_token_id IN ({subquery})',
+                        params
+                    )
+                    totals[key] += cursor.rowcount
+                cursor.execute(f'DELETE FROM {_quote(tokens)} WHERE {token_where}', params)
+                removed = cursor.rowcount
+        totals['tokens'] += removed
+        if progress:
+            progress(tokens, low, high, removed)
+        if sleep and removed:
+            time.sleep(sleep)
+    return totals
+
+
+def purge_unused_contents(created_before, chunk_size=5000, sleep=0.0, progress=None):
+    """
+    Delete shared payloads no longer referenced by any notification or history row
+
+    Contents created at or after created_before are kept, so a payload interned
+    by a writer that has not committed its notification yet is not deleted.
+    """
+    table = NotificationContent._meta.db_table
+    references = ' AND '.join(
+        f'NOT EXISTS (SELECT 1 FROM {_quote(model._meta.db_table)} r WHERE r.content_id = c.id)'
+        for model in (ScheduledNotification, NotificationHistory)
+    )
+    adapted_cutoff = _adapt_datetime(created_before)
+    deleted = 0
+    for low, high in pk_ranges(table, chunk_size):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {_quote(table)} WHERE id IN ('
+                    f'SELECT c.id FROM {_quote(table)} c '
+                    f'WHERE c.id >= %s AND c.id < %s AND c.created_at < %s AND {references})',
+                    [low, high, adapted_cutoff]
+                )
+                removed = cursor.rowcount
+        deleted += removed
+        if progress:
+            progress(table, low, high, removed)
+        if sleep and removed:
+            time.sleep(sleep)
+    return deleted
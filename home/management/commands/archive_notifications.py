@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from home.maintenance import archive_notifications
+from home.models import NotificationHistory, ScheduledNotification
+
+
+class Command(BaseCommand):
+    help = 'Move sent, failed, collapsed and expired notifications older than N days into the notification_history archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=30,
+            help='Archive terminal notifications scheduled more than N days ago (default: 30)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Primary key range moved per transaction (default: 5000)',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.0,
+            help='Seconds to pause between chunks to leave room for the dispatcher (default: 0)',
+        )
+        parser.add_argument(
+            '--status',
+            action='append',
+            choices=NotificationHistory.TERMINAL_STATUSES,
+            help='Only archive this status (repeatable; default: all terminal statuses)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the rows that would be archived',
+        )
+
+    def handle(self, *args, **options):
+        if options['older_than_days'] < 0 or options['chunk_size'] < 1:
+            raise CommandError('--older-than-days must be >= 0 and --chunk-size >= 1')
+
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        statuses = options['status'] or list(NotificationHistory.TERMINAL_STATUSES)
+
+        if options['dry_run']:
+            count = ScheduledNotification.objects.filter(
+                status__in=statuses,
+                scheduled_at__lt=cutoff
+            ).count()
+            self.stdout.write(
+                self.style.WARNING(
+                    f'[DRY RUN] Would archive {count} notifications scheduled before {cutoff:%Y-%m-%d %H:%M}'
+                )
+            )
+            return
+
+        verbosity = options['verbosity']
+
+        def progress(low, high, moved):
+            if verbosity > 1 or moved:
+                self.stdout.write(f'📦 ids [{low}, {high}): archived {moved}')
+
+        self.stdout.write(f'🗄️  Archiving {", ".join(statuses)} notifications scheduled before {cutoff:%Y-%m-%d %H:%M}')
+        result = archive_notifications(
+            cutoff,
+            chunk_size=options['chunk_size'],
+            sleep=options['sleep'],
+            statuses=statuses,
+            progress=progress,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Archived {result["archived"]} notifications in {result["chunks"]} chunks'
+            )
+        )
@@ -0,0 +1,266 @@
+import json
+import os
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from home.adaptive import get_batch_sizer, reset_batch_sizers
+from home.backends import get_backend, override_backend
+from home.benchmark import FakeFCM, FakeFCMServer, QueryCounter, reset_notifications, seed_notifications
+from home.circuit_breaker import get_breaker
+from home.models import ScheduledNotification
+from home.notification_service import FCMHttpV1Service
+from home.queues import DatabaseQueue, MemoryQueue, RedisQueue, override_queue
+
+QUEUES = ('database', 'memory', 'redis')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark send_scheduled_notifications offline against a fake FCM backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10000, 100000, 1000000],
+            help='Numbers of due notifications to seed, one round each (default: 10k 100k 1M)',
+        )
+        parser.add_argument(
+            '--tokens',
+            type=int,
+            default=1000,
+            help='Number of distinct FCM tokens to spread notifications over (default: 1000)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='--limit passed to each send_scheduled_notifications run (default: 1000)',
+        )
+        parser.add_argument('--latency-ms', type=float, default=0.0, help='Fake FCM latency per send')
+        parser.add_argument('--jitter-ms', type=float, default=0.0, help='Extra random latency per send')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of sends failing as UNAVAILABLE')
+        parser.add_argument(
+            '--unregistered-rate',
+            type=float,
+            default=0.0,
+            help='Fraction of sends failing as UNREGISTERED',
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the fake backend')
+        parser.add_argument(
+            '--http-v1',
+            action='store_true',
+            help='Send through FCMHttpV1Service against a local stand-in FCM server instead of the Admin SDK',
+        )
+        parser.add_argument(
+            '--max-connections',
+            type=int,
+            default=10,
+            help='Connection pool size for --http-v1 (default: 10)',
+        )
+        parser.add_argument(
+            '--queue',
+            choices=QUEUES,
+            default='database',
+            help='Queue the dispatcher takes due notifications from (default: database)',
+        )
+        parser.add_argument(
+            '--redis-url',
+            default='redis://localhost:6379/15',
+            help='Redis for --queue redis; the benchmark key is cleared each round',
+        )
+        parser.add_argument(
+            '--adaptive',
+            action='store_true',
+            help='Dispatch with adaptive batching, starting from --batch-size, until nothing is pending',
+        )
+        parser.add_argument(
+            '--no-trace-memory',
+            action='store_true',
+            help='Skip tracemalloc (faster, but peak memory is not reported)',
+        )
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the benchmark database')
+        parser.add_argument('--json', dest='json_path', help='Write results as JSON to this path')
+        parser.add_argument(
+            '--min-throughput',
+            type=float,
+            help='Fail if any round sends fewer messages/sec than this',
+        )
+        parser.add_argument(
+            '--max-queries-per-message',
+            type=float,
+            help='Fail if any round issues more DB queries per message than this',
+        )
+        parser.add_argument(
+            '--max-peak-mb',
+            type=float,
+            help='Fail if any round allocates more than this many MiB at peak',
+        )
+
+    def handle(self, *args, **options):
+        # Never touch the configured database: run against a throwaway copy
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False, keepdb=options['keepdb']
+        )
+        try:
+            results = [self._run_round(size, options) for size in options['sizes']]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        self._report(results)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'📝 Results written to {options["json_path"]}')
+
+        self._check_thresholds(results, options)
+
+    def _run_round(self, size, options):
+        reset_notifications()
+        self.stdout.write(f'🌱 Seeding {size} notifications...')
+        seed_start = time.perf_counter()
+        # Seed without pushing to the configured queue; the round's queue is synced below
+        with override_queue(DatabaseQueue()):
+            seed_notifications(size, token_count=options['tokens'])
+        seed_seconds = time.perf_counter() - seed_start
+        queue = self._build_queue(options)
+        sync_start = time.perf_counter()
+        queue.sync()
+        sync_seconds = time.perf_counter() - sync_start
+
+        fake = FakeFCM(
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            error_rate=options['error_rate'],
+            unregistered_rate=options['unregistered_rate'],
+            seed=options['seed'],
+        )
+        queries = QueryCounter()
+        trace_memory = not options['no_trace_memory']
+
+        self.stdout.write(f'🚀 Dispatching {size} notifications...')
+        with ExitStack() as stack:
+            if options['http_v1']:
+                server = stack.enter_context(FakeFCMServer(fake))
+                backend = FCMHttpV1Service(
+                    project_id='benchmark',
+                    access_token='benchmark',
+                    base_url=server.base_url,
+                    max_connections=options['max_connections'],
+                )
+                stack.callback(backend.close)
+                stack.enter_context(override_backend(backend))
+            else:
+                server = None
+                stack.enter_context(fake.installed())
+            # With --error-rate the breaker would open and leave rows pending; measure raw dispatch instead
+            breaker = get_breaker(get_backend().name)
+            stack.callback(setattr, breaker, 'enabled', breaker.enabled)
+            breaker.enabled = False
+            stack.enter_context(override_queue(queue))
+            elapsed, peak, runs = self._dispatch(options, queries, trace_memory)
+            adaptive = get_batch_sizer(get_backend()).snapshot() if options['adaptive'] else None
+
+        processed = ScheduledNotification.objects.exclude(status='pending').count()
+        return {
+            'size': size,
+            'processed': processed,
+            'sent': ScheduledNotification.objects.filter(status='sent').count(),
+            'failed': ScheduledNotification.objects.filter(status='failed').count(),
+            'runs': runs,
+            'fcm_calls': fake.calls,
+            'http_connections': server.connections if server else None,
+            'queue': queue.name,
+            'adaptive': adaptive,
+            'seed_seconds': round(seed_seconds, 3),
+            'queue_sync_seconds': round(sync_seconds, 3),
+            'dispatch_seconds': round(elapsed, 3),
+            'messages_per_second': round(processed / elapsed, 1) if elapsed else None,
+            'queries': queries.count,
+            'queries_per_message': round(queries.count / processed, 3) if processed else None,
+            'query_seconds': round(queries.duration, 3),
+            'peak_memory_mb': round(peak / (1024 * 1024), 2) if peak is not None else None,
+        }
+
+    def _build_queue(self, options):
+        if options['queue'] == 'memory':
+            return MemoryQueue()
+        if options['queue'] == 'redis':
+            queue = RedisQueue(url=options['redis_url'], key='benchmark:notifications:due')
+            queue.client.delete(*queue.keys, *queue.claimed_keys)
+            return queue
+        return DatabaseQueue()
+
+    def _dispatch(self, options, queries, trace_memory):
+        runs = 0
+        with open(os.devnull, 'w') as devnull, queries.capture():
+            if trace_memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            if options['adaptive']:
+                reset_batch_sizers()
+            while ScheduledNotification.objects.filter(status='pending').exists():
+                if options['adaptive']:
+                    call_command(
+                        'send_scheduled_notifications',
+                        batch_size=options['batch_size'],
+                        adaptive=True,
+                        stdout=devnull,
+                    )
+                else:
+                    call_command(
+                        'send_scheduled_notifications',
+                        limit=options['batch_size'],
+                        stdout=devnull,
+                    )
+                runs += 1
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+            if trace_memory:
+                tracemalloc.stop()
+        return elapsed, peak, runs
+
+    def _report(self, results):
+        self.stdout.write('\n📊 Dispatch benchmark results')
+        header = f'{"rows":>10} {"msg/s":>10} {"queries/msg":>12} {"peak MiB":>10} {"seconds":>10}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for result in results:
+            peak = result['peak_memory_mb']
+            self.stdout.write(
+                f'{result["size"]:>10} {result["messages_per_second"] or 0:>10} '
+                f'{result["queries_per_message"] or 0:>12} '
+                f'{peak if peak is not None else "-":>10} {result["dispatch_seconds"]:>10}'
+            )
+
+    def _check_thresholds(self, results, options):
+        failures = []
+        for result in results:
+            size = result['size']
+            if options['min_throughput'] is not None and \
+                    (result['messages_per_second'] or 0) < options['min_throughput']:
+                failures.append(
+                    f'{size} rows: {result["messages_per_second"]} msg/s < {options["min_throughput"]}'
+                )
+            if options['max_queries_per_message'] is not None and \
+                    (result['queries_per_message'] or 0) > options['max_queries_per_message']:
+                failures.append(
+                    f'{size} rows: {result["queries_per_message"]} queries/msg > '
+                    f'{options["max_queries_per_message"]}'
+                )
+            if options['max_peak_mb'] is not None and result['peak_memory_mb'] is not None and \
+                    result['peak_memory_mb'] > options['max_peak_mb']:
+                failures.append(
+                    f'{size} rows: peak {result["peak_memory_mb"]} MiB > {options["max_peak_mb"]}'
+                )
+
+        if failures:
+            raise CommandError('Benchmark regression:\n' + '\n'.join(failures))
+
+        self.stdout.write(self.style.SUCCESS('✅ Benchmark completed'))
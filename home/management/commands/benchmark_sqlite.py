@@ -0,0 +1,262 @@
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.utils import timezone
+from home.benchmark import seed_notifications
+from home.db import BatchedWriter, worker_connections
+from home.models import ScheduledNotification
+
+# 'default' is what Django and SQLite do out of the box (rollback journal,
+# synchronous=FULL, 5 second busy timeout, deferred transactions); 'wal' is
+# the mode settings.py enables with SQLITE_WAL.
+MODES = {
+    'default': {
+        'init_command': 'PRAGMA journal_mode=DELETE; PRAGMA synchronous=FULL;',
+        'timeout': 5,
+    },
+    'wal': {
+        'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        'timeout': getattr(settings, 'SQLITE_BUSY_TIMEOUT', 20),
+        'transaction_mode': 'IMMEDIATE',
+    },
+}
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index] * 1000
+
+
+def _read(deadline):
+    reads = errors = 0
+    while time.time() < deadline:
+        try:
+            if (reads + errors) % 2:
+                ScheduledNotification.objects.filter(status='pending').count()
+            else:
+                list(ScheduledNotification.objects.filter(
+                    status='pending', scheduled_at__lte=timezone.now()
+                ).order_by('scheduled_at', 'id')[:100])
+            reads += 1
+        except OperationalError:
+            errors += 1
+    return {'reads': reads, 'read_errors': errors}, []
+
+
+def _write_back(deadline, number, ids, options):
+    rng = random.Random(f'{options["seed"]}-writer-{number}')
+    writer = BatchedWriter(ScheduledNotification, ['status', 'sent_at', 'error_message'])
+    latencies = []
+    write_backs = rows = errors = 0
+    while time.time() < deadline:
+        start = rng.randrange(0, len(ids) - options['write_batch'] + 1)
+        now = timezone.now()
+        batch = [
+            ScheduledNotification(id=pk, status='sent', sent_at=now, error_message=None)
+            for pk in ids[start:start + options['write_batch']]
+        ]
+        began = time.perf_counter()
+        try:
+            writer.write(batch)
+            write_backs += 1
+            rows += len(batch)
+            latencies.append(time.perf_counter() - began)
+        except OperationalError:
+            errors += 1
+        time.sleep(options['pause_ms'] / 1000)
+    counts = {
+        'write_backs': write_backs, 'rows_written': rows,
+        'write_errors': errors, 'lock_retries': writer.lock_retries,
+    }
+    return counts, latencies
+
+
+def _insert(deadline, content_id, token_id):
+    inserts = errors = 0
+    while time.time() < deadline:
+        try:
+            ScheduledNotification.objects.create(
+                content_id=content_id,
+                fcm_token_id=token_id,
+                scheduled_at=timezone.now(),
+            )
+            inserts += 1
+        except OperationalError:
+            errors += 1
+    return {'inserts': inserts, 'insert_errors': errors}, []
+
+
+def _worker(queue, role, number, deadline, ids, content_id, token_id, options):
+    with worker_connections():
+        if role == 'reader':
+            report = _read(deadline)
+        elif role == 'writer':
+            report = _write_back(deadline, number, ids, options)
+        else:
+            report = _insert(deadline, content_id, token_id)
+    queue.put(report)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent SQLite reads and writes with and without the WAL concurrency mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modes',
+            nargs='+',
+            choices=list(MODES),
+            default=list(MODES),
+            help='SQLite modes to compare (default: default wal)',
+        )
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per mode (default: 10)')
+        parser.add_argument('--rows', type=int, default=20000, help='Notifications to seed (default: 20000)')
+        parser.add_argument(
+            '--readers',
+            type=int,
+            default=4,
+            help='Reader processes, like status and admin pages (default: 4)',
+        )
+        parser.add_argument(
+            '--writers',
+            type=int,
+            default=1,
+            help='Processes doing dispatcher write-backs through BatchedWriter (default: 1)',
+        )
+        parser.add_argument(
+            '--inserters',
+            type=int,
+            default=1,
+            help='Processes scheduling notifications one row at a time, like the API (default: 1)',
+        )
+        parser.add_argument('--write-batch', type=int, default=500, help='Rows per write-back (default: 500)')
+        parser.add_argument(
+            '--pause-ms',
+            type=float,
+            default=100.0,
+            help='Pause between write-backs, standing in for the FCM sends of a batch (default: 100)',
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Random seed')
+        parser.add_argument('--json', dest='json_path', help='Write results as JSON to this path')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_sqlite only runs against a SQLite database')
+        if options['rows'] < options['write_batch']:
+            raise CommandError('--rows must be at least --write-batch')
+
+        # Workers need a file database; the in-memory test database lives in one process
+        temp_dir = tempfile.mkdtemp(prefix='benchmark-sqlite-')
+        old_name = connection.settings_dict['NAME']
+        old_options = dict(connection.settings_dict['OPTIONS'])
+        connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'benchmark.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            seed_notifications(options['rows'], token_count=100)
+            ids = list(ScheduledNotification.objects.values_list('id', flat=True))
+            content_id, token_id = ScheduledNotification.objects.values_list(
+                'content_id', 'fcm_token_id'
+            ).first()
+            results = []
+            for mode in options['modes']:
+                connection.close()
+                # Worker connections are created from this shared settings dict
+                connection.settings_dict['OPTIONS'] = dict(old_options, **MODES[mode])
+                results.append(self._run_mode(mode, ids, content_id, token_id, options))
+        finally:
+            connection.close()
+            connection.settings_dict['OPTIONS'] = old_options
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            connection.settings_dict['TEST']['NAME'] = None
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        self._report(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'📝 Results written to {options["json_path"]}')
+
+    def _run_mode(self, mode, ids, content_id, token_id, options):
+        self.stdout.write(f'🚀 {mode}: {options["duration"]:g}s with {options["readers"]} readers, '
+                          f'{options["writers"]} writers, {options["inserters"]} inserters...')
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            raise CommandError('benchmark_sqlite needs the fork start method (Linux or macOS)')
+
+        # Separate processes, like the web server, the dispatcher and the admin:
+        # threads would mostly contend on the GIL instead of SQLite's locks
+        connections.close_all()
+        queue = context.Queue()
+        deadline = time.time() + options['duration']
+        roles = (
+            [('reader', i) for i in range(options['readers'])]
+            + [('writer', i) for i in range(options['writers'])]
+            + [('inserter', i) for i in range(options['inserters'])]
+        )
+        processes = [
+            context.Process(
+                target=_worker,
+                args=(queue, role, number, deadline, ids, content_id, token_id, options),
+            )
+            for role, number in roles
+        ]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        reports = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        stats = {
+            'reads': 0, 'read_errors': 0,
+            'write_backs': 0, 'rows_written': 0, 'write_errors': 0, 'lock_retries': 0,
+            'inserts': 0, 'insert_errors': 0,
+        }
+        write_latencies = []
+        for counts, latencies in reports:
+            for key, value in counts.items():
+                stats[key] += value
+            write_latencies.extend(latencies)
+        write_latencies.sort()
+        return {
+            'mode': mode,
+            'seconds': round(elapsed, 2),
+            'reads_per_second': round(stats['reads'] / elapsed, 1),
+            'rows_written_per_second': round(stats['rows_written'] / elapsed, 1),
+            'inserts_per_second': round(stats['inserts'] / elapsed, 1),
+            'write_p99_ms': round(_percentile(write_latencies, 99), 2),
+            'errors': stats['read_errors'] + stats['write_errors'] + stats['insert_errors'],
+            **stats,
+        }
+
+    def _report(self, results):
+        self.stdout.write('\n📊 SQLite concurrency benchmark')
+        header = (
+            f'{"mode":<8} {"reads/s":>9} {"rows w/s":>10} {"inserts/s":>10} '
+            f'{"wb p99 ms":>10} {"retries":>8} {"errors":>7}'
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for r in results:
+            self.stdout.write(
+                f'{r["mode"]:<8} {r["reads_per_second"]:>9} {r["rows_written_per_second"]:>10} '
+                f'{r["inserts_per_second"]:>10} {r["write_p99_ms"]:>10} {r["lock_retries"]:>8} '
+                f'{r["errors"]:>7}'
+            )
+        if any(r['errors'] for r in results):
+            self.stdout.write(self.style.WARNING(
+                '⚠️ Some operations failed with "database is locked", see the errors column'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Benchmark completed'))
@@ -0,0 +1,69 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from home.exports import DATE_FIELDS, EXPORT_FORMATS, export_querysets, parse_datetime_param, stream_export
+from home.models import ScheduledNotification
+
+
+class Command(BaseCommand):
+    help = 'Stream notification delivery results as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson', help='Output format (default: ndjson)')
+        parser.add_argument(
+            '--output',
+            default='-',
+            help='File to write to, or - for stdout (default: -)',
+        )
+        parser.add_argument(
+            '--status',
+            action='append',
+            choices=[choice for choice, _ in ScheduledNotification.STATUS_CHOICES],
+            help='Only export this status (repeatable)',
+        )
+        parser.add_argument('--since', help='Inclusive lower bound on --date-field (ISO 8601)')
+        parser.add_argument('--until', help='Exclusive upper bound on --date-field (ISO 8601)')
+        parser.add_argument(
+            '--date-field',
+            choices=DATE_FIELDS,
+            default='scheduled_at',
+            help='Column the date range applies to (default: scheduled_at)',
+        )
+        parser.add_argument(
+            '--include-history',
+            action='store_true',
+            help='Also export rows moved to the notification_history archive',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows fetched per database round trip (default: 2000)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            querysets = export_querysets(
+                statuses=options['status'],
+                since=parse_datetime_param(options['since']),
+                until=parse_datetime_param(options['until']),
+                date_field=options['date_field'],
+                include_history=options['include_history'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        lines = stream_export(options['format'], querysets, chunk_size=options['chunk_size'])
+        if options['output'] == '-':
+            for line in lines:
+                sys.stdout.write(line)
+            return
+
+        count = 0
+        with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+            for line in lines:
+                f.write(line)
+                count += 1
+        if options['format'] == 'csv':
+            count -= 1
+        self.stderr.write(self.style.SUCCESS(f'✅ Exported {count} rows to {options["output"]}'))
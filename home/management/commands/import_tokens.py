@@ -0,0 +1,65 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from home.token_import import IMPORT_FORMATS, import_tokens
+
+
+class Command(BaseCommand):
+    help = 'Stream FCM tokens from a CSV or NDJSON file and upsert them in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read, or - for stdin')
+        parser.add_argument(
+            '--format',
+            choices=IMPORT_FORMATS,
+            help='Input format (default: guessed from the file extension, ndjson for stdin)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Records upserted per transaction (default: 10000)',
+        )
+        parser.add_argument(
+            '--user-agent',
+            default='',
+            help='User agent stored for records without one',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be >= 1')
+
+        path = options['path']
+        import_format = options['format']
+        if not import_format:
+            import_format = 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+        def progress(stats):
+            self.stdout.write(
+                f'📥 Batch {stats["batches"]}: {stats["imported"]} imported, '
+                f'{stats["duplicates"]} duplicates, {stats["invalid"]} invalid '
+                f'({stats["processed"]} rows read)'
+            )
+
+        try:
+            if path == '-':
+                stats = import_tokens(sys.stdin, import_format, options['batch_size'],
+                                      options['user_agent'], progress)
+            else:
+                with open(path, encoding='utf-8', newline='') as f:
+                    stats = import_tokens(f, import_format, options['batch_size'],
+                                          options['user_agent'], progress)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write('\n📊 Import Summary:')
+        self.stdout.write(f'   Rows read: {stats["processed"]}')
+        self.stdout.write(f'   Imported: {stats["imported"]}')
+        if stats['created'] is not None:
+            self.stdout.write(f'   New tokens: {stats["created"]}')
+        self.stdout.write(f'   Duplicates skipped: {stats["duplicates"]}')
+        if stats['invalid']:
+            self.stdout.write(self.style.WARNING(f'   Invalid rows: {stats["invalid"]}'))
+        else:
+            self.stdout.write('   Invalid rows: 0')
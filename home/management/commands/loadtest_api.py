@@ -0,0 +1,213 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+from home.benchmark import FakeFCM, QueryCounter
+from home.db import worker_connections
+from home.events import flush_events
+from home.models import NotificationEvent, UserFCMToken
+from home.token_writes import flush_tokens
+
+ENDPOINTS = ('save-fcm-token', 'schedule-notification', 'notification-status', 'notification-event')
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percent / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = 'Load test the HTTP API in-process with concurrent Django test clients (Firebase stubbed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--endpoints',
+            nargs='+',
+            choices=ENDPOINTS,
+            default=['save-fcm-token', 'schedule-notification'],
+            help='Endpoints to drive, one phase each',
+        )
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint (default: 2000)')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads (default: 8)')
+        parser.add_argument('--tokens', type=int, default=1000, help='Known tokens to seed (default: 1000)')
+        parser.add_argument(
+            '--new-token-ratio',
+            type=float,
+            default=0.1,
+            help='Fraction of save-fcm-token requests that register a new token (default: 0.1)',
+        )
+        parser.add_argument(
+            '--token-write-behind',
+            action='store_true',
+            help='Run save-fcm-token with FCM_TOKEN_WRITE_BEHIND on (queued, batched upserts)',
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for payload generation')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the load-test database')
+        parser.add_argument('--json', dest='json_path', help='Write results as JSON to this path')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--requests and --concurrency must be positive')
+
+        # Run against a throwaway copy of whatever database --settings points at.
+        # SQLite's shared in-memory test database serializes poorly across
+        # threads, so use a temporary file instead.
+        temp_dir = None
+        old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            temp_dir = tempfile.mkdtemp(prefix='loadtest-')
+            connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'loadtest.sqlite3')
+
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False, keepdb=options['keepdb']
+        )
+        try:
+            self.stdout.write(
+                f'🧪 Load testing on {connection.vendor} with {options["concurrency"]} threads'
+            )
+            tokens = self._seed_tokens(options['tokens'])
+            with FakeFCM().installed(), override_settings(FCM_TOKEN_WRITE_BEHIND=options['token_write_behind']):
+                results = [
+                    self._run_phase(endpoint, tokens, options)
+                    for endpoint in options['endpoints']
+                ]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            if temp_dir:
+                connection.settings_dict['TEST']['NAME'] = None
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+        self._report(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'📝 Results written to {options["json_path"]}')
+
+    def _seed_tokens(self, count):
+        tokens = [f'loadtest-known-{i:08d}' for i in range(count)]
+        UserFCMToken.objects.bulk_create(
+            [UserFCMToken(token=token, user_agent='loadtest') for token in tokens],
+            batch_size=1000,
+        )
+        return tokens
+
+    def _build_requests(self, endpoint, tokens, options):
+        rng = random.Random(f'{options["seed"]}-{endpoint}')
+        scheduled_at = (timezone.now() + timedelta(days=1)).isoformat()
+        requests = []
+        for i in range(options['requests']):
+            if endpoint == 'save-fcm-token':
+                if rng.random() < options['new_token_ratio']:
+                    token = f'loadtest-new-{endpoint}-{i:08d}'
+                else:
+                    token = rng.choice(tokens)
+                requests.append(('post', '/api/save-fcm-token/', {'token': token}))
+            elif endpoint == 'schedule-notification':
+                requests.append(('post', '/api/schedule-notification/', {
+                    'title': f'Load test {i}',
+                    'body': 'In-process load test payload',
+                    'fcm_token': rng.choice(tokens),
+                    'scheduled_at': scheduled_at,
+                    'priority': rng.choice(['low', 'normal', 'high']),
+                }))
+            elif endpoint == 'notification-event':
+                kind = rng.choice(['receipt', 'click'])
+                requests.append(('post', f'/api/notifications/{rng.randrange(1, 10 ** 9)}/{kind}/', None))
+            else:
+                requests.append(('get', '/api/notification-status/', None))
+        return requests
+
+    def _run_phase(self, endpoint, tokens, options):
+        requests = self._build_requests(endpoint, tokens, options)
+        samples = []
+        lock = threading.Lock()
+        cursor = iter(requests)
+
+        def worker():
+            client = Client(HTTP_USER_AGENT='loadtest')
+            counter = QueryCounter()
+            local = []
+            try:
+                with worker_connections(), counter.capture():
+                    while True:
+                        with lock:
+                            item = next(cursor, None)
+                        if item is None:
+                            break
+                        method, path, payload = item
+                        before = counter.count
+                        start = time.perf_counter()
+                        if method == 'post':
+                            response = client.post(
+                                path, data=json.dumps(payload), content_type='application/json'
+                            )
+                        else:
+                            response = client.get(path)
+                        local.append((
+                            time.perf_counter() - start,
+                            counter.count - before,
+                            response.status_code,
+                        ))
+            finally:
+                with lock:
+                    samples.extend(local)
+
+        self.stdout.write(f'🚀 {endpoint}: {len(requests)} requests...')
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Events (and write-behind tokens) are written behind the requests; count the final flush too
+        if endpoint == 'notification-event':
+            flush_events()
+        elif endpoint == 'save-fcm-token' and options['token_write_behind']:
+            flush_tokens()
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        errors = sum(1 for sample in samples if sample[2] >= 400)
+        return {
+            'endpoint': endpoint,
+            'requests': len(samples),
+            'errors': errors,
+            'seconds': round(elapsed, 3),
+            'requests_per_second': round(len(samples) / elapsed, 1) if elapsed else None,
+            'p50_ms': round(_percentile(latencies, 50), 2),
+            'p90_ms': round(_percentile(latencies, 90), 2),
+            'p99_ms': round(_percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2) if latencies else 0.0,
+            'queries_per_request': round(sum(s[1] for s in samples) / len(samples), 2) if samples else 0.0,
+            'events_stored': NotificationEvent.objects.count() if endpoint == 'notification-event' else None,
+        }
+
+    def _report(self, results):
+        self.stdout.write('\n📊 API load test results')
+        header = (
+            f'{"endpoint":<24} {"req/s":>9} {"p50 ms":>8} {"p90 ms":>8} '
+            f'{"p99 ms":>8} {"max ms":>8} {"q/req":>6} {"errors":>7}'
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for r in results:
+            self.stdout.write(
+                f'{r["endpoint"]:<24} {r["requests_per_second"] or 0:>9} {r["p50_ms"]:>8} '
+                f'{r["p90_ms"]:>8} {r["p99_ms"]:>8} {r["max_ms"]:>8} '
+                f'{r["queries_per_request"]:>6} {r["errors"]:>7}'
+            )
+        if any(r['errors'] for r in results):
+            self.stdout.write(self.style.WARNING('⚠️ Some requests failed, see the errors column'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Load test completed'))
@@ -0,0 +1,156 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from home.maintenance import (
+    purge_inactive_tokens, purge_notification_events, purge_notifications, purge_unused_contents
+)
+from home.models import NotificationEvent, NotificationHistory, ScheduledNotification, UserFCMToken
+
+
+def _retention_rule(value):
+    status, _, days = value.partition('=')
+    if not status or not days.isdigit():
+        raise ValueError(value)
+    return status, int(days)
+
+
+class Command(BaseCommand):
+    help = 'Delete old terminal notifications, client events and inactive FCM tokens in throttled chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retain',
+            action='append',
+            type=_retention_rule,
+            metavar='STATUS=DAYS',
+            help='Keep notifications with STATUS for DAYS days (repeatable; '
+                 'default: NOTIFICATION_RETENTION_DAYS)',
+        )
+        parser.add_argument(
+            '--token-days',
+            type=int,
+            default=None,
+            help='Delete inactive tokens not updated for N days (default: FCM_TOKEN_RETENTION_DAYS, '
+                 '0 disables)',
+        )
+        parser.add_argument(
+            '--event-days',
+            type=int,
+            default=None,
+            help='Delete receipt and click events older than N days (default: '
+                 'NOTIFICATION_EVENT_RETENTION_DAYS, 0 disables)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Primary key range deleted per transaction (default: 5000)',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.05,
+            help='Seconds to pause after each chunk that deleted rows (default: 0.05)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the rows that would be deleted',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be >= 1')
+
+        retention = dict(options['retain'] or getattr(settings, 'NOTIFICATION_RETENTION_DAYS', {}))
+        valid_statuses = {choice for choice, _ in ScheduledNotification.STATUS_CHOICES}
+        unknown = set(retention) - valid_statuses
+        if unknown:
+            raise CommandError(f'Unknown status in retention rules: {", ".join(sorted(unknown))}')
+        if 'pending' in retention:
+            raise CommandError('Pending notifications cannot be purged by age')
+
+        token_days = options['token_days']
+        if token_days is None:
+            token_days = getattr(settings, 'FCM_TOKEN_RETENTION_DAYS', 0)
+        event_days = options['event_days']
+        if event_days is None:
+            event_days = getattr(settings, 'NOTIFICATION_EVENT_RETENTION_DAYS', 0)
+
+        now = timezone.now()
+        verbosity = options['verbosity']
+        chunk_size = options['chunk_size']
+        sleep = options['sleep']
+
+        def progress(table, low, high, removed):
+            if verbosity > 1 or removed:
+                self.stdout.write(f'🧹 {table} ids [{low}, {high}): deleted {removed}')
+
+        for status, days in sorted(retention.items()):
+            cutoff = now - timedelta(days=days)
+            for model in (ScheduledNotification, NotificationHistory):
+                if options['dry_run']:
+                    count = model.objects.filter(status=status, scheduled_at__lt=cutoff).count()
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f'[DRY RUN] Would delete {count} {status} rows from {model._meta.db_table} '
+                            f'(older than {days} days)'
+                        )
+                    )
+                    continue
+                deleted = purge_notifications(
+                    model, status, cutoff, chunk_size=chunk_size, sleep=sleep, progress=progress
+                )
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f'✅ Deleted {deleted} {status} rows from {model._meta.db_table} '
+                        f'(older than {days} days)'
+                    )
+                )
+
+        if event_days:
+            cutoff = now - timedelta(days=event_days)
+            if options['dry_run']:
+                count = NotificationEvent.objects.filter(occurred_at__lt=cutoff).count()
+                self.stdout.write(
+                    self.style.WARNING(
+                        f'[DRY RUN] Would delete {count} notification events (older than {event_days} days)'
+                    )
+                )
+            else:
+                deleted = purge_notification_events(cutoff, chunk_size=chunk_size, sleep=sleep, progress=progress)
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f'✅ Deleted {deleted} notification events (older than {event_days} days)'
+                    )
+                )
+
+        if token_days:
+            cutoff = now - timedelta(days=token_days)
+            if options['dry_run']:
+                count = UserFCMToken.objects.filter(is_active=False, updated_at__lt=cutoff).count()
+                self.stdout.write(
+                    self.style.WARNING(
+                        f'[DRY RUN] Would delete {count} inactive tokens (idle for {token_days} days)'
+                    )
+                )
+            else:
+                totals = purge_inactive_tokens(cutoff, chunk_size=chunk_size, sleep=sleep, progress=progress)
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f'✅ Deleted {totals["tokens"]} inactive tokens with {totals["notifications"]} '
+                        f'notifications and {totals["history"]} archived rows'
+                    )
+                )
+
+        if options['dry_run']:
+            return
+
+        # Payloads are shared, so they can only go once nothing points at them
+        grace = getattr(settings, 'NOTIFICATION_CONTENT_GRACE_SECONDS', 3600)
+        deleted = purge_unused_contents(
+            now - timedelta(seconds=grace), chunk_size=chunk_size, sleep=sleep, progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(f'✅ Deleted {deleted} unreferenced notification contents'))
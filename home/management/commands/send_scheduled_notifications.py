@@ -1,14 +1,61 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from home.models import ScheduledNotification
-from home.notification_service import fcm_service
+from django.core.management.base import BaseCommand, CommandError
+from home.adaptive import adaptive_enabled, get_batch_sizer
+from home.backends import get_backend
+from home.dispatcher import DispatchHooks, NotificationDispatcher, PhaseTimer, SqlTraceHook
+from home.queues import get_queue
+from home.sharding import run_shards, validate_shard
+import cProfile
+import io
 import logging
+import pstats
 
 logger = logging.getLogger(__name__)
 
+
+class ConsoleHook(DispatchHooks):
+    """Write per-notification progress to the command's stdout"""
+
+    def __init__(self, command, dry_run):
+        self.command = command
+        self.dry_run = dry_run
+
+    def batch_fetched(self, batch_number, notifications):
+        if notifications:
+            self.command.stdout.write(
+                f'Found {len(notifications)} pending notifications to send'
+            )
+
+    def notification_processed(self, notification, result):
+        style = self.command.style
+        if result is None:
+            self.command.stdout.write(
+                f'[DRY RUN] Would send: "{notification.title}" to {notification.fcm_token.token[:30]}...'
+            )
+        elif result['success']:
+            self.command.stdout.write(
+                style.SUCCESS(
+                    f'✅ Sent: "{notification.title}" (ID: {notification.id})'
+                )
+            )
+        elif result.get('collapsed'):
+            self.command.stdout.write(
+                f'🔕 Collapsed: "{notification.title}" (ID: {notification.id}) - {result["error"]}'
+            )
+        elif result.get('expired'):
+            self.command.stdout.write(
+                style.WARNING(f'⌛ Expired: "{notification.title}" (ID: {notification.id})')
+            )
+        else:
+            self.command.stdout.write(
+                style.ERROR(
+                    f'❌ Failed: "{notification.title}" (ID: {notification.id}) - {result.get("error")}'
+                )
+            )
+
+
 class Command(BaseCommand):
     help = 'Send scheduled notifications that are due'
-    
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--dry-run',
@@ -18,87 +65,134 @@ class Command(BaseCommand):
         parser.add_argument(
             '--limit',
             type=int,
-            default=100,
-            help='Maximum number of notifications to process (default: 100)',
+            default=None,
+            help='Maximum number of notifications to process (default: 100, or all with --adaptive)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Notifications fetched and written back per batch (default: --limit)',
+        )
+        parser.add_argument(
+            '--profile',
+            nargs='?',
+            const='send_scheduled_notifications.prof',
+            default=None,
+            metavar='PATH',
+            help='Run under cProfile, dump pstats to PATH and print a per-phase timing breakdown',
+        )
+        parser.add_argument(
+            '--trace-sql',
+            action='store_true',
+            help='Log query counts and durations per batch and phase',
+        )
+        parser.add_argument(
+            '--sync-queue',
+            action='store_true',
+            help='Push every pending notification into the configured queue first '
+                 '(after switching queues or losing Redis data)',
+        )
+        parser.add_argument(
+            '--shard',
+            type=int,
+            default=None,
+            metavar='K',
+            help='Only send notifications of tokens with id %% N == K (see --num-shards)',
         )
-    
+        parser.add_argument(
+            '--num-shards',
+            type=int,
+            default=1,
+            metavar='N',
+            help='Number of shards; without --shard, run all N shards in parallel worker processes',
+        )
+        parser.add_argument(
+            '--adaptive',
+            action='store_true',
+            help='Adjust batch size and send concurrency to latency, errors and backlog '
+                 '(default: DISPATCH_ADAPTIVE enabled setting)',
+        )
+
     def handle(self, *args, **options):
         dry_run = options['dry_run']
+        adaptive = options['adaptive'] or adaptive_enabled()
         limit = options['limit']
-        
-        now = timezone.now()
-        
-        # Get pending notifications that are due
-        pending_notifications = ScheduledNotification.objects.filter(
-            status='pending',
-            scheduled_at__lte=now
-        ).select_related('fcm_token')[:limit]
-        
-        if not pending_notifications.exists():
-            self.stdout.write(
-                self.style.SUCCESS('No pending notifications to send')
-            )
+        if limit is None and not adaptive:
+            limit = 100
+        num_shards = options['num_shards']
+        try:
+            validate_shard(options['shard'], num_shards)
+        except ValueError as e:
+            raise CommandError(str(e))
+        supervise = num_shards > 1 and options['shard'] is None
+        if supervise and (options['profile'] or options['trace_sql']):
+            raise CommandError('--profile and --trace-sql need a single process; combine them with --shard')
+
+        hooks = [ConsoleHook(self, dry_run)]
+        timer = None
+        if options['profile']:
+            timer = PhaseTimer()
+            hooks.append(timer)
+        if options['trace_sql']:
+            hooks.append(SqlTraceHook(report=self._report_sql))
+
+        if options['sync_queue']:
+            queue = get_queue()
+            pushed = queue.sync()
+            self.stdout.write(f'🔄 Pushed {pushed} pending notifications to the {queue.name} queue')
+
+        if supervise:
+            self._supervise(num_shards, limit, options['batch_size'], dry_run, adaptive)
             return
-        
-        self.stdout.write(
-            f'Found {len(pending_notifications)} pending notifications to send'
+
+        shard = (options['shard'], num_shards) if options['shard'] is not None else None
+        sizer = get_batch_sizer(get_backend(), options['batch_size'] or limit) if adaptive else None
+        dispatcher = NotificationDispatcher(
+            hooks=hooks, dry_run=dry_run, source='command', shard=shard, sizer=sizer
         )
-        
-        sent_count = 0
-        failed_count = 0
-        
-        for notification in pending_notifications:
-            try:
-                if dry_run:
-                    self.stdout.write(
-                        f'[DRY RUN] Would send: "{notification.title}" to {notification.fcm_token.token[:30]}...'
-                    )
-                    sent_count += 1
-                    continue
-                
-                # Send notification
-                result = fcm_service.send_notification(
-                    notification.fcm_token.token,
-                    notification.title,
-                    notification.body,
-                    notification.priority
+
+        if options['profile']:
+            profiler = cProfile.Profile()
+            summary = profiler.runcall(dispatcher.run, limit, options['batch_size'])
+            self._report_profile(profiler, timer, options['profile'])
+        else:
+            summary = dispatcher.run(limit, options['batch_size'])
+
+        if summary['circuit_breaker'] != 'closed' or summary['deferred']:
+            breaker = dispatcher.breaker.snapshot()
+            retry = f', retrying in {breaker["retry_in"]}s' if breaker['retry_in'] is not None else ''
+            self.stdout.write(
+                self.style.WARNING(
+                    f'⚡ Circuit breaker {breaker["state"]} ({breaker["failures"]}/{breaker["calls"]} '
+                    f'transient failures{retry}), {summary["deferred"]} notifications left pending'
                 )
-                
-                if result['success']:
-                    notification.status = 'sent'
-                    notification.sent_at = result.get('sent_at', timezone.now())
-                    notification.save()
-                    sent_count += 1
-                    
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'✅ Sent: "{notification.title}" (ID: {notification.id})'
-                        )
-                    )
-                else:
-                    notification.status = 'failed'
-                    notification.error_message = result.get('error', 'Unknown error')
-                    notification.save()
-                    failed_count += 1
-                    
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f'❌ Failed: "{notification.title}" (ID: {notification.id}) - {result.get("error")}'
-                        )
-                    )
-                    
-            except Exception as e:
-                notification.status = 'failed'
-                notification.error_message = str(e)
-                notification.save()
-                failed_count += 1
-                
+            )
+
+        if sizer:
+            state = sizer.snapshot()
+            self.stdout.write(
+                f'📐 Adaptive batching: batch size {state["batch_size"]} '
+                f'({state["min_batch_size"]}-{state["max_batch_size"]}), '
+                f'concurrency {state["concurrency"]}/{state["max_concurrency"]}'
+            )
+
+        if summary['expired']:
+            self.stdout.write(
+                self.style.WARNING(f'⌛ Expired {summary["expired"]} stale notifications without sending them')
+            )
+
+        if not summary['processed']:
+            if not summary['deferred'] and summary['circuit_breaker'] == 'closed' and not summary['expired']:
                 self.stdout.write(
-                    self.style.ERROR(
-                        f'❌ Error: "{notification.title}" (ID: {notification.id}) - {str(e)}'
-                    )
+                    self.style.SUCCESS('No pending notifications to send')
                 )
-        
+            return
+
+        sent_count = summary['sent']
+        failed_count = summary['failed']
+        collapsed_count = summary['collapsed']
+
         # Summary
         if dry_run:
             self.stdout.write(
@@ -112,14 +206,65 @@ class Command(BaseCommand):
                     f'\n✅ Successfully sent {sent_count} notifications'
                 )
             )
-            
+
             if failed_count > 0:
                 self.stdout.write(
                     self.style.ERROR(
                         f'❌ Failed to send {failed_count} notifications'
                     )
                 )
-            
+
+            if collapsed_count > 0:
+                self.stdout.write(
+                    f'🔕 Collapsed {collapsed_count} notifications into other sends'
+                )
+
+            self.stdout.write(
+                f'📊 Total processed: {summary["processed"]}'
+            )
+
+    def _supervise(self, num_shards, limit, batch_size, dry_run, adaptive):
+        self.stdout.write(f'🔀 Dispatching with {num_shards} shard workers')
+        summaries, totals = run_shards(num_shards, limit, batch_size, dry_run, adaptive)
+        for summary in summaries:
+            breaker = '' if summary['circuit_breaker'] == 'closed' else f', circuit breaker {summary["circuit_breaker"]}'
+            self.stdout.write(
+                f'  shard {summary["shard"]}/{num_shards}: {summary["sent"]} sent, {summary["failed"]} failed, '
+                f'{summary["collapsed"]} collapsed, {summary["expired"]} expired, {summary["deferred"]} deferred in '
+                f'{summary["batches"]} batches{breaker}'
+            )
+
+        if totals['deferred'] or totals['circuit_breaker'] != 'closed':
             self.stdout.write(
-                f'📊 Total processed: {sent_count + failed_count}'
+                self.style.WARNING(
+                    f'⚡ Circuit breaker {totals["circuit_breaker"]} in at least one shard, '
+                    f'{totals["deferred"]} notifications left pending'
+                )
             )
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f'\n[DRY RUN] Would have sent {totals["sent"]} notifications'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'\n✅ Successfully sent {totals["sent"]} notifications'))
+        if totals['failed']:
+            self.stdout.write(self.style.ERROR(f'❌ Failed to send {totals["failed"]} notifications'))
+        if totals['collapsed']:
+            self.stdout.write(f'🔕 Collapsed {totals["collapsed"]} notifications into other sends')
+        if totals['expired']:
+            self.stdout.write(self.style.WARNING(f'⌛ Expired {totals["expired"]} stale notifications'))
+        self.stdout.write(f'📊 Total processed: {totals["processed"]}')
+
+    def _report_sql(self, line):
+        logger.info(line)
+        self.stdout.write(f'🗄️  {line}')
+
+    def _report_profile(self, profiler, timer, path):
+        profiler.dump_stats(path)
+
+        self.stdout.write('\n⏱️  Per-phase timing')
+        for line in timer.summary_lines():
+            self.stdout.write(line)
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(15)
+        self.stdout.write(stream.getvalue())
+        self.stdout.write(f'📝 cProfile stats written to {path} (inspect with python -m pstats)')
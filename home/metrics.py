@@ -0,0 +1,557 @@
+"""
+Lightweight in-process metrics for the notification pipeline
+
+Metrics are kept in a process-wide registry and rendered in the Prometheus
+text exposition format by the ``/metrics`` endpoint. On its own, a
+registry only sees its own process: the dispatcher command, the scheduler
+script, shard workers and each web worker count separately.
+
+With the ``NOTIFICATION_METRICS_DIR`` setting, every process writes a
+snapshot of its registry to ``<dir>/<pid>-<start>.json`` (at most every
+``SNAPSHOT_INTERVAL`` seconds, after each dispatch run and at exit), and
+``/metrics`` renders the merge of all snapshots: counters and histograms
+are summed, gauges take the most recent value per label set. The
+directory must be shared by all processes of one host. Snapshots of
+processes that have exited are folded into ``<dir>/aggregate.json`` by
+the next scrape, which keeps their counters and histograms and drops their
+gauges.
+
+Every observation is also forwarded to an optional sink configured with the
+``NOTIFICATION_METRICS_SINK`` setting (a dotted path to a callable taking
+``kind, name, value, labels``), so they can be shipped to StatsD or similar.
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 21600)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+SNAPSHOT_INTERVAL = 5.0
+AGGREGATE_FILE = 'aggregate.json'
+
+_sink = None
+_sink_loaded = False
+
+
+def _get_sink():
+    """Resolve the configured metrics sink once"""
+    global _sink, _sink_loaded
+    if not _sink_loaded:
+        path = getattr(settings, 'NOTIFICATION_METRICS_SINK', None)
+        _sink = import_string(path) if path else None
+        _sink_loaded = True
+    return _sink
+
+
+def _emit(kind, name, value, labels):
+    # Checked here so that most observations skip write_snapshot() entirely
+    if time.monotonic() >= registry._next_snapshot:
+        registry.write_snapshot()
+    sink = _get_sink()
+    if sink is None:
+        return
+    try:
+        sink(kind, name, value, labels)
+    except Exception as e:
+        print(f"⚠️ Metrics sink failed for {name}: {e}")
+
+
+def _metrics_dir():
+    return getattr(settings, 'NOTIFICATION_METRICS_DIR', None)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # alive, but owned by another user
+    return True
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.extend(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(val)}"' for key, val in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def snapshot(self):
+        """Samples as JSON-serialisable ``[labels, value]`` pairs"""
+        with self._lock:
+            return [[list(key), self._copy(value)] for key, value in self._values.items()]
+
+    def _copy(self, value):
+        return value
+
+    def merge(self, snapshots):
+        """Combine the samples of several processes' snapshots, oldest first"""
+        values = {}
+        for samples in snapshots:
+            for key, value in samples:
+                key = tuple(key)
+                values[key] = value if key not in values else values[key] + value
+        return values
+
+    def render(self, values=None):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        lines.extend(self._render_samples(sorted(values.items())))
+        return lines
+
+    def _render_samples(self, items):
+        return [
+            f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+            for key, value in items
+        ]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _emit(self.kind, self.name, amount, labels)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def merge(self, snapshots):
+        # A gauge is a current state, not a total: the newest value wins
+        return {tuple(key): value for samples in snapshots for key, value in samples}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+        _emit(self.kind, self.name, value, labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][index] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+        _emit(self.kind, self.name, value, labels)
+
+    def _copy(self, value):
+        return {'counts': list(value['counts']), 'sum': value['sum'], 'count': value['count']}
+
+    def merge(self, snapshots):
+        values = {}
+        for samples in snapshots:
+            for key, state in samples:
+                if len(state['counts']) != len(self.buckets):
+                    continue  # written with other buckets by an older release
+                total = values.setdefault(tuple(key), {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+                total['counts'] = [a + b for a, b in zip(total['counts'], state['counts'])]
+                total['sum'] += state['sum']
+                total['count'] += state['count']
+        return values
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the wrapped block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_samples(self, items):
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(state["sum"])}')
+            lines.append(f'{self.name}_count{labels} {state["count"]}')
+        return lines
+
+
+class MetricsRegistry:
+    """Holds metric families and scrape-time collectors"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._next_snapshot = 0.0
+        self._pid = None
+        self._started = None
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        """Register a callable that refreshes gauges right before rendering"""
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+        return collector
+
+    def collect(self):
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception as e:
+                print(f"⚠️ Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+
+    def _snapshot_name(self):
+        """File name for this process's snapshot, unique even when a pid is reused"""
+        pid = os.getpid()
+        if self._pid != pid:
+            # First snapshot, or the first one after a fork
+            self._pid, self._started = pid, int(time.time() * 1000)
+        return f'{pid}-{self._started}.json'
+
+    def write_snapshot(self, force=False):
+        """
+        Write this process's metrics to NOTIFICATION_METRICS_DIR
+
+        Does nothing without the setting, and unless ``force`` is set, when
+        the last snapshot is less than SNAPSHOT_INTERVAL seconds old.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_snapshot:
+            return
+        self._next_snapshot = now + SNAPSHOT_INTERVAL
+        directory = _metrics_dir()
+        if not directory:
+            return
+        if not self._snapshot_lock.acquire(blocking=force):
+            return
+        try:
+            data = {
+                'written_at': time.time(),
+                'metrics': {name: metric.snapshot() for name, metric in list(self._metrics.items())},
+            }
+            path = os.path.join(directory, self._snapshot_name())
+            os.makedirs(directory, exist_ok=True)
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(data, f)
+            # Readers only ever see a complete file
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            print(f"⚠️ Could not write metrics snapshot to {directory}: {e}")
+        finally:
+            self._snapshot_lock.release()
+
+    def _is_dead(self, name):
+        """Whether a snapshot file belongs to a process that has exited"""
+        pid, _, started = name[:-len('.json')].partition('-')
+        if not pid.isdigit() or not started.isdigit():
+            return False
+        if int(pid) == os.getpid():
+            return name != self._snapshot_name()
+        return not _process_alive(int(pid))
+
+    def _fold(self, directory, aggregate, dead):
+        """
+        Add the counters and histograms of exited processes to the aggregate
+
+        Returns:
+            The new aggregate snapshot
+        """
+        metrics = dict(aggregate['metrics'])
+        for name, metric in list(self._metrics.items()):
+            if metric.kind == 'gauge':
+                continue  # the state of a process that is gone
+            values = metric.merge(
+                [metrics.get(name, [])] + [snapshot['metrics'].get(name, []) for snapshot in dead]
+            )
+            metrics[name] = [[list(key), value] for key, value in values.items()]
+        aggregate = {'written_at': 0, 'metrics': metrics}
+        path = os.path.join(directory, AGGREGATE_FILE)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(aggregate, f)
+        os.replace(f'{path}.tmp', path)
+        return aggregate
+
+    def _read_snapshots(self, directory):
+        """
+        Read every snapshot in the directory, folding those of exited processes
+
+        Runs under an exclusive lock so that concurrent scrapes neither fold
+        the same file twice nor see a file both on its own and in the
+        aggregate.
+        """
+        snapshots = []
+        try:
+            lock = open(os.path.join(directory, '.lock'), 'a')
+        except OSError as e:
+            print(f"⚠️ Could not read metrics snapshots from {directory}: {e}")
+            return snapshots
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            aggregate = {'written_at': 0, 'metrics': {}}
+            dead = []
+            for entry in os.scandir(directory):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    with open(entry.path) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue  # removed or replaced while listing
+                if entry.name == AGGREGATE_FILE:
+                    aggregate = snapshot
+                elif self._is_dead(entry.name):
+                    dead.append((entry.path, snapshot))
+                else:
+                    snapshots.append(snapshot)
+            if dead:
+                try:
+                    aggregate = self._fold(directory, aggregate, [snapshot for _, snapshot in dead])
+                except OSError as e:
+                    print(f"⚠️ Could not fold metrics snapshots in {directory}: {e}")
+                    snapshots.extend(snapshot for _, snapshot in dead)
+                else:
+                    for path, _ in dead:
+                        os.remove(path)
+        snapshots.append(aggregate)
+        snapshots.sort(key=lambda snapshot: snapshot.get('written_at', 0))
+        return snapshots
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format
+
+        With NOTIFICATION_METRICS_DIR set, these are the metrics of every
+        process that wrote a snapshot there, this one included.
+        """
+        self.collect()
+        directory = _metrics_dir()
+        snapshots = None
+        if directory:
+            self.write_snapshot(force=True)
+            snapshots = self._read_snapshots(directory)
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            values = None
+            if snapshots is not None:
+                values = metric.merge([snapshot['metrics'].get(name, []) for snapshot in snapshots])
+            lines.extend(metric.render(values))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+@atexit.register
+def _write_final_snapshot():
+    # Runs at interpreter shutdown, also in scripts that never configured Django
+    if not settings.configured:
+        return
+    try:
+        registry.write_snapshot(force=True)
+    except Exception:
+        pass
+
+fcm_send_latency = registry.histogram(
+    'fcm_send_latency_seconds',
+    'Latency of FCM send calls by outcome',
+    ['outcome'],
+)
+dispatch_lag = registry.histogram(
+    'notification_dispatch_lag_seconds',
+    'Delay between scheduled_at and sent_at for delivered notifications',
+    ['priority'],
+    buckets=LAG_BUCKETS,
+)
+dispatch_batch_size = registry.histogram(
+    'notification_dispatch_batch_size',
+    'Number of due notifications picked up per dispatch batch',
+    ['source'],
+    buckets=SIZE_BUCKETS,
+)
+dispatch_total = registry.counter(
+    'notification_dispatch_total',
+    'Notifications processed by the dispatcher by final status',
+    ['status', 'priority'],
+)
+db_flush_latency = registry.histogram(
+    'notification_db_flush_seconds',
+    'Time spent writing dispatch results back to the database',
+    ['operation'],
+)
+dispatch_phase_latency = registry.histogram(
+    'notification_dispatch_phase_seconds',
+    'Time spent per dispatch batch in each phase (query, build, send, write_back)',
+    ['phase'],
+)
+queue_depth = registry.gauge(
+    'notification_queue_depth',
+    'Scheduled notifications by status and priority',
+    ['status', 'priority'],
+)
+circuit_breaker_state = registry.gauge(
+    'notification_circuit_breaker_state',
+    'Delivery circuit breaker state by backend (0 closed, 1 half-open, 2 open)',
+    ['backend'],
+)
+circuit_breaker_transitions = registry.counter(
+    'notification_circuit_breaker_transitions_total',
+    'Delivery circuit breaker state changes by backend and new state',
+    ['backend', 'state'],
+)
+token_writes = registry.counter(
+    'fcm_token_writes_total',
+    'save_fcm_token requests by write mode (direct, queued for write-behind, overflow to direct)',
+    ['mode'],
+)
+notification_events = registry.counter(
+    'notification_events_total',
+    'Receipt and click events reported by clients, by event and buffer outcome',
+    ['event', 'outcome'],
+)
+dispatch_deferred = registry.counter(
+    'notification_dispatch_deferred_total',
+    'Due notifications left pending because the circuit breaker was open',
+    ['backend'],
+)
+dispatch_expired = registry.counter(
+    'notification_dispatch_expired_total',
+    'Pending notifications marked expired instead of being sent',
+    ['backend'],
+)
+dispatch_batch_target = registry.gauge(
+    'notification_dispatch_batch_target',
+    'Batch size the adaptive dispatcher requests next',
+    ['backend'],
+)
+dispatch_concurrency = registry.gauge(
+    'notification_dispatch_concurrency',
+    'Concurrent send calls the adaptive dispatcher uses',
+    ['backend'],
+)
+dispatch_backlog = registry.gauge(
+    'notification_dispatch_backlog_seconds',
+    'How overdue the oldest notification of the last batch was',
+    ['backend'],
+)
+dispatch_adjustments = registry.counter(
+    'notification_dispatch_adjustments_total',
+    'Adaptive batch size and concurrency changes by backend and reason',
+    ['backend', 'reason'],
+)
+
+
+def record_dispatch(notification):
+    """Record the final status and, for delivered rows, the dispatch lag"""
+    dispatch_total.inc(status=notification.status, priority=notification.priority)
+    if notification.status == 'sent' and notification.sent_at:
+        lag = (notification.sent_at - notification.scheduled_at).total_seconds()
+        dispatch_lag.observe(max(lag, 0.0), priority=notification.priority)
+
+
+_queue_depth_refreshed = None
+
+
+@registry.register_collector
+def collect_queue_depth():
+    """
+    Refresh the queue depth gauge from a single grouped query
+
+    The query counts the whole table, so it runs at most once every
+    NOTIFICATION_QUEUE_DEPTH_INTERVAL seconds; scrapes in between reuse the
+    last counts.
+    """
+    global _queue_depth_refreshed
+    from django.db.models import Count
+    from .models import ScheduledNotification
+
+    interval = getattr(settings, 'NOTIFICATION_QUEUE_DEPTH_INTERVAL', 30)
+    now = time.monotonic()
+    if _queue_depth_refreshed is not None and now - _queue_depth_refreshed < interval:
+        return
+    _queue_depth_refreshed = now
+    queue_depth.clear()
+    rows = (
+        ScheduledNotification.objects.order_by()
+        .values('status', 'priority')
+        .annotate(total=Count('id'))
+    )
+    for row in rows:
+        queue_depth.set(row['total'], status=row['status'], priority=row['priority'])
@@ -0,0 +1,72 @@
+# Generated by Django 5.1.4 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+def partition_history_on_postgres(apps, schema_editor):
+    """Rebuild notification_history as a table range-partitioned by month"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # The table was just created and is empty, so swap it for a partitioned
+    # copy. Partitioned tables need the partition key in the primary key.
+    schema_editor.execute(
+        'CREATE TABLE notification_history_partitioned '
+        '(LIKE notification_history INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        'PARTITION BY RANGE (scheduled_at)'
+    )
+    schema_editor.execute('DROP TABLE notification_history')
+    schema_editor.execute('ALTER TABLE notification_history_partitioned RENAME TO notification_history')
+    schema_editor.execute(
+        'ALTER TABLE notification_history '
+        'ADD CONSTRAINT notification_history_pkey PRIMARY KEY (id, scheduled_at)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX notif_hist_status_sched_idx ON notification_history (status, scheduled_at)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX notif_hist_token_idx ON notification_history (fcm_token_id)'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=200)),
+                ('body', models.TextField()),
+                ('fcm_token_id', models.BigIntegerField()),
+                ('scheduled_at', models.DateTimeField()),
+                ('priority', models.CharField(choices=[('low', 'Low'), ('normal', 'Normal'), ('high', 'High')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], max_length=10)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'notification history',
+                'db_table': 'notification_history',
+                'ordering': ['-scheduled_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='schedulednotification',
+            index=models.Index(fields=['status', 'scheduled_at'], name='sched_notif_status_sched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationhistory',
+            index=models.Index(fields=['status', 'scheduled_at'], name='notif_hist_status_sched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationhistory',
+            index=models.Index(fields=['fcm_token_id'], name='notif_hist_token_idx'),
+        ),
+        migrations.RunPython(partition_history_on_postgres, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Add the content table and a nullable content column; 0003_notification_content_backfill fills it"""
+
+    dependencies = [
+        ('home', '0002_notification_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationContent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.BinaryField(editable=False, max_length=16, unique=True)),
+                ('title', models.CharField(max_length=200)),
+                ('body', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'notification_contents',
+            },
+        ),
+        migrations.AddField(
+            model_name='schedulednotification',
+            name='content',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='home.notificationcontent'),
+        ),
+        migrations.AddField(
+            model_name='notificationhistory',
+            name='content',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='home.notificationcontent'),
+        ),
+    ]
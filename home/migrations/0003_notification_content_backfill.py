@@ -0,0 +1,89 @@
+import hashlib
+
+from django.db import migrations
+
+BATCH_SIZE = 2000
+
+
+def _digest(title, body):
+    # Frozen copy of home.models.content_digest
+    return hashlib.blake2b(f'{title}\x00{body}'.encode('utf-8'), digest_size=16).digest()
+
+
+def move_payloads_to_content(apps, schema_editor):
+    """Point every notification and history row at a shared content row"""
+    NotificationContent = apps.get_model('home', 'NotificationContent')
+    db_alias = schema_editor.connection.alias
+
+    for model_name in ('ScheduledNotification', 'NotificationHistory'):
+        model = apps.get_model('home', model_name)
+        last_id = None
+        while True:
+            rows = model.objects.using(db_alias).order_by('id')
+            if last_id is not None:
+                rows = rows.filter(id__gt=last_id)
+            rows = list(rows.values_list('id', 'title', 'body')[:BATCH_SIZE])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            digests = {}
+            for row_id, title, body in rows:
+                digests.setdefault(_digest(title, body), (title, body, []))[2].append(row_id)
+            NotificationContent.objects.using(db_alias).bulk_create(
+                [
+                    NotificationContent(digest=digest, title=title, body=body)
+                    for digest, (title, body, _) in digests.items()
+                ],
+                ignore_conflicts=True,
+            )
+            content_ids = {
+                bytes(digest): content_id
+                for content_id, digest in NotificationContent.objects.using(db_alias)
+                .filter(digest__in=list(digests)).values_list('id', 'digest')
+            }
+            for digest, (_, _, row_ids) in digests.items():
+                model.objects.using(db_alias).filter(id__in=row_ids).update(
+                    content_id=content_ids[digest]
+                )
+
+
+def move_payloads_back(apps, schema_editor):
+    """Copy the shared payloads back into the per-row title and body columns"""
+    db_alias = schema_editor.connection.alias
+
+    for model_name in ('ScheduledNotification', 'NotificationHistory'):
+        model = apps.get_model('home', model_name)
+        last_id = None
+        while True:
+            rows = model.objects.using(db_alias).filter(content__isnull=False).order_by('id')
+            if last_id is not None:
+                rows = rows.filter(id__gt=last_id)
+            rows = list(rows.values_list('id', 'content__title', 'content__body')[:BATCH_SIZE])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            payloads = {}
+            for row_id, title, body in rows:
+                payloads.setdefault((title, body), []).append(row_id)
+            for (title, body), row_ids in payloads.items():
+                model.objects.using(db_alias).filter(id__in=row_ids).update(title=title, body=body)
+
+
+class Migration(migrations.Migration):
+    """
+    Point every row at its content
+
+    Kept apart from the schema changes: on PostgreSQL the updates queue
+    deferred foreign key checks, and ALTER TABLE fails while such events
+    are pending in the same transaction.
+    """
+
+    dependencies = [
+        ('home', '0003_notification_content'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_payloads_to_content, move_payloads_back),
+    ]
@@ -0,0 +1,61 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Require the content and drop the per-row title and body columns"""
+
+    dependencies = [
+        ('home', '0003_notification_content_backfill'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='schedulednotification',
+            name='content',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='home.notificationcontent'),
+        ),
+        migrations.AlterField(
+            model_name='notificationhistory',
+            name='content',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='home.notificationcontent'),
+        ),
+        # Defaults only matter when migrating backwards: the columns are then
+        # added back to tables that already hold rows
+        migrations.AlterField(
+            model_name='schedulednotification',
+            name='title',
+            field=models.CharField(default='', max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='schedulednotification',
+            name='body',
+            field=models.TextField(default=''),
+        ),
+        migrations.AlterField(
+            model_name='notificationhistory',
+            name='title',
+            field=models.CharField(default='', max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='notificationhistory',
+            name='body',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='schedulednotification',
+            name='title',
+        ),
+        migrations.RemoveField(
+            model_name='schedulednotification',
+            name='body',
+        ),
+        migrations.RemoveField(
+            model_name='notificationhistory',
+            name='title',
+        ),
+        migrations.RemoveField(
+            model_name='notificationhistory',
+            name='body',
+        ),
+    ]
@@ -0,0 +1,54 @@
+import hashlib
+
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def _digest(token):
+    # Frozen copy of home.models.token_digest
+    return hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+
+
+def fill_token_hashes(apps, schema_editor):
+    """Compute the digest of every existing token in id-ordered batches"""
+    UserFCMToken = apps.get_model('home', 'UserFCMToken')
+    db_alias = schema_editor.connection.alias
+    last_id = None
+    while True:
+        rows = UserFCMToken.objects.using(db_alias).order_by('id')
+        if last_id is not None:
+            rows = rows.filter(id__gt=last_id)
+        rows = list(rows.only('id', 'token')[:BATCH_SIZE])
+        if not rows:
+            break
+        last_id = rows[-1].id
+        for row in rows:
+            row.token_hash = _digest(row.token)
+        UserFCMToken.objects.using(db_alias).bulk_update(rows, ['token_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0003_notification_content_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userfcmtoken',
+            name='token_hash',
+            field=models.BinaryField(editable=False, max_length=16, null=True),
+        ),
+        migrations.RunPython(fill_token_hashes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='userfcmtoken',
+            name='token_hash',
+            field=models.BinaryField(editable=False, max_length=16, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='userfcmtoken',
+            name='token',
+            field=models.CharField(max_length=500),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-19 14:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0004_userfcmtoken_token_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification_id', models.BigIntegerField()),
+                ('event', models.CharField(choices=[('received', 'Received'), ('clicked', 'Clicked')], max_length=10)),
+                ('occurred_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'notification_events',
+                'ordering': ['-occurred_at'],
+                'constraints': [models.UniqueConstraint(fields=('notification_id', 'event'), name='notif_event_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-19 14:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0005_notification_event'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificationevent',
+            index=models.Index(fields=['occurred_at'], name='notif_event_occurred_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='schedulednotification',
+            index=models.Index(fields=['scheduled_at', 'id'], name='sched_notif_sched_id_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-19 15:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0007_notification_collapse_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationhistory',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='schedulednotification',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='notificationhistory',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('collapsed', 'Collapsed'), ('expired', 'Expired')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='schedulednotification',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('collapsed', 'Collapsed'), ('expired', 'Expired')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='schedulednotification',
+            index=models.Index(fields=['status', 'expires_at'], name='sched_notif_status_exp_idx'),
+        ),
+    ]
@@ -1,23 +1,153 @@
-from django.db import models
+import hashlib
+
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 
 # Create your models here.
 
+def token_digest(token):
+    """Return the 16-byte BLAKE2b digest used to index and look up an FCM token"""
+    return hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+
+class UserFCMTokenQuerySet(models.QuerySet):
+    def for_token(self, token):
+        """Filter on the indexed digest instead of the full token string"""
+        return self.filter(token_hash=token_digest(token))
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create bypasses save(), so fill in the digest here
+        objs = list(objs)
+        for obj in objs:
+            obj.token_hash = token_digest(obj.token)
+        return super().bulk_create(objs, *args, **kwargs)
+
 class UserFCMToken(models.Model):
     """Model to store user FCM tokens for push notifications"""
-    token = models.CharField(max_length=500, unique=True)
+    token = models.CharField(max_length=500)
+    token_hash = models.BinaryField(max_length=16, unique=True, editable=False)
     user_agent = models.TextField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = UserFCMTokenQuerySet.as_manager()
+
     def __str__(self):
         return f"Token: {self.token[:50]}..."
 
+    def save(self, *args, **kwargs):
+        self.token_hash = token_digest(self.token)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'token' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'token_hash'}
+        super().save(*args, **kwargs)
+
     class Meta:
         db_table = 'user_fcm_tokens'
 
-class ScheduledNotification(models.Model):
+def content_digest(title, body):
+    """Return the 16-byte BLAKE2b digest identifying a notification payload"""
+    return hashlib.blake2b(f'{title}\x00{body}'.encode('utf-8'), digest_size=16).digest()
+
+class NotificationContentManager(models.Manager):
+    def intern(self, title, body):
+        """Return the shared content row for this payload, creating it if needed"""
+        digest = content_digest(title, body)
+        try:
+            return self.get(digest=digest)
+        except self.model.DoesNotExist:
+            pass
+        try:
+            with transaction.atomic():
+                return self.create(digest=digest, title=title, body=body)
+        except IntegrityError:
+            # Another request interned the same payload concurrently
+            return self.get(digest=digest)
+
+    def intern_many(self, payloads, batch_size=1000):
+        """
+        Intern many (title, body) pairs with set-based queries
+
+        Returns:
+            Dictionary mapping each (title, body) pair to its content id
+        """
+        by_digest = {content_digest(title, body): (title, body) for title, body in payloads}
+        self.bulk_create(
+            [self.model(digest=digest, title=title, body=body) for digest, (title, body) in by_digest.items()],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        ids = {}
+        digests = list(by_digest)
+        for start in range(0, len(digests), batch_size):
+            chunk = digests[start:start + batch_size]
+            for content_id, digest in self.filter(digest__in=chunk).values_list('id', 'digest'):
+                ids[by_digest[bytes(digest)]] = content_id
+        return ids
+
+class NotificationContent(models.Model):
+    """Deduplicated notification payload, shared by every row that sends it"""
+    digest = models.BinaryField(max_length=16, unique=True, editable=False)
+    title = models.CharField(max_length=200)
+    body = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = NotificationContentManager()
+
+    def __str__(self):
+        return self.title
+
+    class Meta:
+        db_table = 'notification_contents'
+
+class ContentPayloadMixin:
+    """Expose ``title`` and ``body`` of the shared content as plain attributes
+
+    Assigning either one (including through the model constructor) interns a
+    new content row on the next ``save()``.
+    """
+    _pending_title = None
+    _pending_body = None
+
+    @property
+    def title(self):
+        if self._pending_title is not None:
+            return self._pending_title
+        return self.content.title
+
+    @title.setter
+    def title(self, value):
+        self._pending_title = value
+
+    @property
+    def body(self):
+        if self._pending_body is not None:
+            return self._pending_body
+        return self.content.body
+
+    @body.setter
+    def body(self, value):
+        self._pending_body = value
+
+    def save(self, *args, **kwargs):
+        if self._pending_title is None and self._pending_body is None:
+            return super().save(*args, **kwargs)
+        # Intern and insert together so the purge never sees the content unreferenced
+        with transaction.atomic():
+            self.content = NotificationContent.objects.intern(self.title, self.body)
+            self._pending_title = self._pending_body = None
+            super().save(*args, **kwargs)
+
+class ScheduledNotificationQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create bypasses post_save, so push the new rows to the queue here
+        from .queues import enqueue_on_commit
+
+        created = super().bulk_create(objs, *args, **kwargs)
+        enqueue_on_commit(created)
+        return created
+
+class ScheduledNotification(ContentPayloadMixin, models.Model):
     """Model to store scheduled notifications"""
     PRIORITY_CHOICES = [
         ('low', 'Low'),
@@ -29,17 +159,26 @@ class ScheduledNotification(models.Model):
         ('pending', 'Pending'),
         ('sent', 'Sent'),
         ('failed', 'Failed'),
+        # Merged into another notification for the same token (see home.coalescing)
+        ('collapsed', 'Collapsed'),
+        # Past expires_at (or NOTIFICATION_MAX_STALENESS) before it could be sent
+        ('expired', 'Expired'),
     ]
     
-    title = models.CharField(max_length=200)
-    body = models.TextField()
+    content = models.ForeignKey(NotificationContent, on_delete=models.PROTECT)
     fcm_token = models.ForeignKey(UserFCMToken, on_delete=models.CASCADE)
     scheduled_at = models.DateTimeField()
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='normal')
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    # Due rows sharing a token and collapse key may be sent as one message
+    collapse_key = models.CharField(max_length=64, blank=True, null=True)
+    # Not sent after this; also bounds the FCM TTL
+    expires_at = models.DateTimeField(null=True, blank=True)
     sent_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ScheduledNotificationQuerySet.as_manager()
     
     def __str__(self):
         return f"{self.title} - {self.fcm_token.token[:30]}..."
@@ -47,3 +186,74 @@ class ScheduledNotification(models.Model):
     class Meta:
         db_table = 'scheduled_notifications'
         ordering = ['scheduled_at']
+        indexes = [
+            models.Index(fields=['status', 'scheduled_at'], name='sched_notif_status_sched_idx'),
+            # Admin changelist ordering and date filter
+            models.Index(fields=['scheduled_at', 'id'], name='sched_notif_sched_id_idx'),
+            # Bulk expiry of pending rows
+            models.Index(fields=['status', 'expires_at'], name='sched_notif_status_exp_idx'),
+        ]
+
+class NotificationHistory(ContentPayloadMixin, models.Model):
+    """Archive of sent and failed notifications moved out of the dispatch table
+
+    On PostgreSQL the table is range-partitioned by month on ``scheduled_at``;
+    partitions are created on demand by the ``archive_notifications`` command.
+    """
+    TERMINAL_STATUSES = ('sent', 'failed', 'collapsed', 'expired')
+
+    # Keeps the id the row had in scheduled_notifications
+    id = models.BigIntegerField(primary_key=True)
+    content = models.ForeignKey(NotificationContent, on_delete=models.PROTECT, related_name='+')
+    # Plain column rather than a foreign key: tokens may be purged later
+    fcm_token_id = models.BigIntegerField()
+    scheduled_at = models.DateTimeField()
+    priority = models.CharField(max_length=10, choices=ScheduledNotification.PRIORITY_CHOICES)
+    status = models.CharField(max_length=10, choices=ScheduledNotification.STATUS_CHOICES)
+    collapse_key = models.CharField(max_length=64, blank=True, null=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.title} ({self.status}, archived)"
+
+    class Meta:
+        db_table = 'notification_history'
+        ordering = ['-scheduled_at']
+        verbose_name_plural = 'notification history'
+        indexes = [
+            models.Index(fields=['status', 'scheduled_at'], name='notif_hist_status_sched_idx'),
+            models.Index(fields=['fcm_token_id'], name='notif_hist_token_idx'),
+        ]
+
+class NotificationEvent(models.Model):
+    """Delivery receipt or click reported back by the service worker
+
+    Rows are written in batches through the write-behind buffer in
+    ``home.events``; a repeated report of the same event is ignored.
+    """
+    EVENT_CHOICES = [
+        ('received', 'Received'),
+        ('clicked', 'Clicked'),
+    ]
+
+    # Plain column rather than a foreign key: notifications are archived and purged
+    notification_id = models.BigIntegerField()
+    event = models.CharField(max_length=10, choices=EVENT_CHOICES)
+    occurred_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Notification {self.notification_id} {self.event}"
+
+    class Meta:
+        db_table = 'notification_events'
+        ordering = ['-occurred_at']
+        constraints = [
+            models.UniqueConstraint(fields=['notification_id', 'event'], name='notif_event_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['occurred_at'], name='notif_event_occurred_idx'),
+        ]
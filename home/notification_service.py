@@ -1,4 +1,6 @@
+import asyncio
 import json
+import threading
 import time
 import base64
 import hashlib
@@ -6,13 +8,24 @@ import hmac
 import requests
 from datetime import datetime
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 import os
 import firebase_admin
 from firebase_admin import credentials, messaging, exceptions
 from django.utils import timezone
+from .backends import DeliveryBackend, web_push_topic
+from .metrics import fcm_send_latency
 
-class FCMNotificationService:
+# Longest TTL FCM accepts (4 weeks)
+FCM_MAX_TTL = 28 * 24 * 3600
+
+class FCMNotificationService(DeliveryBackend):
     """Service to send FCM notifications using Firebase Admin SDK"""
+
+    name = 'fcm'
+    # send_each() accepts up to 500 messages and already sends them in parallel
+    max_batch_size = 500
+    max_concurrency = 1
     
     def __init__(self):
         # Use the correct path to static directory
@@ -49,37 +62,76 @@ class FCMNotificationService:
         except Exception as e:
             print(f"❌ Error initializing Firebase: {str(e)}")
     
-    def send_notification(self, fcm_token, title, body, priority='high'):
-        """Send FCM notification using Firebase Admin SDK"""
+    def build_message(self, fcm_token, title, body, priority='high', notification_id=None, collapse_key=None,
+                      ttl=None):
+        """Build the FCM message for a single notification"""
+        headers = {}
+        if collapse_key:
+            headers['Topic'] = web_push_topic(collapse_key)
+        if ttl is not None:
+            ttl = min(ttl, FCM_MAX_TTL)
+            headers['TTL'] = str(ttl)
+        return messaging.Message(
+            notification=messaging.Notification(
+                title=title,
+                body=body
+            ),
+            # FCM data values must be strings; the service worker reports receipts and clicks with this id
+            data={'notification_id': str(notification_id)} if notification_id is not None else None,
+            webpush=messaging.WebpushConfig(
+                headers=headers or None,
+                notification=messaging.WebpushNotification(
+                    icon='https://cdn-icons-png.flaticon.com/512/3884/3884811.png',
+                    badge='https://cdn-icons-png.flaticon.com/512/3884/3884811.png',
+                    require_interaction=True,
+                    vibrate=[200, 100, 200]
+                )
+            ),
+            android=messaging.AndroidConfig(
+                priority='high' if priority == 'high' else 'normal',
+                collapse_key=collapse_key,
+                ttl=ttl
+            ),
+            token=fcm_token
+        )
+
+    # Errors that say more about FCM or our egress than about the token;
+    # the circuit breaker counts these (see home/circuit_breaker.py)
+    TRANSIENT_ERRORS = (
+        exceptions.UnavailableError,
+        exceptions.InternalError,
+        exceptions.DeadlineExceededError,
+        exceptions.UnknownError,
+        exceptions.UnauthenticatedError,
+        messaging.QuotaExceededError,
+    )
+
+    def _failure(self, error):
+        """Map an Admin SDK exception to a metrics outcome, an error message and whether it is transient"""
+        transient = isinstance(error, self.TRANSIENT_ERRORS) or not isinstance(error, exceptions.FirebaseError)
+        if isinstance(error, messaging.UnregisteredError):
+            return 'unregistered', 'FCM token is not registered or invalid', False
+        if isinstance(error, exceptions.InvalidArgumentError):
+            return 'invalid_argument', f'Invalid argument: {str(error)}', False
+        if isinstance(error, messaging.QuotaExceededError):
+            return 'quota_exceeded', 'Quota exceeded', True
+        return 'error', str(error), transient
+
+    def send_message(self, message):
+        """Send a prebuilt FCM message and return a result dict"""
+        start = time.perf_counter()
+        outcome = 'error'
         try:
             if not firebase_admin._apps:
+                outcome = 'not_initialized'
                 return {
                     'success': False,
                     'error': 'Firebase not initialized'
                 }
             
-            # Create notification message
-            message = messaging.Message(
-                notification=messaging.Notification(
-                    title=title,
-                    body=body
-                ),
-                webpush=messaging.WebpushConfig(
-                    notification=messaging.WebpushNotification(
-                        icon='https://cdn-icons-png.flaticon.com/512/3884/3884811.png',
-                        badge='https://cdn-icons-png.flaticon.com/512/3884/3884811.png',
-                        require_interaction=True,
-                        vibrate=[200, 100, 200]
-                    )
-                ),
-                android=messaging.AndroidConfig(
-                    priority='high' if priority == 'high' else 'normal'
-                ),
-                token=fcm_token
-            )
-            
             # Send the message
             response = messaging.send(message)
+            outcome = 'success'
             
             return {
                 'success': True,
@@ -87,26 +139,306 @@ class FCMNotificationService:
                 'sent_at': timezone.now()
             }
             
-        except messaging.UnregisteredError:
-            return {
-                'success': False,
-                'error': 'FCM token is not registered or invalid'
-            }
-        except exceptions.InvalidArgumentError as e:
-            return {
-                'success': False,
-                'error': f'Invalid argument: {str(e)}'
-            }
-        except messaging.QuotaExceededError:
-            return {
-                'success': False,
-                'error': 'Quota exceeded'
-            }
         except Exception as e:
+            outcome, error, transient = self._failure(e)
             return {
                 'success': False,
-                'error': str(e)
+                'error': error,
+                'transient': transient
+            }
+        finally:
+            fcm_send_latency.observe(time.perf_counter() - start, outcome=outcome)
+
+    def send_batch(self, messages):
+        """Send up to 500 prebuilt FCM messages with one send_each() call"""
+        start = time.perf_counter()
+        if not firebase_admin._apps:
+            outcomes = ['not_initialized'] * len(messages)
+            results = [{'success': False, 'error': 'Firebase not initialized'} for _ in messages]
+        else:
+            try:
+                response = messaging.send_each(messages)
+            except Exception as e:
+                outcome, error, transient = self._failure(e)
+                outcomes = [outcome] * len(messages)
+                results = [{'success': False, 'error': error, 'transient': transient} for _ in messages]
+            else:
+                sent_at = timezone.now()
+                outcomes = []
+                results = []
+                for item in response.responses:
+                    if item.success:
+                        outcomes.append('success')
+                        results.append({
+                            'success': True,
+                            'messageId': item.message_id,
+                            'sent_at': sent_at
+                        })
+                    else:
+                        outcome, error, transient = self._failure(item.exception)
+                        outcomes.append(outcome)
+                        results.append({
+                            'success': False,
+                            'error': error,
+                            'transient': transient
+                        })
+
+        # Messages in a batch are sent in parallel, so each one took about as long as the batch
+        elapsed = time.perf_counter() - start
+        for outcome in outcomes:
+            fcm_send_latency.observe(elapsed, outcome=outcome)
+        return results
+
+FCM_SCOPES = ['https://www.googleapis.com/auth/firebase.messaging']
+
+
+class AccessTokenCache:
+    """
+    Cache an OAuth2 access token and refresh it before it expires
+
+    Wraps google-auth service account credentials; the token is refreshed
+    ``refresh_margin`` seconds ahead of its expiry so no send starts with a
+    token that is about to lapse. A static ``access_token`` can be given
+    instead, for emulators and local stand-in servers.
+    """
+
+    def __init__(self, credentials=None, access_token=None, refresh_margin=300):
+        self.credentials = credentials
+        self.static_token = access_token
+        self.refresh_margin = refresh_margin
+        self.refreshes = 0
+        self._lock = threading.Lock()
+
+    def _fresh(self):
+        token = self.credentials.token
+        expiry = self.credentials.expiry
+        if not token or expiry is None:
+            return False
+        # google-auth expiries are naive UTC datetimes
+        remaining = (expiry - timezone.now().replace(tzinfo=None)).total_seconds()
+        return remaining > self.refresh_margin
+
+    def get(self):
+        if self.static_token:
+            return self.static_token
+        with self._lock:
+            if not self._fresh():
+                from google.auth.transport.requests import Request
+                self.credentials.refresh(Request())
+                self.refreshes += 1
+            return self.credentials.token
+
+    def invalidate(self):
+        """Force a refresh on the next get(), e.g. after a 401"""
+        if self.credentials is not None:
+            with self._lock:
+                self.credentials.token = None
+
+
+class FCMHttpV1Client:
+    """
+    Async FCM HTTP v1 client on a persistent, pooled HTTP/2 connection pool
+
+    Concurrent sends are multiplexed as HTTP/2 streams over a few
+    connections; ``max_in_flight`` bounds the number of outstanding
+    requests. It defaults to what the pool carries without queueing inside
+    httpx: ``STREAMS_PER_CONNECTION`` per connection over HTTP/2, one per
+    connection for plain ``http://`` URLs, which httpx speaks as HTTP/1.1.
+    """
+
+    STREAMS_PER_CONNECTION = 100
+
+    def __init__(self, project_id, base_url='https://fcm.googleapis.com', timeout=10.0,
+                 connect_timeout=5.0, pool_timeout=10.0, max_connections=10, max_in_flight=None, http2=True):
+        import httpx
+
+        self._httpx = httpx
+        self.url = f'/v1/projects/{project_id}/messages:send'
+        if max_in_flight is None:
+            multiplexed = http2 and base_url.startswith('https://')
+            max_in_flight = max_connections * (self.STREAMS_PER_CONNECTION if multiplexed else 1)
+        self.max_in_flight = max_in_flight
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            http2=http2,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout, pool=pool_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    @staticmethod
+    def _json_body(response):
+        """The response body as a dict, or an empty one when it is empty or not a JSON object"""
+        try:
+            body = response.json()
+        except ValueError:
+            return {}
+        return body if isinstance(body, dict) else {}
+
+    def _failure(self, response):
+        """Map an FCM v1 error response to a metrics outcome, an error message and whether it is transient"""
+        error = self._json_body(response).get('error')
+        if not isinstance(error, dict):
+            error = {}
+        message = error.get('message') or f'HTTP {response.status_code}'
+        codes = {detail.get('errorCode') for detail in error.get('details', []) if isinstance(detail, dict)}
+        codes.add(error.get('status'))
+        if 'UNREGISTERED' in codes:
+            return 'unregistered', 'FCM token is not registered or invalid', False
+        if 'INVALID_ARGUMENT' in codes:
+            return 'invalid_argument', f'Invalid argument: {message}', False
+        if 'QUOTA_EXCEEDED' in codes or response.status_code == 429:
+            return 'quota_exceeded', 'Quota exceeded', True
+        # 5xx and rejected credentials fail every send, whatever the token
+        return 'error', message, response.status_code >= 500 or response.status_code == 401
+
+    async def send(self, message, access_token, semaphore):
+        """Send one v1 message body; returns ``(outcome, result, status_code)``"""
+        start = time.perf_counter()
+        async with semaphore:
+            try:
+                response = await self.client.post(
+                    self.url, json=message, headers={'Authorization': f'Bearer {access_token}'}
+                )
+            except self._httpx.TimeoutException as e:
+                outcome, status = 'error', None
+                result = {'success': False, 'error': f'FCM request timed out: {e!r}', 'transient': True}
+            except self._httpx.HTTPError as e:
+                outcome, status = 'error', None
+                result = {'success': False, 'error': f'FCM request failed: {e!r}', 'transient': True}
+            else:
+                status = response.status_code
+                if response.is_success:
+                    outcome = 'success'
+                    result = {
+                        'success': True,
+                        # The message was accepted even if a proxy mangled the body
+                        'messageId': self._json_body(response).get('name'),
+                        'sent_at': timezone.now()
+                    }
+                else:
+                    outcome, error, transient = self._failure(response)
+                    result = {'success': False, 'error': error, 'transient': transient}
+        fcm_send_latency.observe(time.perf_counter() - start, outcome=outcome)
+        return outcome, result, status
+
+    async def send_many(self, messages, access_token):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        return await asyncio.gather(*(self.send(message, access_token, semaphore) for message in messages))
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class FCMHttpV1Service(DeliveryBackend):
+    """
+    FCM backend that talks to the HTTP v1 API directly instead of through the Admin SDK
+
+    The async client lives on a background event loop owned by this backend,
+    so its connection pool survives across ``send_batch()`` calls. Requires
+    ``httpx[http2]``. Options (``NOTIFICATION_BACKEND_OPTIONS``):
+    ``service_account_file``, ``project_id``, ``base_url``, ``timeout``,
+    ``connect_timeout``, ``pool_timeout``, ``max_connections``,
+    ``max_in_flight``, ``token_refresh_margin`` and ``access_token`` (a
+    static token for local stand-in servers).
+    """
+
+    name = 'fcm_v1'
+    # One call multiplexes the whole dispatcher batch, bounded by max_in_flight
+    max_batch_size = None
+    max_concurrency = 1
+
+    def __init__(self, service_account_file=None, project_id=None, access_token=None,
+                 token_refresh_margin=300, **client_options):
+        try:
+            import httpx  # noqa: F401
+        except ImportError:
+            raise ImproperlyConfigured('FCMHttpV1Service requires httpx[http2] (pip install "httpx[http2]")')
+
+        credentials = None
+        if not access_token:
+            from google.oauth2 import service_account
+
+            service_account_file = service_account_file or os.path.join(
+                settings.BASE_DIR, 'static', 'service-account.json'
+            )
+            credentials = service_account.Credentials.from_service_account_file(
+                service_account_file, scopes=FCM_SCOPES
+            )
+            project_id = project_id or credentials.project_id
+        if not project_id:
+            raise ImproperlyConfigured('FCMHttpV1Service needs a project_id')
+
+        self.project_id = project_id
+        self.tokens = AccessTokenCache(credentials, access_token, token_refresh_margin)
+        self._client_options = client_options
+        self._client = None
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        # Event loops and their connections do not survive fork(); rebuild them in child processes
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='fcm-http-v1', daemon=True).start()
+                self._client = FCMHttpV1Client(self.project_id, **self._client_options)
+                self._pid = os.getpid()
+        return self._loop
+
+    def build_message(self, fcm_token, title, body, priority='high', notification_id=None, collapse_key=None,
+                      ttl=None):
+        """Build the v1 request body, matching FCMNotificationService.build_message"""
+        message = {
+            'message': {
+                'token': fcm_token,
+                'notification': {'title': title, 'body': body},
+                'webpush': {
+                    'notification': {
+                        'icon': 'https://cdn-icons-png.flaticon.com/512/3884/3884811.png',
+                        'badge': 'https://cdn-icons-png.flaticon.com/512/3884/3884811.png',
+                        'requireInteraction': True,
+                        'vibrate': [200, 100, 200],
+                    }
+                },
+                'android': {'priority': 'high' if priority == 'high' else 'normal'},
             }
+        }
+        if notification_id is not None:
+            message['message']['data'] = {'notification_id': str(notification_id)}
+        headers = {}
+        if collapse_key:
+            message['message']['android']['collapse_key'] = collapse_key
+            headers['Topic'] = web_push_topic(collapse_key)
+        if ttl is not None:
+            ttl = min(ttl, FCM_MAX_TTL)
+            message['message']['android']['ttl'] = f'{ttl}s'
+            headers['TTL'] = str(ttl)
+        if headers:
+            message['message']['webpush']['headers'] = headers
+        return message
+
+    def send_batch(self, messages):
+        if not messages:
+            return []
+        loop = self._ensure_loop()
+        access_token = self.tokens.get()
+        replies = asyncio.run_coroutine_threadsafe(
+            self._client.send_many(messages, access_token), loop
+        ).result()
+        if any(status == 401 for _, _, status in replies):
+            self.tokens.invalidate()
+        return [result for _, result, _ in replies]
+
+    def close(self):
+        """Close pooled connections and stop the background loop"""
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                return
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = self._client = None
+
 
 # Global instance
 fcm_service = FCMNotificationService()
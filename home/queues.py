@@ -0,0 +1,427 @@
+"""
+Pluggable queues of due notifications
+
+The dispatcher takes its work from a queue instead of scanning
+``scheduled_notifications`` itself. ``scheduled_notifications`` stays the
+source of truth: queues only hold ``(notification id, scheduled_at,
+fcm_token_id)`` entries, and rows are always re-read with
+``status='pending'`` before they are sent, so a stale or duplicated entry
+is skipped rather than sent twice.
+
+Dispatchers may run as shards (``fetch_due(..., shard=(index, count))``).
+A shard owns the notifications whose ``fcm_token_id % count == index``,
+so every token is served by a single dispatcher and keeps its order.
+
+- ``DatabaseQueue`` (default): polls the table through the
+  ``(status, scheduled_at)`` index, as before.
+- ``MemoryQueue``: a heap in this process, for single-node setups where the
+  web process schedules and dispatches. It loads the pending rows on first
+  use and again every ``sync_interval`` seconds (default 60) to pick up rows
+  created by other processes.
+- ``RedisQueue``: a sorted set scored by ``scheduled_at`` (one per shard
+  with the ``shards`` option). A claim is one Lua script that takes the due
+  entries off the set and adds them to a second, claimed set, so concurrent
+  dispatchers never get the same entry. Claimed entries stay there until they
+  are settled, and are put back if a dispatcher dies before that.
+
+The queue is selected with the ``NOTIFICATION_QUEUE`` setting (a dotted
+path) and constructed with ``NOTIFICATION_QUEUE_OPTIONS``. Pending rows are
+pushed with ``enqueue_on_commit()`` whenever they are saved or bulk-created
+(the admin, scripts, API and plain ORM calls alike); ``sync()``
+(``send_scheduled_notifications --sync-queue``) re-pushes every pending row
+after switching queues or losing Redis data.
+"""
+
+import heapq
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import ScheduledNotification
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE = 'home.queues.DatabaseQueue'
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """Return the configured queue, constructing it once per process"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                path = getattr(settings, 'NOTIFICATION_QUEUE', DEFAULT_QUEUE)
+                options = getattr(settings, 'NOTIFICATION_QUEUE_OPTIONS', {})
+                _queue = import_string(path)(**options)
+    return _queue
+
+
+@contextmanager
+def override_queue(queue):
+    """Temporarily make ``queue`` the configured queue (benchmarks, tests)"""
+    global _queue
+    previous, _queue = _queue, queue
+    try:
+        yield queue
+    finally:
+        _queue = previous
+
+
+def enqueue_on_commit(notifications):
+    """Push pending ``notifications`` to the queue once the current transaction commits"""
+    queue = get_queue()
+    if not queue.holds_entries:
+        return
+    items = [
+        queue_item(notification) for notification in notifications
+        if notification.status == 'pending' and notification.pk is not None
+    ]
+    if not items:
+        return
+
+    def push():
+        try:
+            queue.enqueue(items)
+        except Exception as e:
+            # The rows are committed; sync() or the next DB-backed run picks them up
+            logger.warning('Could not enqueue %d notifications on %s: %s', len(items), queue.name, e)
+
+    transaction.on_commit(push)
+
+
+@receiver(post_save, sender=ScheduledNotification, dispatch_uid='home.queues.enqueue_saved')
+def _enqueue_saved(sender, instance, raw=False, **kwargs):
+    # Covers create() and save(); bulk_create() goes through the queryset
+    if not raw:
+        enqueue_on_commit([instance])
+
+
+def queue_item(notification):
+    return (notification.id, notification.scheduled_at, notification.fcm_token_id)
+
+
+def shard_filter(queryset, shard):
+    """Restrict ``queryset`` to the rows of ``shard``, an ``(index, count)`` pair"""
+    if shard is None or shard[1] == 1:
+        return queryset
+    index, count = shard
+    return queryset.alias(shard=F('fcm_token_id') % count).filter(shard=index)
+
+
+def due_queryset(now, shard=None):
+    return shard_filter(ScheduledNotification.objects.filter(
+        status='pending',
+        scheduled_at__lte=now
+    ), shard).select_related('fcm_token').order_by('scheduled_at', 'id')
+
+
+class NotificationQueue:
+    """
+    Base class for queues of ``(notification id, scheduled_at, fcm_token_id)`` entries
+
+    Subclasses implement ``enqueue()``, ``claim()`` and ``depth()``;
+    ``ack()`` and ``release()`` settle claimed entries.
+    """
+
+    name = 'base'
+    # False when the table itself is the queue and enqueue() does nothing
+    holds_entries = True
+
+    def enqueue(self, items):
+        """Add ``(id, scheduled_at, fcm_token_id)`` items; re-adding an id updates its time"""
+        raise NotImplementedError
+
+    def claim(self, now, limit, shard=None):
+        """Remove and return up to ``limit`` ids of ``shard`` scheduled at or before ``now``"""
+        raise NotImplementedError
+
+    def ack(self, ids):
+        """Forget claimed ids whose rows were sent, failed or no longer exist"""
+
+    def release(self, items):
+        """Return claimed items to the queue (deferred, dry run)"""
+        self.enqueue(items)
+
+    def depth(self):
+        """Entries waiting in the queue"""
+        raise NotImplementedError
+
+    def fetch_due(self, now, limit, shard=None):
+        """
+        Claim up to ``limit`` due entries of ``shard`` and load their pending rows
+
+        Entries whose row is gone or no longer pending are acknowledged and
+        skipped; rows rescheduled to a later time go back into the queue.
+        """
+        while True:
+            ids = self.claim(now, limit, shard)
+            if not ids:
+                return []
+            batch = list(
+                ScheduledNotification.objects.filter(id__in=ids, status='pending')
+                .select_related('fcm_token').order_by('scheduled_at', 'id')
+            )
+            found = {notification.id for notification in batch}
+            gone = [pk for pk in ids if pk not in found]
+            if gone:
+                self.ack(gone)
+            early = [notification for notification in batch if notification.scheduled_at > now]
+            if early:
+                self.release([queue_item(notification) for notification in early])
+                batch = [notification for notification in batch if notification.scheduled_at <= now]
+            if batch:
+                return batch
+
+    def sync(self, chunk_size=5000, shard=None):
+        """Push every pending row (of ``shard``) into the queue; returns the number pushed"""
+        rows = (
+            shard_filter(ScheduledNotification.objects.filter(status='pending'), shard)
+            .order_by('id').values_list('id', 'scheduled_at', 'fcm_token_id')
+        )
+        pushed = 0
+        chunk = []
+        for row in rows.iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                self.enqueue(chunk)
+                pushed += len(chunk)
+                chunk = []
+        if chunk:
+            self.enqueue(chunk)
+            pushed += len(chunk)
+        return pushed
+
+
+class DatabaseQueue(NotificationQueue):
+    """The table is the queue: due rows are read through the (status, scheduled_at) index"""
+
+    name = 'database'
+    holds_entries = False
+
+    def enqueue(self, items):
+        pass
+
+    def release(self, items):
+        pass
+
+    def depth(self):
+        return ScheduledNotification.objects.filter(status='pending').count()
+
+    def fetch_due(self, now, limit, shard=None):
+        return list(due_queryset(now, shard)[:limit])
+
+    def sync(self, chunk_size=5000, shard=None):
+        return 0
+
+
+class MemoryQueue(NotificationQueue):
+    """
+    Process-local heap ordered by scheduled_at
+
+    A shard's dispatcher process only loads and serves that shard's rows.
+
+    Args:
+        sync_interval: Seconds between reloads of the pending rows from the
+            database, to pick up rows pushed by other processes (None: load
+            only on first use)
+    """
+
+    name = 'memory'
+
+    def __init__(self, sync_interval=60):
+        self.sync_interval = sync_interval
+        self._heap = []
+        # Current score per id; heap entries that no longer match are stale
+        self._scores = {}
+        self._lock = threading.Lock()
+        self._synced_at = None
+        self._shard = None
+
+    def enqueue(self, items):
+        with self._lock:
+            for pk, scheduled_at, _ in items:
+                score = scheduled_at.timestamp()
+                if self._scores.get(pk) != score:
+                    self._scores[pk] = score
+                    heapq.heappush(self._heap, (score, pk))
+
+    def claim(self, now, limit, shard=None):
+        cutoff = now.timestamp()
+        ids = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= cutoff and len(ids) < limit:
+                score, pk = heapq.heappop(self._heap)
+                if self._scores.get(pk) == score:
+                    del self._scores[pk]
+                    ids.append(pk)
+        return ids
+
+    def depth(self):
+        return len(self._scores)
+
+    def fetch_due(self, now, limit, shard=None):
+        if shard != self._shard:
+            with self._lock:
+                self._heap, self._scores, self._synced_at = [], {}, None
+            self._shard = shard
+        if self._synced_at is None or (
+            self.sync_interval is not None and time.monotonic() - self._synced_at >= self.sync_interval
+        ):
+            self.sync(shard=shard)
+        return super().fetch_due(now, limit, shard)
+
+    def sync(self, chunk_size=5000, shard=None):
+        self._synced_at = time.monotonic()
+        return super().sync(chunk_size, shard)
+
+
+# Pop up to ARGV[2] ids scored at most ARGV[1] from KEYS[1] and claim them in
+# KEYS[2] until the deadline ARGV[3], in one atomic step. unpack() is chunked
+# to stay below Lua's stack limit.
+CLAIM_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for start = 1, #ids, 1000 do
+    local chunk, claimed = {}, {}
+    for i = start, math.min(start + 999, #ids) do
+        chunk[#chunk + 1] = ids[i]
+        claimed[#claimed + 1] = ARGV[3]
+        claimed[#claimed + 1] = ids[i]
+    end
+    redis.call('ZREM', KEYS[1], unpack(chunk))
+    redis.call('ZADD', KEYS[2], unpack(claimed))
+end
+return ids
+"""
+
+
+class RedisQueue(NotificationQueue):
+    """
+    Redis sorted sets of notification ids scored by scheduled_at
+
+    With ``shards`` > 1 every shard has its own set (``<key>:<index>``), and
+    sharded dispatchers must run with ``--num-shards`` equal to ``shards``.
+
+    Args:
+        url: Redis URL (default: the ``REDIS_URL`` setting)
+        key: Sorted set holding queued ids; ``<key>:claimed`` holds claimed ones
+        visibility_timeout: Seconds a claimed id may stay unsettled before it
+            is queued again
+        shards: Number of shard sets entries are spread over by token id
+        client: Ready-made redis client (tests, fakeredis)
+    """
+
+    name = 'redis'
+
+    def __init__(self, url=None, key='notifications:due', visibility_timeout=300, shards=1, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured('RedisQueue requires redis (pip install redis)')
+            client = redis.Redis.from_url(url or getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0'))
+        self.client = client
+        self.key = key
+        self.visibility_timeout = visibility_timeout
+        self.shards = shards
+        self.keys = [key] if shards == 1 else [f'{key}:{index}' for index in range(shards)]
+        self.claimed_keys = [f'{queue_key}:claimed' for queue_key in self.keys]
+        self._claim_script = client.register_script(CLAIM_SCRIPT)
+
+    def _shard_index(self, fcm_token_id):
+        return fcm_token_id % self.shards
+
+    def _shard_indexes(self, shard):
+        if shard is None:
+            return range(self.shards)
+        if shard[1] != self.shards:
+            raise ImproperlyConfigured(
+                f'RedisQueue has {self.shards} shards but the dispatcher runs with {shard[1]}'
+            )
+        return [shard[0]]
+
+    def _group(self, items):
+        groups = {}
+        for pk, scheduled_at, fcm_token_id in items:
+            groups.setdefault(self._shard_index(fcm_token_id), {})[str(pk)] = scheduled_at.timestamp()
+        return groups
+
+    def enqueue(self, items, chunk_size=1000):
+        items = list(items)
+        with self.client.pipeline(transaction=False) as pipe:
+            for start in range(0, len(items), chunk_size):
+                for index, mapping in self._group(items[start:start + chunk_size]).items():
+                    pipe.zadd(self.keys[index], mapping)
+            pipe.execute()
+
+    def _recover(self, index):
+        """Queue again ids whose claim timed out (their dispatcher died)"""
+        queue_key, claimed_key = self.keys[index], self.claimed_keys[index]
+        # Claim deadlines are wall-clock times, independent of any run's ``now``
+        expired = self.client.zrangebyscore(claimed_key, '-inf', time.time(), start=0, num=1000)
+        if not expired:
+            return
+        # Rows that were settled meanwhile are dropped; the others keep their own scheduled_at
+        pending = ScheduledNotification.objects.filter(
+            id__in=[int(member) for member in expired], status='pending'
+        ).values_list('id', 'scheduled_at')
+        requeue = {str(pk): scheduled_at.timestamp() for pk, scheduled_at in pending}
+        with self.client.pipeline() as pipe:
+            if requeue:
+                pipe.zadd(queue_key, requeue)
+            pipe.zrem(claimed_key, *expired)
+            pipe.execute()
+        if requeue:
+            logger.warning('Re-queued %d notifications with expired claims', len(requeue))
+
+    def _claim_from(self, index, cutoff, limit):
+        queue_key, claimed_key = self.keys[index], self.claimed_keys[index]
+        self._recover(index)
+        deadline = time.time() + self.visibility_timeout
+        ids = self._claim_script(keys=[queue_key, claimed_key], args=[repr(cutoff), limit, repr(deadline)])
+        return [int(member) for member in ids]
+
+    def claim(self, now, limit, shard=None):
+        cutoff = now.timestamp()
+        ids = []
+        for index in self._shard_indexes(shard):
+            ids.extend(self._claim_from(index, cutoff, limit - len(ids)))
+            if len(ids) >= limit:
+                break
+        return ids
+
+    def ack(self, ids):
+        if ids:
+            members = [str(pk) for pk in ids]
+            # Acknowledged ids may come from any shard set when running unsharded
+            with self.client.pipeline(transaction=False) as pipe:
+                for claimed_key in self.claimed_keys:
+                    pipe.zrem(claimed_key, *members)
+                pipe.execute()
+
+    def release(self, items):
+        groups = self._group(items)
+        if not groups:
+            return
+        with self.client.pipeline() as pipe:
+            for index, mapping in groups.items():
+                pipe.zadd(self.keys[index], mapping)
+                pipe.zrem(self.claimed_keys[index], *mapping)
+            pipe.execute()
+
+    def depth(self):
+        with self.client.pipeline(transaction=False) as pipe:
+            for queue_key in self.keys:
+                pipe.zcard(queue_key)
+            return sum(pipe.execute())
@@ -0,0 +1,85 @@
+"""
+Sharded dispatch across processes
+
+``send_scheduled_notifications --shard K --num-shards N`` runs a dispatcher
+that only serves notifications whose ``fcm_token_id % N == K``. Shards share
+nothing but the database and the queue, so they can run as separate
+processes on one host or on several hosts without coordinating, and all
+notifications of a token are still sent in order by a single shard.
+
+With ``--num-shards N`` and no ``--shard``, the command acts as a
+supervisor: ``run_shards()`` forks one worker per shard with a
+multiprocessing pool and adds up their summaries.
+"""
+
+import multiprocessing
+
+from django.db import connections
+
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN
+
+SUMMARY_COUNTS = ('processed', 'sent', 'failed', 'collapsed', 'expired', 'deferred', 'batches')
+
+
+def validate_shard(shard, num_shards):
+    """Raise ValueError unless ``shard`` (or None) is a valid index out of ``num_shards``"""
+    if num_shards < 1:
+        raise ValueError('--num-shards must be at least 1')
+    if shard is not None and not 0 <= shard < num_shards:
+        raise ValueError(f'--shard must be between 0 and {num_shards - 1}')
+
+
+def run_shard(shard, num_shards, limit=None, batch_size=None, dry_run=False, adaptive=False):
+    """Run one dispatch pass for ``shard`` and return its summary (pool worker entry point)"""
+    from .adaptive import get_batch_sizer
+    from .backends import get_backend
+    from .dispatcher import NotificationDispatcher
+
+    try:
+        sizer = get_batch_sizer(get_backend(), batch_size or limit) if adaptive else None
+        dispatcher = NotificationDispatcher(
+            dry_run=dry_run, source='shard', shard=(shard, num_shards), sizer=sizer
+        )
+        summary = dispatcher.run(limit, batch_size)
+    finally:
+        connections.close_all()
+    summary['shard'] = shard
+    return summary
+
+
+def _init_worker():
+    # Needed under the spawn start method; a no-op for forked workers
+    import django
+    django.setup()
+
+
+def combine_summaries(summaries):
+    """Add up shard summaries; the breaker state is the worst one reported"""
+    totals = {key: sum(summary[key] for summary in summaries) for key in SUMMARY_COUNTS}
+    states = {summary['circuit_breaker'] for summary in summaries}
+    totals['circuit_breaker'] = next((state for state in (OPEN, HALF_OPEN) if state in states), CLOSED)
+    return totals
+
+
+def run_shards(num_shards, limit=None, batch_size=None, dry_run=False, adaptive=False):
+    """
+    Run all ``num_shards`` shards in parallel worker processes
+
+    Args:
+        num_shards: Number of shards, and of worker processes
+        limit: Most notifications each shard processes (all when None)
+        batch_size: Rows per batch in each shard
+        dry_run: Run the shards without sending
+        adaptive: Let each shard size its own batches (see ``home.adaptive``)
+
+    Returns:
+        (per-shard summaries ordered by shard, combined summary)
+    """
+    # Forked workers must open their own connections, not share the parent's sockets
+    connections.close_all()
+    with multiprocessing.Pool(num_shards, initializer=_init_worker) as pool:
+        summaries = pool.starmap(
+            run_shard,
+            [(shard, num_shards, limit, batch_size, dry_run, adaptive) for shard in range(num_shards)],
+        )
+    return summaries, combine_summaries(summaries)
@@ -1,6 +1,21 @@
 // Firebase messaging service worker
 console.log('Service Worker: Starting...');
 
+// Report a delivery receipt or click back to the API. Events are buffered
+// server-side, so this is a cheap fire-and-forget request.
+function reportNotificationEvent(data, kind) {
+    const notificationId = data && data.notification_id;
+    if (!notificationId) {
+        return Promise.resolve();
+    }
+    return fetch(`/api/notifications/${encodeURIComponent(notificationId)}/${kind}/`, {
+        method: 'POST',
+        keepalive: true
+    }).catch((error) => {
+        console.log(`Service Worker: Could not report ${kind}:`, error);
+    });
+}
+
 // Handle service worker installation
 self.addEventListener('install', (event) => {
     console.log('Service Worker: Installing...');
@@ -30,9 +45,10 @@ self.addEventListener('push', (event) => {
                 data: payload.data || {}
             };
             
-            event.waitUntil(
-                self.registration.showNotification(notificationTitle, notificationOptions)
-            );
+            event.waitUntil(Promise.all([
+                self.registration.showNotification(notificationTitle, notificationOptions),
+                reportNotificationEvent(notificationOptions.data, 'receipt')
+            ]));
         } catch (error) {
             console.error('Service Worker: Error parsing push data:', error);
             
@@ -68,6 +84,7 @@ self.addEventListener('notificationclick', (event) => {
     console.log('Service Worker: Notification clicked:', event);
     
     event.notification.close();
+    event.waitUntil(reportNotificationEvent(event.notification.data, 'click'));
     
     // Handle notification click - you can customize this
     if (event.notification.data && event.notification.data.url) {
@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from home.adaptive import AdaptiveBatchSizer
+
+
+class AdaptiveBatchSizerTests(SimpleTestCase):
+    def setUp(self):
+        self.sizer = AdaptiveBatchSizer(
+            'test', initial_size=100, min_batch_size=10, max_batch_size=1000, max_concurrency=4,
+            target_send_seconds=1.0, max_error_rate=0.1, backlog_seconds=30,
+        )
+
+    def run_batch(self, fetched=None, lag=0, send_seconds=0.1, transient=0, cap=None, results=None):
+        """Feed one batch through the sizer's hooks, as the dispatcher would"""
+        requested = self.sizer.next_batch_size(cap)
+        fetched = requested if fetched is None else fetched
+        scheduled_at = timezone.now() - timedelta(seconds=lag)
+        self.sizer.batch_fetched(1, [SimpleNamespace(scheduled_at=scheduled_at)] * fetched)
+        self.sizer.phase_finished(1, 'send', send_seconds)
+        for index in range(fetched):
+            result = {'success': index >= transient, 'transient': index < transient}
+            self.sizer.notification_processed(None, results[index] if results else result)
+        self.sizer.batch_finished(1, fetched)
+        return requested
+
+    def test_transient_errors_halve_the_batch_and_drop_concurrency(self):
+        self.sizer.concurrency = 3
+
+        self.run_batch(transient=20)
+
+        self.assertEqual((self.sizer.batch_size, self.sizer.concurrency), (50, 2))
+
+    def test_slow_sends_shrink_the_batch(self):
+        self.run_batch(send_seconds=2.0)
+
+        self.assertEqual(self.sizer.batch_size, 75)
+
+    def test_backlog_grows_batch_and_concurrency(self):
+        self.run_batch(lag=60, send_seconds=0.1)
+
+        self.assertEqual((self.sizer.batch_size, self.sizer.concurrency), (200, 2))
+
+    def test_backlog_growth_stays_within_the_send_target(self):
+        self.run_batch(lag=60, send_seconds=0.6)
+
+        # 100 rows took 0.6s, so 150 fit in 90% of the 1s target
+        self.assertEqual(self.sizer.batch_size, 150)
+
+    def test_idle_batches_return_to_the_initial_size(self):
+        self.sizer.batch_size, self.sizer.concurrency = 400, 3
+
+        self.run_batch(fetched=5)
+
+        self.assertEqual((self.sizer.batch_size, self.sizer.concurrency), (200, 2))
+        self.run_batch(fetched=5)
+        self.run_batch(fetched=5)
+        self.assertEqual(self.sizer.batch_size, 100)
+
+    def test_idle_batches_below_the_initial_size_grow_back(self):
+        self.sizer.batch_size = 25
+
+        self.run_batch(fetched=5)
+
+        self.assertEqual(self.sizer.batch_size, 50)
+
+    def test_healthy_batches_keep_the_size(self):
+        self.run_batch(lag=1)
+
+        self.assertEqual((self.sizer.batch_size, self.sizer.concurrency), (100, 1))
+
+    def test_capped_batch_is_not_mistaken_for_idle(self):
+        requested = self.run_batch(lag=60, cap=20)
+
+        self.assertEqual(requested, 20)
+        self.assertGreater(self.sizer.batch_size, 100)
+
+    def test_rows_that_were_not_sent_do_not_count_as_errors(self):
+        results = (
+            [{'success': False, 'collapsed': True}] * 50
+            + [{'success': False, 'grouped': True, 'transient': True}] * 50
+        )
+
+        self.run_batch(lag=1, results=results)
+
+        self.assertEqual(self.sizer.batch_size, 100)
+
+    def test_sizes_stay_within_bounds(self):
+        self.sizer.batch_size = 800
+        self.run_batch(lag=60, send_seconds=0.01)
+        self.assertEqual(self.sizer.batch_size, 1000)
+
+        self.sizer.batch_size = 15
+        self.run_batch(transient=15)
+        self.assertEqual(self.sizer.batch_size, 10)
+
+    def test_results_from_send_threads_are_all_counted(self):
+        self.sizer.concurrency = 3
+        self.sizer.next_batch_size()
+        self.sizer.batch_fetched(1, [SimpleNamespace(scheduled_at=timezone.now())] * 100)
+        results = [{'success': False, 'transient': True}] * 50 + [{'success': True}] * 9950
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda result: self.sizer.notification_processed(None, result), results))
+
+        self.assertEqual((self.sizer._results, self.sizer._transient), (10000, 50))
+        self.sizer.batch_finished(1, 100)
+        self.assertEqual(self.sizer.concurrency, 3)
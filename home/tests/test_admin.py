@@ -0,0 +1,89 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from home.admin import EstimatedCountPaginator
+from home.models import NotificationContent, ScheduledNotification, UserFCMToken
+
+from .utils import create_notification, create_token
+
+
+class AdminTestCase(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        self.token = create_token()
+
+
+class ScheduledNotificationAdminTests(AdminTestCase):
+    def form_data(self, **data):
+        scheduled_at = timezone.localtime()
+        return {
+            'fcm_token': self.token.id, 'title': 'Hello', 'body': 'World',
+            'scheduled_at_0': scheduled_at.strftime('%Y-%m-%d'), 'scheduled_at_1': scheduled_at.strftime('%H:%M:%S'),
+            'priority': 'normal', 'status': 'pending', **data,
+        }
+
+    def test_add_form_interns_the_text(self):
+        response = self.client.post('/admin/home/schedulednotification/add/', self.form_data())
+
+        self.assertEqual(response.status_code, 302)
+        notification = ScheduledNotification.objects.get()
+        self.assertEqual((notification.title, notification.body), ('Hello', 'World'))
+
+    def test_change_form_shows_and_edits_the_text(self):
+        notification = create_notification(self.token, title='Before', body='Body')
+        url = f'/admin/home/schedulednotification/{notification.id}/change/'
+
+        self.assertContains(self.client.get(url), 'value="Before"')
+        response = self.client.post(url, self.form_data(title='After'))
+
+        self.assertEqual(response.status_code, 302)
+        notification.refresh_from_db()
+        self.assertEqual(notification.title, 'After')
+        self.assertEqual(NotificationContent.objects.filter(title='Before').count(), 1)
+
+    def test_shared_text_is_reused(self):
+        existing = create_notification(self.token, title='Hello', body='World')
+
+        self.client.post('/admin/home/schedulednotification/add/', self.form_data())
+
+        self.assertEqual(set(ScheduledNotification.objects.values_list('content_id', flat=True)), {existing.content_id})
+
+
+class ChangelistTests(AdminTestCase):
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_notification_changelist_queries_do_not_grow_with_rows(self):
+        create_notification(self.token)
+        few = self.changelist_queries('/admin/home/schedulednotification/')
+        for index in range(5):
+            create_notification(create_token(f'token-{index}'), title=f'Title {index}')
+
+        self.assertEqual(self.changelist_queries('/admin/home/schedulednotification/'), few)
+
+    def test_token_search_matches_the_whole_token_by_digest(self):
+        create_token('another-token')
+
+        response = self.client.get('/admin/home/userfcmtoken/', {'q': 'token'})
+
+        self.assertEqual([token.token for token in response.context['cl'].result_list], ['token'])
+
+    def test_large_tables_use_the_estimate(self):
+        paginator = EstimatedCountPaginator(UserFCMToken.objects.order_by('id'), 100)
+
+        with mock.patch('home.admin.estimated_count', return_value=5_000_000):
+            self.assertEqual(paginator.count, 5_000_000)
+
+    def test_small_results_are_counted_exactly(self):
+        paginator = EstimatedCountPaginator(UserFCMToken.objects.order_by('id'), 100)
+
+        with mock.patch('home.admin.estimated_count', return_value=10):
+            self.assertEqual(paginator.count, 1)
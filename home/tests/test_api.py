@@ -0,0 +1,50 @@
+from django.test import SimpleTestCase
+
+from home.api import ApiError, Field, Schema
+
+
+class SchemaTests(SimpleTestCase):
+    def setUp(self):
+        self.schema = Schema({
+            'token': Field(max_length=10),
+            'priority': Field(required=False, default='normal', choices=('high', 'normal')),
+            'count': Field(int, required=False, default=1),
+            'delay': Field((int, float), required=False, parse=float, error='Invalid delay'),
+            'enabled': Field(bool, required=False, default=False),
+        })
+
+    def assertRejected(self, data, message, schema=None):
+        with self.assertRaises(ApiError) as caught:
+            (schema or self.schema).validate(data)
+        self.assertEqual(caught.exception.message, message)
+        self.assertEqual(caught.exception.status, 400)
+
+    def test_valid_payload_gets_defaults(self):
+        self.assertEqual(
+            self.schema.validate({'token': 'abc', 'delay': 2, 'extra': 'ignored'}),
+            {'token': 'abc', 'priority': 'normal', 'count': 1, 'delay': 2.0, 'enabled': False},
+        )
+
+    def test_missing_required_fields(self):
+        self.assertRejected({'token': ''}, 'Missing required fields: token')
+        schema = Schema({'token': Field()}, missing_error='Token is required')
+        self.assertRejected({}, 'Token is required', schema)
+
+    def test_wrong_types(self):
+        self.assertRejected({'token': 123}, 'token must be a string of at most 10 characters')
+        self.assertRejected({'token': 'abc', 'count': '3'}, 'Invalid count')
+
+    def test_bool_is_not_an_int(self):
+        self.assertRejected({'token': 'abc', 'count': True}, 'Invalid count')
+        self.assertTrue(self.schema.validate({'token': 'abc', 'enabled': True})['enabled'])
+
+    def test_length_and_choices(self):
+        self.assertRejected({'token': 'x' * 11}, 'token must be a string of at most 10 characters')
+        self.assertRejected({'token': 'abc', 'priority': 'urgent'}, 'priority must be one of high, normal')
+
+    def test_parse_errors_use_the_field_error(self):
+        schema = Schema({'at': Field(parse=lambda value: int(value), error='Invalid time')})
+        self.assertRejected({'at': 'soon'}, 'Invalid time', schema)
+
+    def test_payload_must_be_an_object(self):
+        self.assertRejected(['token'], 'Expected a JSON object')
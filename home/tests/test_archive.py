@@ -0,0 +1,50 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from home.maintenance import archive_notifications
+from home.models import NotificationHistory, ScheduledNotification
+
+from .utils import create_notification, create_token
+
+DAY = 24 * 3600
+
+
+class ArchiveNotificationsTests(TestCase):
+    def setUp(self):
+        self.token = create_token()
+
+    def test_moves_old_terminal_rows_only(self):
+        sent = create_notification(self.token, seconds_ago=40 * DAY, status='sent', title='Old')
+        pending = create_notification(self.token, seconds_ago=40 * DAY)
+        recent = create_notification(self.token, seconds_ago=DAY, status='failed')
+
+        result = archive_notifications(timezone.now() - timedelta(days=30), chunk_size=1)
+
+        self.assertEqual(result['archived'], 1)
+        self.assertEqual(
+            set(ScheduledNotification.objects.values_list('id', flat=True)), {pending.id, recent.id}
+        )
+        archived = NotificationHistory.objects.get()
+        self.assertEqual((archived.id, archived.status, archived.title), (sent.id, 'sent', 'Old'))
+        self.assertIsNotNone(archived.archived_at)
+
+    def test_status_filter(self):
+        create_notification(self.token, seconds_ago=40 * DAY, status='sent')
+        failed = create_notification(self.token, seconds_ago=40 * DAY, status='failed')
+
+        archive_notifications(timezone.now() - timedelta(days=30), statuses=['failed'])
+
+        self.assertEqual(list(NotificationHistory.objects.values_list('id', flat=True)), [failed.id])
+
+    def test_command_reports_the_count(self):
+        create_notification(self.token, seconds_ago=40 * DAY, status='sent')
+        out = StringIO()
+
+        call_command('archive_notifications', '--older-than-days', '30', stdout=out)
+
+        self.assertIn('Archived 1 notifications', out.getvalue())
+        self.assertFalse(ScheduledNotification.objects.exists())
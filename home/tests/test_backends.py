@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from home import backends
+from home.backends import FileBackend, MemoryBackend, get_backend, override_backend
+from home.dispatcher import NotificationDispatcher
+from home.queues import DatabaseQueue
+
+from .utils import closed_breaker, create_notification, create_token, statuses
+
+try:
+    import pywebpush
+except ImportError:
+    pywebpush = None
+
+
+class RecordingBackend(MemoryBackend):
+    """Memory backend that accepts at most two messages per call"""
+
+    max_batch_size = 2
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def send_batch(self, messages):
+        self.batches.append(len(messages))
+        return super().send_batch(messages)
+
+
+class BackendSelectionTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(setattr, backends, '_backend', backends._backend)
+        backends._backend = None
+
+    @override_settings(NOTIFICATION_BACKEND='home.backends.FileBackend',
+                       NOTIFICATION_BACKEND_OPTIONS={'path': 'out.ndjson'})
+    def test_builds_the_configured_backend_once(self):
+        backend = get_backend()
+
+        self.assertIsInstance(backend, FileBackend)
+        self.assertEqual(backend.path, 'out.ndjson')
+        self.assertIs(get_backend(), backend)
+
+    def test_override_restores_the_previous_backend(self):
+        backends._backend = previous = MemoryBackend()
+
+        with override_backend(MemoryBackend()) as backend:
+            self.assertIs(get_backend(), backend)
+        self.assertIs(get_backend(), previous)
+
+
+class MemoryBackendTests(SimpleTestCase):
+    def test_records_messages_and_answers_in_order(self):
+        backend = MemoryBackend()
+        messages = [backend.build_message(f't{i}', 'Title', 'Body', notification_id=i) for i in range(3)]
+
+        results = backend.send_batch(messages)
+
+        self.assertEqual([result['messageId'] for result in results], ['memory/1', 'memory/2', 'memory/3'])
+        self.assertEqual([message['notification_id'] for message in backend.outbox], [0, 1, 2])
+
+    def test_send_notification_reports_build_errors(self):
+        backend = MemoryBackend()
+
+        with mock.patch.object(backend, 'build_message', side_effect=ValueError('bad token')):
+            result = backend.send_notification('t', 'Title', 'Body')
+
+        self.assertEqual(result, {'success': False, 'error': 'bad token'})
+        self.assertEqual(backend.outbox, [])
+
+    def test_file_backend_appends_ndjson(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = FileBackend(path=os.path.join(directory, 'sent.ndjson'))
+            backend.send_batch([backend.build_message('t', 'Title', 'Body')])
+            backend.send_batch([backend.build_message('u', 'Title', 'Body')])
+
+            with open(backend.path) as f:
+                self.assertEqual([json.loads(line)['token'] for line in f], ['t', 'u'])
+
+
+class DispatchThroughBackendTests(TestCase):
+    def test_sends_are_split_to_the_backend_batch_size(self):
+        token = create_token()
+        notifications = [create_notification(token, seconds_ago=60 - i) for i in range(5)]
+        backend = RecordingBackend()
+        dispatcher = NotificationDispatcher(service=backend, breaker=closed_breaker(), queue=DatabaseQueue())
+
+        dispatcher.run(batch_size=10)
+
+        self.assertEqual(backend.batches, [2, 2, 1])
+        self.assertEqual(statuses(notifications), ['sent'] * 5)
+        self.assertEqual([message['notification_id'] for message in backend.outbox], [n.id for n in notifications])
+
+
+@unittest.skipIf(pywebpush is None, 'pywebpush is not installed')
+class WebPushBackendTests(SimpleTestCase):
+    def test_requires_vapid_settings(self):
+        with override_settings(WEBPUSH_VAPID_PRIVATE_KEY=None, WEBPUSH_VAPID_SUBJECT=None):
+            with self.assertRaises(ImproperlyConfigured):
+                backends.WebPushBackend()
+
+    @override_settings(WEBPUSH_VAPID_PRIVATE_KEY='key', WEBPUSH_VAPID_SUBJECT='mailto:ops@example.com')
+    def test_build_message_needs_a_push_subscription(self):
+        backend = backends.WebPushBackend(ttl=3600)
+        subscription = json.dumps({'endpoint': 'https://push.example/1', 'keys': {'p256dh': 'a', 'auth': 'b'}})
+
+        message = backend.build_message(subscription, 'Title', 'Body', priority='normal', collapse_key='k', ttl=7200)
+
+        self.assertEqual(message['headers']['Urgency'], 'normal')
+        self.assertIn('Topic', message['headers'])
+        self.assertEqual(message['ttl'], 3600)
+        with self.assertRaises(ValueError):
+            backend.build_message('not a subscription', 'Title', 'Body')
@@ -0,0 +1,126 @@
+from django.test import TestCase
+
+from home.backends import MemoryBackend
+from home.circuit_breaker import CLOSED, HALF_OPEN, OPEN
+from home.dispatcher import DispatchHooks, NotificationDispatcher
+from home.queues import DatabaseQueue
+
+from .utils import FailingBackend, closed_breaker, create_notification, create_token, statuses
+
+
+class BatchSizes(DispatchHooks):
+    def __init__(self):
+        self.sizes = []
+
+    def batch_fetched(self, batch_number, notifications):
+        self.sizes.append(len(notifications))
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.breaker = closed_breaker(failure_rate=0.5, min_calls=4, window=30, reset_timeout=10, probe_size=2)
+        self.clock = self.breaker.clock
+
+    def trip(self):
+        self.breaker.record(4, 4)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_opens_once_the_window_holds_enough_failing_calls(self):
+        self.breaker.record(2, 2)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.record(2, 0)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_calls_leave_the_window(self):
+        self.breaker.record(3, 3)
+        self.clock.advance(31)
+        self.breaker.record(2, 1)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_lets_one_probe_through(self):
+        self.trip()
+        self.clock.advance(9)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.clock.advance(1)
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_failing_probe_reopens(self):
+        self.trip()
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(2, 1)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.trips, 2)
+        self.assertEqual(self.breaker.snapshot()['retry_in'], 10)
+
+    def test_healthy_probe_closes(self):
+        self.trip()
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(2, 0)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.snapshot()['calls'], 0)
+
+    def test_disabled_breaker_always_allows(self):
+        self.breaker.enabled = False
+        self.breaker.record(10, 10)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CLOSED)
+
+
+class DispatcherBreakerTests(TestCase):
+    def setUp(self):
+        self.breaker = closed_breaker(failure_rate=0.5, min_calls=4, window=30, reset_timeout=10, probe_size=2)
+        token = create_token()
+        self.notifications = [create_notification(token, seconds_ago=60 - i) for i in range(6)]
+
+    def dispatch(self, backend, hooks=()):
+        dispatcher = NotificationDispatcher(
+            service=backend, breaker=self.breaker, queue=DatabaseQueue(), hooks=hooks
+        )
+        return dispatcher.run(batch_size=4)
+
+    def test_outage_leaves_rows_pending(self):
+        summary = self.dispatch(FailingBackend(error='Unavailable', transient=True))
+
+        self.assertEqual(summary['circuit_breaker'], OPEN)
+        self.assertEqual(summary['deferred'], 4)
+        self.assertEqual(summary['failed'], 0)
+        self.assertEqual(statuses(self.notifications), ['pending'] * 6)
+
+    def test_open_breaker_sends_nothing(self):
+        self.breaker.record(4, 4)
+        backend = MemoryBackend()
+
+        summary = self.dispatch(backend)
+
+        self.assertEqual(summary['processed'], 0)
+        self.assertEqual(backend.outbox, [])
+
+    def test_half_open_probe_failure_reopens_without_failing_rows(self):
+        self.breaker.record(4, 4)
+        self.breaker.clock.advance(10)
+        hook = BatchSizes()
+
+        summary = self.dispatch(FailingBackend(error='Unavailable', transient=True), hooks=[hook])
+
+        self.assertEqual(hook.sizes, [2])
+        self.assertEqual(summary['deferred'], 2)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(statuses(self.notifications), ['pending'] * 6)
+
+    def test_half_open_probe_success_closes_and_drains(self):
+        self.breaker.record(4, 4)
+        self.breaker.clock.advance(10)
+        hook = BatchSizes()
+
+        summary = self.dispatch(MemoryBackend(), hooks=[hook])
+
+        self.assertEqual(hook.sizes[0], 2)
+        self.assertEqual(summary['sent'], 6)
+        self.assertEqual(summary['circuit_breaker'], CLOSED)
+        self.assertEqual(statuses(self.notifications), ['sent'] * 6)
@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from home.backends import MemoryBackend
+from home.coalescing import Coalescer
+from home.dispatcher import NotificationDispatcher
+from home.models import ScheduledNotification
+from home.queues import DatabaseQueue
+
+from .utils import FailingBackend, closed_breaker, create_notification, create_token
+
+
+class CoalescerGroupTests(SimpleTestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def notification(self, pk, seconds_ago, token=1, collapse_key=None, priority='normal', title=None):
+        return ScheduledNotification(
+            id=pk, fcm_token_id=token, collapse_key=collapse_key, priority=priority,
+            scheduled_at=self.now - timedelta(seconds=seconds_ago), title=title or f'Title {pk}', body='Body'
+        )
+
+    def test_groups_by_token_and_collapse_key_within_the_window(self):
+        rows = [
+            self.notification(1, 100, collapse_key='chat'),
+            self.notification(2, 50, collapse_key='chat'),
+            self.notification(3, 40, collapse_key='news'),
+            self.notification(4, 30, token=2, collapse_key='chat'),
+            self.notification(5, 20),
+        ]
+
+        groups = Coalescer(window=300).group(rows)
+
+        self.assertEqual([[n.id for n in group] for group in groups], [[1, 2], [3], [4], [5]])
+
+    def test_rows_outside_the_window_start_a_new_group(self):
+        rows = [self.notification(1, 500, collapse_key='chat'), self.notification(2, 100, collapse_key='chat')]
+
+        self.assertEqual(len(Coalescer(window=300).group(rows)), 2)
+
+    def test_priorities_group_rows_without_a_collapse_key(self):
+        rows = [self.notification(pk, 10 * pk, priority='low') for pk in (1, 2, 3)]
+
+        groups = Coalescer(priorities=['low']).group(rows)
+
+        self.assertEqual([[n.id for n in group] for group in groups], [[3, 2, 1]])
+        self.assertEqual(len(Coalescer().group(rows)), 3)
+
+    def test_collapse_keys_can_be_ignored(self):
+        rows = [self.notification(pk, pk, collapse_key='chat') for pk in (1, 2)]
+
+        self.assertEqual(len(Coalescer(collapse_keys=False).group(rows)), 2)
+
+    def test_latest_payload_is_the_newest_row(self):
+        group = [self.notification(1, 20, title='Old'), self.notification(2, 10, title='New')]
+
+        self.assertEqual(Coalescer().payload(group), ('New', 'Body'))
+
+    def test_summary_payload_lists_titles_newest_first(self):
+        group = [self.notification(pk, 10 - pk, title=f'T{pk % 3}') for pk in range(5)]
+
+        title, body = Coalescer(mode='summary', summary_lines=2).payload(group)
+
+        self.assertEqual(title, '5 new notifications')
+        self.assertEqual(body, 'T1\nT0\n+1 more')
+
+    def test_unknown_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            Coalescer(mode='digest')
+
+
+class CoalescedDispatchTests(TestCase):
+    def setUp(self):
+        token = create_token()
+        self.rows = [
+            create_notification(token, seconds_ago=30 - i, collapse_key='chat', title=f'Message {i}')
+            for i in range(3)
+        ]
+        self.alone = create_notification(create_token('other'), seconds_ago=5)
+
+    def dispatch(self, backend, mode='latest'):
+        dispatcher = NotificationDispatcher(
+            service=backend, breaker=closed_breaker(), queue=DatabaseQueue(), coalescer=Coalescer(mode=mode)
+        )
+        return dispatcher.run()
+
+    def refreshed(self):
+        return [ScheduledNotification.objects.get(id=n.id) for n in self.rows]
+
+    def test_latest_sends_the_newest_row_once(self):
+        backend = MemoryBackend()
+
+        summary = self.dispatch(backend)
+
+        self.assertEqual((summary['sent'], summary['collapsed']), (2, 2))
+        newest = self.rows[-1]
+        self.assertEqual(
+            [(m['notification_id'], m['title'], m['collapse_key']) for m in backend.outbox],
+            [(newest.id, 'Message 2', 'chat'), (self.alone.id, 'Title', None)],
+        )
+        first, second, last = self.refreshed()
+        self.assertEqual([first.status, second.status, last.status], ['collapsed', 'collapsed', 'sent'])
+        self.assertEqual(first.error_message, f'Collapsed into notification {newest.id}')
+
+    def test_summary_sends_a_digest(self):
+        backend = MemoryBackend()
+
+        self.dispatch(backend, mode='summary')
+
+        self.assertEqual(backend.outbox[0]['title'], '3 new notifications')
+        self.assertEqual(backend.outbox[0]['body'], 'Message 2\nMessage 1\nMessage 0')
+
+    def test_failed_send_fails_the_whole_group(self):
+        summary = self.dispatch(FailingBackend())
+
+        self.assertEqual((summary['failed'], summary['collapsed']), (4, 0))
+        for notification in self.refreshed():
+            self.assertEqual(notification.status, 'failed')
+            self.assertEqual(notification.error_message, 'FCM token is not registered or invalid')
@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from home.maintenance import purge_unused_contents
+from home.models import NotificationContent
+
+from .utils import create_notification, create_token
+
+
+class NotificationContentTests(TestCase):
+    def setUp(self):
+        self.token = create_token()
+
+    def test_identical_payloads_share_one_row(self):
+        first = create_notification(self.token, title='Hello', body='World')
+        second = create_notification(self.token, title='Hello', body='World')
+
+        self.assertEqual(first.content_id, second.content_id)
+        self.assertEqual(NotificationContent.objects.count(), 1)
+
+    def test_intern_many_returns_ids_for_every_pair(self):
+        existing = NotificationContent.objects.intern('Hello', 'World')
+
+        ids = NotificationContent.objects.intern_many([('Hello', 'World'), ('Other', 'Body')])
+
+        self.assertEqual(ids[('Hello', 'World')], existing.id)
+        self.assertEqual(NotificationContent.objects.count(), 2)
+
+
+class PurgeUnusedContentsTests(TestCase):
+    def age(self, content, seconds):
+        NotificationContent.objects.filter(pk=content.pk).update(
+            created_at=timezone.now() - timedelta(seconds=seconds)
+        )
+
+    def test_deletes_only_old_unreferenced_contents(self):
+        used = create_notification(create_token()).content
+        old = NotificationContent.objects.intern('Old', 'Body')
+        fresh = NotificationContent.objects.intern('Fresh', 'Body')
+        self.age(used, 7200)
+        self.age(old, 7200)
+
+        deleted = purge_unused_contents(timezone.now() - timedelta(hours=1), chunk_size=1)
+
+        self.assertEqual(deleted, 1)
+        self.assertEqual(set(NotificationContent.objects.values_list('id', flat=True)), {used.id, fresh.id})
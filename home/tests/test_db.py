@@ -0,0 +1,50 @@
+from unittest import mock
+
+from django.db import OperationalError, transaction
+from django.test import TestCase, TransactionTestCase
+
+from home.db import BatchedWriter
+from home.models import ScheduledNotification
+
+from .utils import create_notification, create_token
+
+LOCKED = OperationalError('database is locked')
+
+
+class BatchedWriterTests(TransactionTestCase):
+    def setUp(self):
+        self.notification = create_notification(create_token())
+        self.writer = BatchedWriter(ScheduledNotification, ['status'], retries=2, backoff=0)
+
+    def write(self, *errors):
+        with mock.patch.object(ScheduledNotification.objects, 'bulk_update', side_effect=[*errors, 1]) as update, \
+                self.assertLogs('home.db', 'WARNING'):
+            written = self.writer.write([self.notification])
+        self.assertEqual(update.call_count, len(errors) + 1)
+        return written
+
+    def test_retries_while_the_database_is_locked(self):
+        self.assertEqual(self.write(LOCKED, LOCKED), 1)
+
+        self.assertEqual(self.writer.lock_retries, 2)
+
+    def test_gives_up_after_the_last_retry(self):
+        with self.assertRaises(OperationalError):
+            self.write(LOCKED, LOCKED, LOCKED)
+
+    def test_other_errors_are_not_retried(self):
+        with mock.patch.object(ScheduledNotification.objects, 'bulk_update', side_effect=OperationalError('disk I/O')):
+            with self.assertRaises(OperationalError):
+                self.writer.write([self.notification])
+        self.assertEqual(self.writer.lock_retries, 0)
+
+
+class BatchedWriterInTransactionTests(TestCase):
+    def test_does_not_retry_inside_an_outer_transaction(self):
+        writer = BatchedWriter(ScheduledNotification, ['status'], backoff=0)
+        notification = create_notification(create_token())
+
+        with mock.patch.object(ScheduledNotification.objects, 'bulk_update', side_effect=LOCKED):
+            with self.assertRaises(OperationalError), transaction.atomic():
+                writer.write([notification])
+        self.assertEqual(writer.lock_retries, 0)
@@ -0,0 +1,60 @@
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from home import events
+from home.events import flush_events, record_event
+from home.models import NotificationEvent
+
+from .utils import idle_buffer
+
+
+class NotificationEventTests(TestCase):
+    def setUp(self):
+        self.buffer = idle_buffer(self, NotificationEvent, max_pending=3, ignore_conflicts=True)
+        patcher = mock.patch.object(events, '_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_endpoints_accept_events_without_writing(self):
+        for path in ('/api/notifications/7/receipt/', '/api/notifications/7/click/'):
+            with self.assertNumQueries(0):
+                response = self.client.post(path)
+            self.assertEqual(response.status_code, 202)
+
+        self.assertEqual(flush_events(), 2)
+        self.assertEqual(set(NotificationEvent.objects.values_list('notification_id', 'event')), {
+            (7, 'received'), (7, 'clicked'),
+        })
+
+    def test_repeated_reports_are_ignored(self):
+        record_event(7, 'received')
+        flush_events()
+        record_event(7, 'received')
+        flush_events()
+
+        self.assertEqual(NotificationEvent.objects.count(), 1)
+
+    def test_full_buffer_answers_503(self):
+        for notification_id in range(3):
+            self.assertTrue(record_event(notification_id, 'received'))
+
+        response = self.client.post('/api/notifications/9/receipt/')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.buffer.dropped, 1)
+
+    def test_failed_flush_keeps_the_events_for_the_next_one(self):
+        record_event(7, 'clicked')
+
+        with mock.patch.object(self.buffer, 'write', side_effect=DatabaseError('down')), \
+                self.assertLogs('home.db', 'WARNING'):
+            self.assertEqual(flush_events(), 0)
+
+        self.assertEqual(len(self.buffer), 1)
+        self.assertEqual(flush_events(), 1)
+
+    def test_unknown_events_are_rejected(self):
+        with self.assertRaises(ValueError):
+            record_event(7, 'opened')
@@ -0,0 +1,102 @@
+import unittest
+from datetime import timedelta
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from home.backends import MemoryBackend
+from home.dispatcher import EXPIRED_MESSAGE, NotificationDispatcher
+from home.models import ScheduledNotification
+from home.notification_service import FCM_MAX_TTL, FCMHttpV1Service, fcm_service
+from home.queues import DatabaseQueue
+
+from .utils import closed_breaker, create_notification, create_token, statuses
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class ExpiryTests(TestCase):
+    def setUp(self):
+        self.token = create_token()
+        self.now = timezone.now()
+        self.backend = MemoryBackend()
+
+    def dispatch(self):
+        dispatcher = NotificationDispatcher(service=self.backend, breaker=closed_breaker(), queue=DatabaseQueue())
+        return dispatcher.run()
+
+    def test_rows_past_expires_at_are_expired_instead_of_sent(self):
+        stale = create_notification(self.token, expires_at=self.now - timedelta(seconds=1))
+        fresh = create_notification(self.token, expires_at=self.now + timedelta(hours=1))
+
+        summary = self.dispatch()
+
+        self.assertEqual((summary['sent'], summary['expired']), (1, 1))
+        self.assertEqual(statuses([stale, fresh]), ['expired', 'sent'])
+        self.assertEqual(ScheduledNotification.objects.get(id=stale.id).error_message, EXPIRED_MESSAGE)
+        self.assertEqual([m['notification_id'] for m in self.backend.outbox], [fresh.id])
+
+    @override_settings(NOTIFICATION_MAX_STALENESS=600)
+    def test_max_staleness_expires_old_rows_without_expires_at(self):
+        old = create_notification(self.token, seconds_ago=3600)
+        recent = create_notification(self.token, seconds_ago=60)
+        kept = create_notification(self.token, seconds_ago=3600, expires_at=self.now + timedelta(hours=1))
+
+        summary = self.dispatch()
+
+        self.assertEqual(summary['expired'], 1)
+        self.assertEqual(statuses([old, recent, kept]), ['expired', 'sent', 'sent'])
+
+    def test_rows_without_expiry_never_expire(self):
+        notification = create_notification(self.token, seconds_ago=30 * 86400)
+
+        self.dispatch()
+
+        self.assertEqual(statuses([notification]), ['sent'])
+        self.assertIsNone(self.backend.outbox[0]['ttl'])
+
+    def test_remaining_lifetime_is_sent_as_ttl(self):
+        create_notification(self.token, expires_at=self.now + timedelta(hours=1))
+
+        self.dispatch()
+
+        self.assertTrue(3500 < self.backend.outbox[0]['ttl'] <= 3600)
+
+    def test_dry_run_expires_nothing(self):
+        stale = create_notification(self.token, expires_at=self.now - timedelta(seconds=1))
+
+        NotificationDispatcher(service=self.backend, dry_run=True, queue=DatabaseQueue()).run()
+
+        self.assertEqual(statuses([stale]), ['pending'])
+
+
+class TTLClampTests(SimpleTestCase):
+    def test_fcm_ttl_is_clamped_to_the_fcm_maximum(self):
+        message = fcm_service.build_message('token', 'Title', 'Body', ttl=FCM_MAX_TTL * 2)
+
+        self.assertEqual(message.android.ttl, FCM_MAX_TTL)
+        self.assertEqual(message.webpush.headers['TTL'], str(FCM_MAX_TTL))
+
+    def test_shorter_fcm_ttl_is_kept(self):
+        message = fcm_service.build_message('token', 'Title', 'Body', ttl=120)
+
+        self.assertEqual(message.android.ttl, 120)
+        self.assertEqual(message.webpush.headers['TTL'], '120')
+
+    def test_no_ttl_leaves_the_fcm_default(self):
+        message = fcm_service.build_message('token', 'Title', 'Body')
+
+        self.assertIsNone(message.android.ttl)
+        self.assertIsNone(message.webpush.headers)
+
+    @unittest.skipIf(httpx is None, 'httpx is not installed')
+    def test_http_v1_ttl_is_clamped_to_the_fcm_maximum(self):
+        service = FCMHttpV1Service(project_id='test', access_token='test')
+
+        message = service.build_message('token', 'Title', 'Body', ttl=FCM_MAX_TTL + 1)['message']
+
+        self.assertEqual(message['android']['ttl'], f'{FCM_MAX_TTL}s')
+        self.assertEqual(message['webpush']['headers']['TTL'], str(FCM_MAX_TTL))
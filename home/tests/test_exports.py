@@ -0,0 +1,59 @@
+import csv
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from home.maintenance import archive_notifications
+
+from .utils import create_notification, create_token
+
+URL = '/api/notifications/export/'
+
+
+class ExportNotificationsTests(TestCase):
+    def setUp(self):
+        token = create_token()
+        self.sent = create_notification(token, status='sent', title='Sent', seconds_ago=7200)
+        self.failed = create_notification(token, status='failed', title='Failed', seconds_ago=3600)
+        self.pending = create_notification(token, title='Pending', seconds_ago=60)
+
+    def get(self, **params):
+        response = self.client.get(URL, params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_streams_ndjson_filtered_by_status(self):
+        rows = [json.loads(line) for line in self.get(status=['sent', 'failed']).splitlines()]
+
+        self.assertEqual([(row['id'], row['title'], row['archived']) for row in rows], [
+            (self.sent.id, 'Sent', False), (self.failed.id, 'Failed', False),
+        ])
+
+    def test_streams_csv_with_a_header(self):
+        rows = list(csv.DictReader(StringIO(self.get(format='csv', since=self.failed.scheduled_at.isoformat()))))
+
+        self.assertEqual([row['title'] for row in rows], ['Failed', 'Pending'])
+
+    def test_includes_archived_rows_on_request(self):
+        archive_notifications(timezone.now(), statuses=['sent'])
+
+        rows = [json.loads(line) for line in self.get(include_history='1', status='sent').splitlines()]
+
+        self.assertEqual([(row['id'], row['archived']) for row in rows], [(self.sent.id, True)])
+
+    def test_rejects_unknown_formats(self):
+        self.assertEqual(self.client.get(URL, {'format': 'xml'}).status_code, 400)
+
+    def test_command_writes_to_a_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.ndjson')
+
+            call_command('export_notifications', '--status', 'pending', '--output', path, stderr=StringIO())
+
+            with open(path) as f:
+                self.assertEqual([json.loads(line)['id'] for line in f], [self.pending.id])
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import unittest
+
+from django.test import SimpleTestCase
+
+from home.notification_service import FCMHttpV1Client, FCMHttpV1Service
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+def replying(*responses):
+    """Mock transport answering each request with the next (status, body) pair"""
+    responses = list(responses)
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        status, body = responses.pop(0)
+        content = body if isinstance(body, (str, bytes)) else json.dumps(body)
+        return httpx.Response(status, content=content)
+
+    return httpx.MockTransport(handler), requests
+
+
+@unittest.skipIf(httpx is None, 'httpx is not installed')
+class FCMHttpV1ClientTests(SimpleTestCase):
+    def send(self, *responses):
+        client = FCMHttpV1Client('project', max_in_flight=4)
+        transport, self.requests = replying(*responses)
+        client.client = httpx.AsyncClient(base_url='https://fcm.test', transport=transport)
+
+        async def run():
+            try:
+                return await client.send_many([{'message': {'token': 't'}}] * len(responses), 'access')
+            finally:
+                await client.aclose()
+
+        return asyncio.run(run())
+
+    def test_success_carries_the_message_id(self):
+        (outcome, result, status), = self.send((200, {'name': 'projects/project/messages/1'}))
+
+        self.assertEqual((outcome, status), ('success', 200))
+        self.assertEqual(result['messageId'], 'projects/project/messages/1')
+        self.assertEqual(self.requests[0].headers['Authorization'], 'Bearer access')
+
+    def test_success_without_a_json_body_still_counts_as_sent(self):
+        replies = self.send((200, ''), (200, 'OK'), (200, ['unexpected']))
+
+        self.assertEqual([(outcome, result['success'], result['messageId']) for outcome, result, _ in replies], [
+            ('success', True, None)
+        ] * 3)
+
+    def test_errors_are_mapped_to_transient_or_permanent_failures(self):
+        replies = self.send(
+            (404, {'error': {'status': 'NOT_FOUND', 'details': [{'errorCode': 'UNREGISTERED'}]}}),
+            (400, {'error': {'status': 'INVALID_ARGUMENT', 'message': 'bad token'}}),
+            (429, ''),
+            (503, '<html>Service Unavailable</html>'),
+            (500, {'error': 'internal'}),
+        )
+
+        self.assertEqual([(outcome, result['transient']) for outcome, result, _ in replies], [
+            ('unregistered', False), ('invalid_argument', False), ('quota_exceeded', True),
+            ('error', True), ('error', True),
+        ])
+        self.assertEqual(replies[1][1]['error'], 'Invalid argument: bad token')
+        self.assertEqual(replies[3][1]['error'], 'HTTP 503')
+
+
+@unittest.skipIf(httpx is None, 'httpx is not installed')
+class FCMHttpV1ServiceTests(SimpleTestCase):
+    def test_build_message_sets_collapse_key_and_ttl(self):
+        service = FCMHttpV1Service(project_id='project', access_token='access')
+
+        message = service.build_message('t', 'Title', 'Body', notification_id=5, collapse_key='score', ttl=60)['message']
+
+        self.assertEqual(message['data'], {'notification_id': '5'})
+        self.assertEqual((message['android']['collapse_key'], message['android']['ttl']), ('score', '60s'))
+        self.assertEqual(message['webpush']['headers']['TTL'], '60')
+        self.assertIn('Topic', message['webpush']['headers'])
@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from home.listing import MAX_LIMIT, decode_cursor, encode_cursor, list_notifications
+
+from .utils import create_notification, create_token
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        scheduled_at = timezone.now()
+
+        self.assertEqual(decode_cursor(encode_cursor('desc', scheduled_at, 42)), ('desc', scheduled_at, 42))
+
+    def test_malformed_cursors_are_rejected(self):
+        for cursor in ('', 'not-a-cursor', encode_cursor('sideways', timezone.now(), 1)):
+            with self.assertRaisesMessage(ValueError, 'Invalid cursor'):
+                decode_cursor(cursor)
+
+
+class KeysetListingTests(TestCase):
+    def setUp(self):
+        token = create_token()
+        # Ties on scheduled_at must be broken by id across page boundaries
+        self.notifications = [create_notification(token, seconds_ago=60 * (i // 3)) for i in range(10)]
+
+    def pages(self, order, limit=3, **filters):
+        ids, cursor = [], None
+        while True:
+            rows, cursor = list_notifications(order=order, limit=limit, cursor=cursor, **filters)
+            ids.extend(row['id'] for row in rows)
+            if cursor is None:
+                return ids
+
+    def expected(self, reverse=False):
+        ordered = sorted(self.notifications, key=lambda n: (n.scheduled_at, n.id), reverse=reverse)
+        return [n.id for n in ordered]
+
+    def test_ascending_pages_cover_every_row_once(self):
+        self.assertEqual(self.pages('asc'), self.expected())
+
+    def test_descending_pages_cover_every_row_once(self):
+        self.assertEqual(self.pages('desc', limit=4), self.expected(reverse=True))
+
+    def test_cursor_keeps_its_order(self):
+        _, cursor = list_notifications(order='desc', limit=2)
+
+        rows, _ = list_notifications(order='asc', limit=2, cursor=cursor)
+
+        self.assertEqual([row['id'] for row in rows], self.expected(reverse=True)[2:4])
+
+    def test_filters_apply_to_every_page(self):
+        self.notifications[0].status = 'sent'
+        self.notifications[0].save()
+
+        self.assertEqual(self.pages('asc', statuses=['pending']), [
+            pk for pk in self.expected() if pk != self.notifications[0].id
+        ])
+
+    def test_rows_carry_the_listed_columns(self):
+        rows, _ = list_notifications(limit=1, since=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(rows[0]['title'], 'Title')
+        self.assertEqual(rows[0]['status'], 'pending')
+
+    def test_invalid_arguments(self):
+        for options in ({'limit': 0}, {'limit': MAX_LIMIT + 1}, {'order': 'up'}, {'statuses': ['done']}):
+            with self.assertRaises(ValueError):
+                list_notifications(**options)
+
+    def test_view_reports_bad_cursors(self):
+        response = self.client.get('/api/notifications/', {'cursor': 'bad'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'success': False, 'error': 'Invalid cursor'})
+
+    def test_view_returns_the_next_cursor(self):
+        response = self.client.get('/api/notifications/', {'limit': 4})
+
+        data = response.json()['data']
+        self.assertTrue(data['has_more'])
+        self.assertEqual([row['id'] for row in data['notifications']], self.expected()[:4])
+        self.assertEqual(decode_cursor(data['next_cursor'])[2], self.expected()[3])
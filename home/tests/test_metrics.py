@@ -0,0 +1,124 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from home import metrics
+from home.metrics import AGGREGATE_FILE, MetricsRegistry
+
+from .utils import create_notification, create_token
+
+
+def exited_pid():
+    """Pid of a process that has already exited"""
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+class RenderTests(SimpleTestCase):
+    def test_renders_prometheus_text(self):
+        registry = MetricsRegistry()
+        registry.counter('sent_total', 'Sent', ['status']).inc(status='ok')
+        registry.histogram('latency_seconds', 'Latency', buckets=(1,)).observe(0.5)
+
+        text = registry.render()
+
+        self.assertIn('# TYPE sent_total counter\nsent_total{status="ok"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 1\nlatency_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn('latency_seconds_count 1', text)
+
+
+class SnapshotTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(NOTIFICATION_METRICS_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.registry = MetricsRegistry()
+        self.sent = self.registry.counter('sent_total', 'Sent')
+        self.depth = self.registry.gauge('depth', 'Depth')
+
+    def write(self, name, metrics, written_at=1.0):
+        with open(os.path.join(self.directory, name), 'w') as f:
+            json.dump({'written_at': written_at, 'metrics': metrics}, f)
+
+    def test_snapshot_is_keyed_by_pid_and_start(self):
+        self.registry.write_snapshot(force=True)
+
+        name, = os.listdir(self.directory)
+        pid, _, started = name[:-len('.json')].partition('-')
+        self.assertEqual(int(pid), os.getpid())
+        self.assertTrue(started.isdigit())
+
+    def test_merges_live_processes(self):
+        self.sent.inc(2)
+        self.depth.set(5)
+        self.write(f'{os.getppid()}-1.json', {'sent_total': [[[], 3]], 'depth': [[[], 7]]}, written_at=2e9)
+
+        text = self.registry.render()
+
+        self.assertIn('sent_total 5\n', text)
+        self.assertIn('depth 7\n', text)
+        self.assertIn(f'{os.getppid()}-1.json', os.listdir(self.directory))
+
+    def test_folds_exited_processes_into_the_aggregate(self):
+        self.sent.inc(2)
+        dead = f'{exited_pid()}-1.json'
+        self.write(dead, {'sent_total': [[[], 3]], 'depth': [[[], 7]]})
+        self.write(AGGREGATE_FILE, {'sent_total': [[[], 10]]})
+
+        text = self.registry.render()
+
+        self.assertIn('sent_total 15\n', text)
+        self.assertNotIn('depth 7', text)
+        self.assertNotIn(dead, os.listdir(self.directory))
+        with open(os.path.join(self.directory, AGGREGATE_FILE)) as f:
+            self.assertEqual(json.load(f)['metrics']['sent_total'], [[[], 13]])
+        self.assertIn('sent_total 15\n', self.registry.render())
+
+    def test_observations_write_at_most_one_snapshot_per_interval(self):
+        with mock.patch.object(metrics, 'registry', self.registry), \
+                mock.patch.object(self.registry, 'write_snapshot', wraps=self.registry.write_snapshot) as write:
+            for _ in range(10):
+                self.sent.inc()
+
+        self.assertEqual(write.call_count, 1)
+
+    def test_exit_hook_ignores_errors(self):
+        with mock.patch.object(metrics.registry, 'write_snapshot', side_effect=RuntimeError):
+            metrics._write_final_snapshot()
+
+
+@override_settings(NOTIFICATION_QUEUE_DEPTH_INTERVAL=60)
+class QueueDepthTests(TestCase):
+    def setUp(self):
+        metrics._queue_depth_refreshed = None
+        self.addCleanup(setattr, metrics, '_queue_depth_refreshed', None)
+
+    def depth(self):
+        return dict(metrics.queue_depth._values)
+
+    def test_counts_by_status_and_priority(self):
+        token = create_token()
+        create_notification(token)
+        create_notification(token, priority='high')
+
+        metrics.collect_queue_depth()
+
+        self.assertEqual(self.depth(), {('pending', 'normal'): 1, ('pending', 'high'): 1})
+
+    def test_reuses_the_counts_within_the_interval(self):
+        create_notification(create_token())
+        metrics.collect_queue_depth()
+        create_notification(create_token('other'))
+
+        with self.assertNumQueries(0):
+            metrics.collect_queue_depth()
+        self.assertEqual(self.depth(), {('pending', 'normal'): 1})
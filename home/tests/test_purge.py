@@ -0,0 +1,60 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from home.maintenance import purge_inactive_tokens, purge_notifications
+from home.models import ScheduledNotification, UserFCMToken
+
+from .utils import create_notification, create_token
+
+DAY = 24 * 3600
+
+
+class PurgeNotificationsTests(TestCase):
+    def setUp(self):
+        self.token = create_token()
+
+    def test_deletes_rows_past_their_status_retention(self):
+        old_sent = create_notification(self.token, seconds_ago=40 * DAY, status='sent')
+        old_failed = create_notification(self.token, seconds_ago=40 * DAY, status='failed')
+        recent_sent = create_notification(self.token, seconds_ago=DAY, status='sent')
+
+        deleted = purge_notifications(
+            ScheduledNotification, 'sent', timezone.now() - timedelta(days=30), chunk_size=1
+        )
+
+        self.assertEqual(deleted, 1)
+        remaining = set(ScheduledNotification.objects.values_list('id', flat=True))
+        self.assertEqual(remaining, {old_failed.id, recent_sent.id})
+        self.assertNotIn(old_sent.id, remaining)
+
+    def test_inactive_tokens_go_with_their_notifications(self):
+        inactive = create_token('inactive')
+        create_notification(inactive)
+        UserFCMToken.objects.filter(pk=inactive.pk).update(
+            is_active=False, updated_at=timezone.now() - timedelta(days=200)
+        )
+        kept = create_notification(self.token)
+
+        totals = purge_inactive_tokens(timezone.now() - timedelta(days=180))
+
+        self.assertEqual((totals['tokens'], totals['notifications']), (1, 1))
+        self.assertEqual(list(ScheduledNotification.objects.values_list('id', flat=True)), [kept.id])
+
+    def test_command_uses_retention_rules_and_dry_run(self):
+        create_notification(self.token, seconds_ago=10 * DAY, status='sent')
+        out = StringIO()
+
+        call_command('purge_notifications', '--retain', 'sent=7', '--dry-run', stdout=out)
+        self.assertIn('Would delete 1 sent rows', out.getvalue())
+        self.assertEqual(ScheduledNotification.objects.count(), 1)
+
+        call_command('purge_notifications', '--retain', 'sent=7', stdout=StringIO())
+        self.assertFalse(ScheduledNotification.objects.exists())
+
+    def test_command_refuses_to_purge_pending_rows(self):
+        with self.assertRaises(CommandError):
+            call_command('purge_notifications', '--retain', 'pending=1', stdout=StringIO())
@@ -0,0 +1,210 @@
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from django.utils import timezone
+
+from home.backends import MemoryBackend
+from home.dispatcher import NotificationDispatcher
+from home.models import ScheduledNotification
+from home.queues import MemoryQueue, RedisQueue, override_queue, queue_item
+
+from .utils import closed_breaker, create_notification, create_token, statuses
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  (fakeredis runs the claim script with it)
+except ImportError:
+    fakeredis = None
+
+
+class MemoryQueueTests(TestCase):
+    def setUp(self):
+        self.token = create_token()
+        self.queue = MemoryQueue(sync_interval=None)
+        self.now = timezone.now()
+
+    def test_claims_due_entries_in_scheduled_order(self):
+        late = create_notification(self.token, seconds_ago=10)
+        early = create_notification(self.token, seconds_ago=20)
+        future = create_notification(self.token, seconds_ago=-60)
+        self.queue.enqueue([queue_item(n) for n in (late, early, future)])
+
+        self.assertEqual(self.queue.claim(self.now, 10), [early.id, late.id])
+        self.assertEqual(self.queue.claim(self.now, 10), [])
+        self.assertEqual(self.queue.depth(), 1)
+
+    def test_enqueue_again_moves_an_entry(self):
+        notification = create_notification(self.token, seconds_ago=10)
+        self.queue.enqueue([queue_item(notification)])
+        notification.scheduled_at = self.now + timedelta(minutes=5)
+        self.queue.enqueue([queue_item(notification)])
+
+        self.assertEqual(self.queue.claim(self.now, 10), [])
+        self.assertEqual(self.queue.depth(), 1)
+
+    def test_fetch_due_loads_pending_rows_and_skips_settled_ones(self):
+        pending = create_notification(self.token)
+        sent = create_notification(self.token, status='sent')
+
+        batch = self.queue.fetch_due(self.now, 10)
+
+        self.assertEqual([n.id for n in batch], [pending.id])
+        self.assertEqual(self.queue.claim(self.now, 10), [])
+        self.assertNotIn(sent.id, [n.id for n in batch])
+
+    def test_rescheduled_rows_go_back_into_the_queue(self):
+        notification = create_notification(self.token)
+        self.queue.enqueue([queue_item(notification)])
+        ScheduledNotification.objects.filter(id=notification.id).update(
+            scheduled_at=self.now + timedelta(minutes=5)
+        )
+        self.queue._synced_at = 0
+
+        self.assertEqual(self.queue.fetch_due(self.now, 10), [])
+        self.assertEqual(self.queue.depth(), 1)
+
+    def test_release_returns_claimed_entries(self):
+        notification = create_notification(self.token)
+        self.queue.enqueue([queue_item(notification)])
+        self.queue.claim(self.now, 10)
+
+        self.queue.release([queue_item(notification)])
+
+        self.assertEqual(self.queue.claim(self.now, 10), [notification.id])
+
+    def test_default_sync_interval_reloads_rows_from_other_processes(self):
+        self.assertEqual(MemoryQueue().sync_interval, 60)
+
+    def test_saved_rows_are_pushed_on_commit(self):
+        with override_queue(self.queue), self.captureOnCommitCallbacks(execute=True):
+            created = create_notification(self.token)
+            bulk = ScheduledNotification.objects.bulk_create([
+                ScheduledNotification(fcm_token=self.token, content=created.content, scheduled_at=self.now)
+            ])
+            create_notification(self.token, status='sent')
+
+        self.assertEqual(sorted(self.queue.claim(self.now, 10)), sorted([created.id, bulk[0].id]))
+
+
+@unittest.skipIf(fakeredis is None, 'fakeredis[lua] is not installed')
+class RedisQueueTests(TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.queue = self.make_queue()
+        self.tokens = [create_token(f'token-{i}') for i in range(4)]
+        self.now = timezone.now()
+
+    def make_queue(self, **options):
+        options.setdefault('visibility_timeout', 60)
+        return RedisQueue(client=fakeredis.FakeRedis(server=self.server), **options)
+
+    def claimed(self, queue=None):
+        queue = queue or self.queue
+        return {int(member) for member in queue.client.zrange(queue.claimed_keys[0], 0, -1)}
+
+    def test_claim_moves_entries_to_the_claimed_set_until_acked(self):
+        notifications = [create_notification(token) for token in self.tokens]
+        self.queue.enqueue([queue_item(n) for n in notifications])
+
+        ids = self.queue.claim(self.now, 3)
+
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(self.claimed(), set(ids))
+        self.assertEqual(self.queue.depth(), 1)
+        self.queue.ack(ids)
+        self.assertEqual(self.claimed(), set())
+
+    def test_claim_takes_due_entries_only_and_sets_the_deadline(self):
+        due = [create_notification(self.tokens[0], seconds_ago=2000 - i) for i in range(1100)]
+        future = create_notification(self.tokens[1], seconds_ago=-60)
+        self.queue.enqueue([queue_item(n) for n in due + [future]])
+
+        with mock.patch('home.queues.time.time', return_value=1000.0):
+            first = self.queue.claim(self.now, 1050)
+            second = self.queue.claim(self.now, 1000)
+
+        self.assertEqual(first + second, [n.id for n in due])
+        self.assertEqual(len(first), 1050)
+        scores = dict(self.queue.client.zrange(self.queue.claimed_keys[0], 0, -1, withscores=True))
+        self.assertEqual(set(scores.values()), {1060.0})
+        self.assertEqual(self.queue.depth(), 1)
+
+    def test_release_puts_claimed_entries_back(self):
+        notification = create_notification(self.tokens[0])
+        self.queue.enqueue([queue_item(notification)])
+        self.queue.claim(self.now, 10)
+
+        self.queue.release([queue_item(notification)])
+
+        self.assertEqual(self.claimed(), set())
+        self.assertEqual(self.queue.claim(self.now, 10), [notification.id])
+
+    def test_expired_claims_are_recovered_with_their_scheduled_time(self):
+        pending = create_notification(self.tokens[0], seconds_ago=120)
+        settled = create_notification(self.tokens[1], seconds_ago=90)
+        self.queue.enqueue([queue_item(pending), queue_item(settled)])
+        self.queue.claim(self.now, 10)
+        ScheduledNotification.objects.filter(id=settled.id).update(status='sent')
+
+        with mock.patch('home.queues.time.time', return_value=self.now.timestamp() + 61), \
+                self.assertLogs('home.queues', 'WARNING'):
+            self.queue._recover(0)
+
+        self.assertEqual(self.claimed(), set())
+        queued = self.queue.client.zrange(self.queue.key, 0, -1, withscores=True)
+        self.assertEqual(queued, [(str(pending.id).encode(), pending.scheduled_at.timestamp())])
+
+    def test_live_claims_are_not_recovered(self):
+        notification = create_notification(self.tokens[0])
+        self.queue.enqueue([queue_item(notification)])
+        self.queue.claim(self.now, 10)
+
+        self.queue._recover(0)
+
+        self.assertEqual(self.claimed(), {notification.id})
+        self.assertEqual(self.queue.depth(), 0)
+
+    def test_long_running_dispatcher_claims_are_not_sent_twice(self):
+        # A dispatcher loop keeps the ``now`` its run started with; its claim
+        # deadlines must still be counted from when the claim was made
+        notification = create_notification(self.tokens[0], seconds_ago=600)
+        self.queue.enqueue([queue_item(notification)])
+        run_started = self.now - timedelta(seconds=300)
+
+        self.assertEqual(self.queue.claim(run_started, 10), [notification.id])
+        self.assertEqual(self.make_queue().claim(timezone.now(), 10), [])
+
+    def test_concurrent_dispatchers_send_each_row_once(self):
+        notifications = [create_notification(token, seconds_ago=60 - i) for i, token in enumerate(self.tokens * 3)]
+        self.queue.sync()
+        backends = [MemoryBackend(), MemoryBackend()]
+        dispatchers = [
+            NotificationDispatcher(service=backend, breaker=closed_breaker(), queue=self.make_queue())
+            for backend in backends
+        ]
+
+        # Interleave small batches of both dispatchers
+        while any(dispatcher.run(limit=2)['processed'] for dispatcher in dispatchers):
+            pass
+
+        sent = [message['notification_id'] for backend in backends for message in backend.outbox]
+        self.assertEqual(sorted(sent), sorted(n.id for n in notifications))
+        self.assertEqual(statuses(notifications), ['sent'] * len(notifications))
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertEqual(self.claimed(), set())
+
+    def test_sharded_sets_hold_their_tokens_entries(self):
+        queue = self.make_queue(shards=2)
+        notifications = [create_notification(token) for token in self.tokens]
+        queue.enqueue([queue_item(n) for n in notifications])
+
+        for index in range(2):
+            expected = {n.id for n in notifications if n.fcm_token_id % 2 == index}
+            self.assertEqual(set(queue.claim(self.now, 10, shard=(index, 2))), expected)
+
+    def test_shard_count_must_match(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.make_queue(shards=2).claim(self.now, 10, shard=(0, 3))
@@ -0,0 +1,74 @@
+from django.test import SimpleTestCase, TestCase
+
+from home.backends import MemoryBackend
+from home.circuit_breaker import CLOSED, HALF_OPEN, OPEN
+from home.dispatcher import NotificationDispatcher
+from home.models import ScheduledNotification
+from home.queues import DatabaseQueue, MemoryQueue, shard_filter
+from home.sharding import combine_summaries, validate_shard
+
+from .utils import closed_breaker, create_notification, create_token
+
+
+class ShardPartitionTests(TestCase):
+    def setUp(self):
+        self.tokens = [create_token(f'token-{i}') for i in range(7)]
+        self.notifications = [create_notification(token, seconds_ago=i) for i, token in enumerate(self.tokens * 2)]
+
+    def shard_ids(self, index, count):
+        return set(shard_filter(ScheduledNotification.objects.all(), (index, count)).values_list('id', flat=True))
+
+    def test_shards_partition_the_rows(self):
+        shards = [self.shard_ids(index, 3) for index in range(3)]
+
+        self.assertEqual(set().union(*shards), {n.id for n in self.notifications})
+        self.assertEqual(sum(len(shard) for shard in shards), len(self.notifications))
+
+    def test_a_tokens_rows_stay_in_one_shard(self):
+        for index in range(3):
+            tokens = set(
+                ScheduledNotification.objects.filter(id__in=self.shard_ids(index, 3))
+                .values_list('fcm_token_id', flat=True)
+            )
+            self.assertTrue(all(token % 3 == index for token in tokens))
+
+    def test_single_shard_is_everything(self):
+        self.assertEqual(self.shard_ids(0, 1), {n.id for n in self.notifications})
+
+    def test_dispatchers_only_send_their_shard(self):
+        for queue_class in (DatabaseQueue, MemoryQueue):
+            ScheduledNotification.objects.update(status='pending', sent_at=None)
+            for index in range(2):
+                backend = MemoryBackend()
+                NotificationDispatcher(
+                    service=backend, breaker=closed_breaker(), queue=queue_class(), shard=(index, 2)
+                ).run()
+                ids = {message['notification_id'] for message in backend.outbox}
+                self.assertEqual(ids, self.shard_ids(index, 2), queue_class.name)
+            self.assertFalse(ScheduledNotification.objects.filter(status='pending').exists())
+
+
+class ShardHelperTests(SimpleTestCase):
+    def test_validate_shard(self):
+        validate_shard(None, 1)
+        validate_shard(2, 3)
+        for shard, count in ((3, 3), (-1, 3), (None, 0)):
+            with self.assertRaises(ValueError):
+                validate_shard(shard, count)
+
+    def test_combine_summaries_adds_counts_and_keeps_the_worst_breaker_state(self):
+        summaries = [
+            {'processed': 3, 'sent': 2, 'failed': 1, 'collapsed': 0, 'expired': 1, 'deferred': 0, 'batches': 1,
+             'circuit_breaker': CLOSED},
+            {'processed': 4, 'sent': 4, 'failed': 0, 'collapsed': 2, 'expired': 0, 'deferred': 5, 'batches': 2,
+             'circuit_breaker': HALF_OPEN},
+        ]
+
+        totals = combine_summaries(summaries)
+
+        self.assertEqual(totals, {
+            'processed': 7, 'sent': 6, 'failed': 1, 'collapsed': 2, 'expired': 1, 'deferred': 5, 'batches': 3,
+            'circuit_breaker': HALF_OPEN,
+        })
+        summaries[0]['circuit_breaker'] = OPEN
+        self.assertEqual(combine_summaries(summaries)['circuit_breaker'], OPEN)
@@ -0,0 +1,59 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from home.models import UserFCMToken
+from home.token_import import import_tokens
+
+URL = '/api/import-tokens/'
+CSV = 'token,user_agent\na,Firefox\nb,\na,Chrome\n'
+
+
+class ImportTokensTests(TestCase):
+    def test_upserts_and_counts_duplicates_within_a_batch(self):
+        stats = import_tokens(CSV.splitlines(), 'csv', default_user_agent='import')
+
+        self.assertEqual((stats['processed'], stats['imported'], stats['duplicates']), (3, 2, 1))
+        self.assertEqual(
+            dict(UserFCMToken.objects.values_list('token', 'user_agent')), {'a': 'Firefox', 'b': 'import'}
+        )
+
+    def test_tokens_repeated_in_later_batches_are_upserted_again(self):
+        stats = import_tokens(CSV.splitlines(), 'csv', batch_size=1)
+
+        self.assertEqual((stats['imported'], stats['duplicates'], stats['batches']), (3, 0, 3))
+        self.assertEqual(UserFCMToken.objects.for_token('a').get().user_agent, 'Chrome')
+        self.assertEqual(UserFCMToken.objects.count(), 2)
+
+    def test_invalid_records_are_counted(self):
+        stats = import_tokens(['{"token": "a"}', 'not json', '{"user_agent": "x"}'], 'ndjson')
+
+        self.assertEqual((stats['imported'], stats['invalid']), (1, 2))
+
+
+@override_settings(FCM_TOKEN_IMPORT_SECRET='s3cret')
+class ImportTokensEndpointTests(TestCase):
+    def post(self, secret=None):
+        headers = {'X-Import-Secret': secret} if secret is not None else {}
+        return self.client.post(URL, CSV, content_type='text/csv', headers=headers)
+
+    def test_requires_staff_or_secret(self):
+        self.assertEqual(self.post().status_code, 403)
+        self.assertEqual(self.post(secret='wrong').status_code, 403)
+        self.client.force_login(get_user_model().objects.create_user('user', password='password'))
+        self.assertEqual(self.post().status_code, 403)
+        self.assertFalse(UserFCMToken.objects.exists())
+
+    def test_accepts_the_shared_secret(self):
+        response = self.post(secret='s3cret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['imported'], 2)
+
+    def test_accepts_staff_sessions(self):
+        self.client.force_login(get_user_model().objects.create_user('staff', password='password', is_staff=True))
+
+        self.assertEqual(self.post().status_code, 200)
+
+    @override_settings(FCM_TOKEN_IMPORT_SECRET=None)
+    def test_no_secret_configured_means_staff_only(self):
+        self.assertEqual(self.post(secret='').status_code, 403)
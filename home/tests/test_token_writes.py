@@ -0,0 +1,66 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from home import token_writes
+from home.models import UserFCMToken
+from home.token_import import upsert_batch
+from home.token_writes import flush_tokens, queue_token_save
+
+from .utils import idle_buffer
+
+URL = '/api/save-fcm-token/'
+
+
+@override_settings(FCM_TOKEN_WRITE_BEHIND=True)
+class TokenWriteBehindTests(TestCase):
+    def setUp(self):
+        self.buffer = idle_buffer(
+            self, UserFCMToken, max_pending=2, key=lambda record: record[0], write=upsert_batch
+        )
+        patcher = mock.patch.object(token_writes, '_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def register(self, token, user_agent='Firefox'):
+        return self.client.post(URL, {'token': token}, content_type='application/json', headers={'User-Agent': user_agent})
+
+    def test_registrations_are_acknowledged_before_they_are_written(self):
+        with self.assertNumQueries(0):
+            response = self.register('a')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(UserFCMToken.objects.exists())
+        flush_tokens()
+        self.assertEqual(UserFCMToken.objects.for_token('a').get().user_agent, 'Firefox')
+
+    def test_repeated_registrations_coalesce_to_the_latest(self):
+        self.register('a', 'Firefox')
+        self.register('a', 'Chrome')
+
+        self.assertEqual(flush_tokens(), 1)
+        self.assertEqual(self.buffer.coalesced, 1)
+        self.assertEqual(UserFCMToken.objects.get().user_agent, 'Chrome')
+
+    def test_flush_reactivates_known_tokens(self):
+        UserFCMToken.objects.create(token='a', is_active=False)
+        queue_token_save('a', 'Firefox')
+
+        flush_tokens()
+
+        self.assertTrue(UserFCMToken.objects.get().is_active)
+
+    def test_full_buffer_falls_back_to_a_direct_write(self):
+        self.register('a')
+        self.register('b')
+
+        response = self.register('c')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(UserFCMToken.objects.for_token('c').exists())
+        self.assertEqual(len(self.buffer), 2)
+
+    @override_settings(FCM_TOKEN_WRITE_BEHIND=False)
+    def test_disabled_by_default_writes_directly(self):
+        self.assertEqual(self.register('a').status_code, 200)
+        self.assertEqual(len(self.buffer), 0)
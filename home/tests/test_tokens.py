@@ -0,0 +1,40 @@
+from django.db import IntegrityError
+from django.test import TestCase
+
+from home.models import UserFCMToken, token_digest
+
+
+class TokenDigestTests(TestCase):
+    def test_save_keeps_the_digest_in_sync(self):
+        token = UserFCMToken.objects.create(token='first')
+        self.assertEqual(bytes(token.token_hash), token_digest('first'))
+
+        token.token = 'second'
+        token.save(update_fields=['token'])
+
+        token.refresh_from_db()
+        self.assertEqual(bytes(token.token_hash), token_digest('second'))
+        self.assertEqual(UserFCMToken.objects.for_token('second').get(), token)
+        self.assertFalse(UserFCMToken.objects.for_token('first').exists())
+
+    def test_bulk_create_fills_the_digest(self):
+        UserFCMToken.objects.bulk_create([UserFCMToken(token='a'), UserFCMToken(token='b')])
+
+        self.assertEqual(UserFCMToken.objects.for_token('b').get().token, 'b')
+
+    def test_tokens_are_unique_by_digest(self):
+        UserFCMToken.objects.create(token='same')
+
+        with self.assertRaises(IntegrityError):
+            UserFCMToken.objects.create(token='same')
+
+    def test_registering_a_token_again_reuses_the_row(self):
+        for user_agent in ('Firefox', 'Chrome'):
+            response = self.client.post(
+                '/api/save-fcm-token/', {'token': 'x' * 400}, content_type='application/json',
+                headers={'User-Agent': user_agent}
+            )
+            self.assertEqual(response.status_code, 200)
+
+        token = UserFCMToken.objects.get()
+        self.assertEqual((len(token.token), token.user_agent), (400, 'Chrome'))
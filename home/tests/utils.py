@@ -0,0 +1,78 @@
+import atexit
+from datetime import timedelta
+from unittest import mock
+
+from django.utils import timezone
+
+from home.backends import MemoryBackend
+from home.circuit_breaker import CircuitBreaker
+from home.db import WriteBehindBuffer
+from home.models import ScheduledNotification, UserFCMToken
+
+
+class FakeClock:
+    """Monotonic clock the tests move forward by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FailingBackend(MemoryBackend):
+    """Answers every message with the same failure"""
+
+    name = 'failing'
+
+    def __init__(self, error='FCM token is not registered or invalid', transient=False):
+        super().__init__()
+        self.error = error
+        self.transient = transient
+        self.calls = 0
+
+    def send_batch(self, messages):
+        self.calls += 1
+        return [{'success': False, 'error': self.error, 'transient': self.transient} for _ in messages]
+
+
+def closed_breaker(**options):
+    """A breaker of its own, so tests do not share the process-wide one"""
+    options.setdefault('name', 'test')
+    return CircuitBreaker(clock=FakeClock(), **options)
+
+
+def idle_buffer(test, model, **options):
+    """A write-behind buffer the test flushes by hand, without the background thread"""
+    buffer = WriteBehindBuffer(model, **options)
+    # Rows left over must not be flushed into the real database at exit
+    atexit.unregister(buffer.flush)
+    patcher = mock.patch.object(buffer, '_ensure_thread')
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return buffer
+
+
+def create_token(token='token'):
+    return UserFCMToken.objects.create(token=token)
+
+
+def create_notification(fcm_token, seconds_ago=60, title='Title', body='Body', **fields):
+    return ScheduledNotification.objects.create(
+        fcm_token=fcm_token,
+        title=title,
+        body=body,
+        scheduled_at=timezone.now() - timedelta(seconds=seconds_ago),
+        **fields
+    )
+
+
+def statuses(notifications):
+    """Current status of each notification, in order"""
+    by_id = dict(
+        ScheduledNotification.objects.filter(id__in=[n.id for n in notifications]).values_list('id', 'status')
+    )
+    return [by_id.get(n.id) for n in notifications]
@@ -0,0 +1,197 @@
+"""
+Streaming bulk import of FCM tokens
+
+Records are read lazily from CSV or NDJSON input, validated, de-duplicated
+within the stream and upserted into ``user_fcm_tokens`` in large batches.
+On PostgreSQL each batch is loaded with ``COPY`` into a temporary staging
+table and merged with a single ``INSERT ... ON CONFLICT DO UPDATE``; other
+databases use ``bulk_create(update_conflicts=True)``.
+"""
+
+import csv
+import io
+
+from django.db import connection, transaction
+
+from .api import loads
+from .models import UserFCMToken, token_digest
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+TOKEN_MAX_LENGTH = UserFCMToken._meta.get_field('token').max_length
+_TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+_FALSE_VALUES = {'0', 'false', 'f', 'no', 'n'}
+
+
+class InvalidRecord(Exception):
+    pass
+
+
+def _decode_lines(lines):
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        yield line
+
+
+def _parse_bool(value, default=True):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    normalized = str(value).strip().lower()
+    if normalized in _TRUE_VALUES:
+        return True
+    if normalized in _FALSE_VALUES:
+        return False
+    raise InvalidRecord(f'invalid is_active value {value!r}')
+
+
+def _clean(record, default_user_agent):
+    token = record.get('token')
+    if not isinstance(token, str):
+        raise InvalidRecord('token is required')
+    token = token.strip()
+    if not token or len(token) > TOKEN_MAX_LENGTH or any(ch.isspace() for ch in token):
+        raise InvalidRecord('token is empty, too long or contains whitespace')
+    user_agent = record.get('user_agent') or default_user_agent
+    return token, user_agent, _parse_bool(record.get('is_active'))
+
+
+def parse_records(lines, import_format, default_user_agent=''):
+    """Yield ``(token, user_agent, is_active)`` tuples, or ``InvalidRecord`` instances"""
+    if import_format not in IMPORT_FORMATS:
+        raise ValueError(f'format must be one of {", ".join(IMPORT_FORMATS)}')
+
+    lines = _decode_lines(lines)
+    if import_format == 'csv':
+        reader = csv.DictReader(lines)
+        if not reader.fieldnames or 'token' not in reader.fieldnames:
+            raise ValueError('CSV input needs a header row with a "token" column')
+        records = reader
+    else:
+        records = (line for line in lines if line.strip())
+
+    for record in records:
+        try:
+            if import_format == 'ndjson':
+                try:
+                    record = loads(record)
+                except ValueError:
+                    raise InvalidRecord('invalid JSON')
+                if not isinstance(record, dict):
+                    raise InvalidRecord('each line must be a JSON object')
+            yield _clean(record, default_user_agent)
+        except InvalidRecord as e:
+            yield e
+
+
+def _upsert_with_bulk_create(batch):
+    UserFCMToken.objects.bulk_create(
+        [
+            UserFCMToken(token=token, user_agent=user_agent, is_active=is_active)
+            for _, token, user_agent, is_active in batch
+        ],
+        update_conflicts=True,
+        unique_fields=['token_hash'],
+        update_fields=['user_agent', 'is_active', 'updated_at'],
+    )
+    return None
+
+
+def _copy_into(cursor, sql, data):
+    raw = cursor.cursor
+    if hasattr(raw, 'copy_expert'):
+        # psycopg2
+        raw.copy_expert(sql, io.StringIO(data))
+    else:
+        # psycopg 3
+        with raw.copy(sql) as copy:
+            copy.write(data)
+
+
+def _upsert_with_copy(batch):
+    table = connection.ops.quote_name(UserFCMToken._meta.db_table)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for digest, token, user_agent, is_active in batch:
+        writer.writerow(['\\x' + digest.hex(), token, user_agent, 't' if is_active else 'f'])
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS token_import_staging '
+            '(token_hash bytea, token varchar(500), user_agent text, is_active boolean) ON COMMIT DELETE ROWS'
+        )
+        # Inside an outer transaction the previous batch's rows are still there
+        cursor.execute('TRUNCATE token_import_staging')
+        _copy_into(cursor, 'COPY token_import_staging (token_hash, token, user_agent, is_active) FROM STDIN WITH (FORMAT csv)',
+                   buffer.getvalue())
+        cursor.execute(
+            f'INSERT INTO {table} (token_hash, token, user_agent, is_active, created_at, updated_at) '
+            f'SELECT token_hash, token, user_agent, is_active, now(), now() FROM token_import_staging '
+            f'ON CONFLICT (token_hash) DO UPDATE SET user_agent = EXCLUDED.user_agent, '
+            f'is_active = EXCLUDED.is_active, updated_at = EXCLUDED.updated_at '
+            f'RETURNING (xmax = 0)'
+        )
+        return sum(1 for (inserted,) in cursor.fetchall() if inserted)
+
+
+def upsert_batch(batch):
+    """Upsert a list of cleaned records; returns the number of new tokens when known"""
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            return _upsert_with_copy(batch)
+        return _upsert_with_bulk_create(batch)
+
+
+def import_tokens(lines, import_format, batch_size=10000, default_user_agent='', progress=None):
+    """
+    Import tokens from an iterable of CSV or NDJSON lines
+
+    Args:
+        lines: Iterable of str or bytes lines (a file, request stream, ...)
+        import_format: 'csv' or 'ndjson'
+        batch_size: Records upserted per transaction
+        default_user_agent: User agent stored when a record has none
+        progress: Optional callable receiving the running stats after each batch
+
+    Returns:
+        Dictionary with processed, imported, created, duplicates and invalid counts;
+        duplicates are counted within a batch, a token repeated in a later
+        batch is upserted again
+    """
+    stats = {'processed': 0, 'imported': 0, 'created': 0, 'duplicates': 0, 'invalid': 0, 'batches': 0}
+    seen = set()
+    batch = []
+
+    def flush():
+        created = upsert_batch(batch)
+        stats['imported'] += len(batch)
+        if created is None:
+            stats['created'] = None
+        elif stats['created'] is not None:
+            stats['created'] += created
+        stats['batches'] += 1
+        batch.clear()
+        # The upsert handles tokens seen in earlier batches; only a batch must be unique
+        seen.clear()
+        if progress:
+            progress(dict(stats))
+
+    for record in parse_records(lines, import_format, default_user_agent):
+        stats['processed'] += 1
+        if isinstance(record, InvalidRecord):
+            stats['invalid'] += 1
+            continue
+        # Keep fixed-size digests instead of the tokens themselves
+        key = token_digest(record[0])
+        if key in seen:
+            stats['duplicates'] += 1
+            continue
+        seen.add(key)
+        batch.append((key, *record))
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    return stats
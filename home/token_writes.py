@@ -0,0 +1,59 @@
+"""
+Write-behind mode for FCM token registrations
+
+The landing page re-registers its token on every load, so registration
+spikes are mostly repeated upserts of tokens we already have. With
+``FCM_TOKEN_WRITE_BEHIND`` on, ``save_fcm_token`` acknowledges right away
+and queues the upsert here instead. The per-process buffer keeps only the
+latest registration per token and flushes them with the bulk import's
+``upsert_batch`` every ``FCM_TOKEN_FLUSH_INTERVAL_MS`` milliseconds (or
+every ``FCM_TOKEN_FLUSH_SIZE`` distinct tokens) and at shutdown.
+"""
+
+import threading
+
+from django.conf import settings
+
+from .db import WriteBehindBuffer
+from .models import UserFCMToken, token_digest
+from .token_import import upsert_batch
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def write_behind_enabled():
+    return getattr(settings, 'FCM_TOKEN_WRITE_BEHIND', False)
+
+
+def get_token_buffer():
+    """Return the process-wide token buffer, configured from settings"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = WriteBehindBuffer(
+                    UserFCMToken,
+                    flush_size=getattr(settings, 'FCM_TOKEN_FLUSH_SIZE', 5000),
+                    flush_interval=getattr(settings, 'FCM_TOKEN_FLUSH_INTERVAL_MS', 1000) / 1000,
+                    max_pending=getattr(settings, 'FCM_TOKEN_MAX_PENDING', 100000),
+                    # Records are (digest, token, user_agent, is_active), as in the bulk import
+                    key=lambda record: record[0],
+                    write=upsert_batch,
+                )
+    return _buffer
+
+
+def queue_token_save(token, user_agent):
+    """
+    Queue an upsert of ``token`` as active with ``user_agent``
+
+    Returns:
+        False if the buffer is full; the caller should write directly
+    """
+    return get_token_buffer().add((token_digest(token), token, user_agent, True))
+
+
+def flush_tokens():
+    """Write queued registrations now (tests, benchmarks, shutdown hooks)"""
+    return get_token_buffer().flush()
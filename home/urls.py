@@ -8,9 +8,15 @@ urlpatterns = [
     path('firebase/', views.firebase_test, name='firebase_test'),
     path('firebase-messaging-sw.js', views.service_worker, name='service_worker'),
     path('api/save-fcm-token/', views.save_fcm_token, name='save_fcm_token'),
+    path('api/import-tokens/', views.import_fcm_tokens, name='import_fcm_tokens'),
     path('api/schedule-notification/', views.schedule_notification, name='schedule_notification'),
     path('api/check-and-send-notifications/', views.check_and_send_notifications, name='check_and_send_notifications'),
     path('api/notification-status/', views.get_notification_status, name='notification_status'),
+    path('api/notifications/', views.list_notifications, name='list_notifications'),
+    path('api/notifications/export/', views.export_notifications, name='export_notifications'),
+    path('api/notifications/<int:notification_id>/receipt/', views.record_notification_event, {'event': 'received'}, name='notification_receipt'),
+    path('api/notifications/<int:notification_id>/click/', views.record_notification_event, {'event': 'clicked'}, name='notification_click'),
     path('api/timezone-info/', views.get_timezone_info, name='timezone_info'),
+    path('metrics', views.metrics, name='metrics'),
     path('send/', views.send_notification, name='send_notification'),  # Legacy endpoint
 ]
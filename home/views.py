@@ -1,13 +1,88 @@
-from django.http import JsonResponse, HttpResponse
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
 from django.db import transaction
-import json
+from django.db.models import Count
 from datetime import datetime, timedelta
-from .models import UserFCMToken, ScheduledNotification
-from .notification_service import fcm_service
+from .models import UserFCMToken, ScheduledNotification, NotificationHistory, NotificationContent, token_digest
+from .adaptive import adaptive_enabled, get_batch_sizer
+from .api import NDJSON_CONTENT_TYPE, ApiError, Field, Schema, api_response, error_response, parse_json
+from .backends import get_backend
+from .circuit_breaker import get_breaker
+from .dispatcher import NotificationDispatcher
+from .events import record_event
+from .exports import export_querysets, parse_datetime_param, stream_export
+from .listing import DEFAULT_LIMIT, list_notifications as list_notification_page
+from .metrics import registry, token_writes
+from .token_import import TOKEN_MAX_LENGTH, import_tokens
+from .token_writes import queue_token_save, write_behind_enabled
+
+
+def _parse_scheduled_at(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _aware(value):
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def _parse_positive_seconds(value):
+    if value <= 0:
+        raise ValueError(value)
+    return timedelta(seconds=value)
+
+
+def _count_by_status(queryset):
+    """Rows of ``queryset`` per status, every status included, from one grouped query"""
+    counts = dict.fromkeys((status for status, _ in ScheduledNotification.STATUS_CHOICES), 0)
+    counts.update(queryset.order_by().values_list('status').annotate(total=Count('id')))
+    return counts
+
+
+# Request payloads, compiled once at import
+TOKEN_SCHEMA = Schema({
+    'token': Field(
+        max_length=TOKEN_MAX_LENGTH,
+        error=f'FCM token must be a string of at most {TOKEN_MAX_LENGTH} characters'
+    ),
+}, missing_error='FCM token is required')
+
+SCHEDULE_SCHEMA = Schema({
+    'title': Field(max_length=NotificationContent._meta.get_field('title').max_length),
+    'body': Field(),
+    'fcm_token': Field(max_length=TOKEN_MAX_LENGTH, error='Invalid or inactive FCM token'),
+    'scheduled_at': Field(
+        parse=_parse_scheduled_at,
+        error='Invalid scheduled_at format. Use ISO format (YYYY-MM-DDTHH:MM:SS)'
+    ),
+    'priority': Field(
+        required=False,
+        default='normal',
+        choices=[choice for choice, _ in ScheduledNotification.PRIORITY_CHOICES]
+    ),
+    'collapse_key': Field(
+        required=False,
+        max_length=ScheduledNotification._meta.get_field('collapse_key').max_length
+    ),
+    # Either an absolute deadline or a lifetime in seconds after scheduled_at
+    'expires_at': Field(
+        required=False,
+        parse=_parse_scheduled_at,
+        error='Invalid expires_at format. Use ISO format (YYYY-MM-DDTHH:MM:SS)'
+    ),
+    'max_staleness': Field(
+        types=int,
+        required=False,
+        parse=_parse_positive_seconds,
+        error='max_staleness must be a positive number of seconds'
+    ),
+}, missing_error='Title, body, FCM token, and scheduled_at are required')
+
 
 def index(request):
     """Main page with notification permission interface"""
@@ -39,20 +114,28 @@ def service_worker(request):
 def save_fcm_token(request):
     """API endpoint to save user FCM token"""
     try:
-        data = json.loads(request.body)
-        token = data.get('token')
+        token = parse_json(request, TOKEN_SCHEMA)['token']
         user_agent = request.META.get('HTTP_USER_AGENT', '')
-        
-        if not token:
-            return JsonResponse({
-                'success': False,
-                'error': 'FCM token is required'
-            }, status=400)
+
+        # Write-behind mode: acknowledge now, upsert with the next batch
+        if write_behind_enabled():
+            if queue_token_save(token, user_agent):
+                token_writes.inc(mode='queued')
+                return api_response({
+                    'success': True,
+                    'message': 'FCM token queued',
+                    'queued': True
+                }, status=202)
+            # Buffer full: fall back to writing synchronously
+            token_writes.inc(mode='overflow')
+        else:
+            token_writes.inc(mode='direct')
         
         # Check if token already exists
         fcm_token_obj, created = UserFCMToken.objects.get_or_create(
-            token=token,
+            token_hash=token_digest(token),
             defaults={
+                'token': token,
                 'user_agent': user_agent,
                 'is_active': True
             }
@@ -64,19 +147,16 @@ def save_fcm_token(request):
             fcm_token_obj.is_active = True
             fcm_token_obj.save()
         
-        return JsonResponse({
+        return api_response({
             'success': True,
             'message': 'FCM token saved successfully',
             'created': created
         })
         
-    except json.JSONDecodeError:
-        return JsonResponse({
-            'success': False,
-            'error': 'Invalid JSON data'
-        }, status=400)
+    except ApiError as e:
+        return error_response(e.message, e.status)
     except Exception as e:
-        return JsonResponse({
+        return api_response({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -86,60 +166,50 @@ def save_fcm_token(request):
 def schedule_notification(request):
     """API endpoint to schedule a notification"""
     try:
-        data = json.loads(request.body)
-        title = data.get('title')
-        body = data.get('body')
-        fcm_token = data.get('fcm_token')
-        scheduled_at = data.get('scheduled_at')
-        priority = data.get('priority', 'normal')
-        
-        if not all([title, body, fcm_token, scheduled_at]):
-            return JsonResponse({
-                'success': False,
-                'error': 'Title, body, FCM token, and scheduled_at are required'
-            }, status=400)
-        
-        try:
-            # Parse scheduled_at (expecting ISO format)
-            scheduled_datetime = datetime.fromisoformat(scheduled_at.replace('Z', '+00:00'))
-        except ValueError:
-            return JsonResponse({
-                'success': False,
-                'error': 'Invalid scheduled_at format. Use ISO format (YYYY-MM-DDTHH:MM:SS)'
-            }, status=400)
+        data = parse_json(request, SCHEDULE_SCHEMA)
+        fcm_token = data['fcm_token']
         
         # Check if FCM token exists
         try:
-            fcm_token_obj = UserFCMToken.objects.get(token=fcm_token, is_active=True)
+            fcm_token_obj = UserFCMToken.objects.for_token(fcm_token).get(is_active=True)
         except UserFCMToken.DoesNotExist:
-            return JsonResponse({
+            return api_response({
                 'success': False,
                 'error': 'Invalid or inactive FCM token'
             }, status=400)
         
-        # Create scheduled notification
-        notification = ScheduledNotification.objects.create(
-            title=title,
-            body=body,
-            fcm_token=fcm_token_obj,
-            scheduled_at=scheduled_datetime,
-            priority=priority
-        )
+        expires_at = data['expires_at']
+        if data['max_staleness'] is not None:
+            if expires_at is not None:
+                raise ApiError('Give either expires_at or max_staleness, not both')
+            expires_at = data['scheduled_at'] + data['max_staleness']
+        if expires_at is not None and _aware(expires_at) <= _aware(data['scheduled_at']):
+            raise ApiError('expires_at must be after scheduled_at')
+
+        # Create scheduled notification; intern and insert in one transaction so
+        # purge_unused_contents cannot delete the content in between
+        with transaction.atomic():
+            notification = ScheduledNotification.objects.create(
+                content=NotificationContent.objects.intern(data['title'], data['body']),
+                fcm_token=fcm_token_obj,
+                scheduled_at=data['scheduled_at'],
+                priority=data['priority'],
+                collapse_key=data['collapse_key'] or None,
+                expires_at=expires_at
+            )
         
-        return JsonResponse({
+        return api_response({
             'success': True,
             'message': 'Notification scheduled successfully',
             'notification_id': notification.id,
-            'scheduled_at': notification.scheduled_at.isoformat()
+            'scheduled_at': notification.scheduled_at.isoformat(),
+            'expires_at': notification.expires_at.isoformat() if notification.expires_at else None
         })
         
-    except json.JSONDecodeError:
-        return JsonResponse({
-            'success': False,
-            'error': 'Invalid JSON data'
-        }, status=400)
+    except ApiError as e:
+        return error_response(e.message, e.status)
     except Exception as e:
-        return JsonResponse({
+        return api_response({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -148,61 +218,39 @@ def schedule_notification(request):
 def check_and_send_notifications(request):
     """API endpoint to check and send scheduled notifications"""
     try:
-        now = timezone.now()
-        
-        # Get pending notifications that are due
-        pending_notifications = ScheduledNotification.objects.filter(
-            status='pending',
-            scheduled_at__lte=now
-        ).select_related('fcm_token')
+        sizer = get_batch_sizer(get_backend()) if adaptive_enabled() else None
+        summary = NotificationDispatcher(source='api', sizer=sizer).run()
         
-        if not pending_notifications.exists():
-            return JsonResponse({
+        if not summary['processed'] and summary['circuit_breaker'] == 'open':
+            return api_response({
+                'success': True,
+                'message': 'Circuit breaker open, pending notifications left for a later run',
+                'count': 0,
+                'deferred': summary['deferred'],
+                'circuit_breaker': summary['circuit_breaker']
+            })
+
+        if not summary['processed'] and not summary['deferred'] and not summary['expired']:
+            return api_response({
                 'success': True,
                 'message': 'No pending notifications to send',
                 'count': 0
             })
         
-        sent_count = 0
-        failed_count = 0
-        
-        for notification in pending_notifications:
-            try:
-                # Send notification
-                result = fcm_service.send_notification(
-                    notification.fcm_token.token,
-                    notification.title,
-                    notification.body,
-                    notification.priority
-                )
-                
-                if result['success']:
-                    notification.status = 'sent'
-                    notification.sent_at = result.get('sent_at', timezone.now())
-                    notification.save()
-                    sent_count += 1
-                else:
-                    notification.status = 'failed'
-                    notification.error_message = result.get('error', 'Unknown error')
-                    notification.save()
-                    failed_count += 1
-                    
-            except Exception as e:
-                notification.status = 'failed'
-                notification.error_message = str(e)
-                notification.save()
-                failed_count += 1
-        
-        return JsonResponse({
+        return api_response({
             'success': True,
-            'message': f'Processed {len(pending_notifications)} notifications',
-            'sent': sent_count,
-            'failed': failed_count,
-            'total': len(pending_notifications)
+            'message': f'Processed {summary["processed"]} notifications',
+            'sent': summary['sent'],
+            'failed': summary['failed'],
+            'collapsed': summary['collapsed'],
+            'expired': summary['expired'],
+            'deferred': summary['deferred'],
+            'total': summary['processed'],
+            'circuit_breaker': summary['circuit_breaker']
         })
         
     except Exception as e:
-        return JsonResponse({
+        return api_response({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -212,28 +260,163 @@ def get_notification_status(request):
     """API endpoint to get notification statistics"""
     try:
         total_tokens = UserFCMToken.objects.filter(is_active=True).count()
-        total_scheduled = ScheduledNotification.objects.count()
-        pending_notifications = ScheduledNotification.objects.filter(status='pending').count()
-        sent_notifications = ScheduledNotification.objects.filter(status='sent').count()
-        failed_notifications = ScheduledNotification.objects.filter(status='failed').count()
+        scheduled = _count_by_status(ScheduledNotification.objects.all())
+        archived = _count_by_status(NotificationHistory.objects.all())
         
-        return JsonResponse({
+        return api_response({
             'success': True,
             'data': {
                 'total_tokens': total_tokens,
-                'total_scheduled': total_scheduled,
-                'pending': pending_notifications,
-                'sent': sent_notifications,
-                'failed': failed_notifications
+                'total_scheduled': sum(scheduled.values()),
+                **scheduled,
+                **{f'archived_{status}': count for status, count in archived.items() if status != 'pending'},
+                'total_archived': sum(archived.values()),
+                'circuit_breaker': get_breaker(get_backend().name).snapshot()
             }
         })
         
     except Exception as e:
-        return JsonResponse({
+        return api_response({
             'success': False,
             'error': str(e)
         }, status=500)
 
+@require_http_methods(["GET"])
+def list_notifications(request):
+    """API endpoint to list scheduled notifications, paginated with an opaque cursor"""
+    try:
+        notifications, next_cursor = list_notification_page(
+            statuses=request.GET.getlist('status'),
+            priorities=request.GET.getlist('priority'),
+            token=request.GET.get('token'),
+            since=parse_datetime_param(request.GET.get('since')),
+            until=parse_datetime_param(request.GET.get('until')),
+            cursor=request.GET.get('cursor'),
+            limit=int(request.GET.get('limit', DEFAULT_LIMIT)),
+            order=request.GET.get('order', 'asc')
+        )
+
+        return api_response({
+            'success': True,
+            'data': {
+                'notifications': notifications,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
+            }
+        })
+
+    except ValueError as e:
+        return api_response({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+    except Exception as e:
+        return api_response({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+@require_http_methods(["GET"])
+def export_notifications(request):
+    """API endpoint to stream delivery results as NDJSON or CSV"""
+    export_format = request.GET.get('format', 'ndjson')
+    try:
+        since = parse_datetime_param(request.GET.get('since'))
+        until = parse_datetime_param(request.GET.get('until'))
+        querysets = export_querysets(
+            statuses=request.GET.getlist('status'),
+            since=since,
+            until=until,
+            date_field=request.GET.get('date_field', 'scheduled_at'),
+            include_history=request.GET.get('include_history') in ('1', 'true', 'yes')
+        )
+        lines = stream_export(export_format, querysets)
+    except ValueError as e:
+        return api_response({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+    
+    content_type = NDJSON_CONTENT_TYPE if export_format == 'ndjson' else 'text/csv'
+    response = StreamingHttpResponse(lines, content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="notifications.{export_format}"'
+    return response
+
+def _may_import_tokens(request):
+    """Staff sessions and callers sending FCM_TOKEN_IMPORT_SECRET may import tokens"""
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    secret = getattr(settings, 'FCM_TOKEN_IMPORT_SECRET', None)
+    provided = request.headers.get('X-Import-Secret')
+    return bool(secret and provided) and hmac.compare_digest(provided.encode(), secret.encode())
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def import_fcm_tokens(request):
+    """API endpoint to bulk import FCM tokens from a streamed CSV or NDJSON body"""
+    if not _may_import_tokens(request):
+        return api_response({
+            'success': False,
+            'error': 'Staff login or X-Import-Secret header required'
+        }, status=403)
+    import_format = request.GET.get('format')
+    if not import_format:
+        import_format = 'csv' if request.content_type == 'text/csv' else 'ndjson'
+    try:
+        batch_size = int(request.GET.get('batch_size', 10000))
+        if batch_size < 1:
+            raise ValueError('batch_size must be >= 1')
+        # Iterating the request reads the body line by line instead of loading it whole
+        stats = import_tokens(
+            request,
+            import_format,
+            batch_size=batch_size,
+            default_user_agent=request.META.get('HTTP_USER_AGENT', '')
+        )
+    except (ValueError, UnicodeDecodeError) as e:
+        return api_response({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+    except Exception as e:
+        return api_response({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+    
+    return api_response({
+        'success': True,
+        **stats
+    })
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def record_notification_event(request, notification_id, event):
+    """API endpoint for delivery receipts and clicks reported by the service worker"""
+    try:
+        if not record_event(notification_id, event):
+            return api_response({
+                'success': False,
+                'error': 'Event buffer is full, try again later'
+            }, status=503)
+
+        # Accepted, not yet stored: the buffer writes events in batches
+        return api_response({'success': True}, status=202)
+
+    except Exception as e:
+        return api_response({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """Expose dispatcher and FCM metrics in Prometheus text format"""
+    return HttpResponse(
+        registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
 @require_http_methods(["GET"])
 def get_timezone_info(request):
     """API endpoint to get timezone information"""
@@ -242,7 +425,7 @@ def get_timezone_info(request):
         
         info = get_timezone_info()
         
-        return JsonResponse({
+        return api_response({
             'success': True,
             'data': {
                 'server_time': info['local_time'],
@@ -254,14 +437,14 @@ def get_timezone_info(request):
         })
         
     except Exception as e:
-        return JsonResponse({
+        return api_response({
             'success': False,
             'error': str(e)
         }, status=500)
 
 def send_notification(request):
     """Legacy endpoint - redirects to new system"""
-    return JsonResponse({
+    return api_response({
         'success': False,
         'message': 'Use /api/schedule-notification/ to schedule notifications'
     })
\ No newline at end of file
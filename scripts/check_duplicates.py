@@ -24,7 +24,7 @@ def check_notifications():
     print("=" * 60)
     
     # Get all notifications
-    all_notifications = ScheduledNotification.objects.all().order_by('-created_at')
+    all_notifications = ScheduledNotification.objects.select_related('content').order_by('-created_at')
     
     print(f"📊 Total notifications: {all_notifications.count()}")
     
@@ -44,8 +44,7 @@ def check_notifications():
     
     for notification in all_notifications:
         similar = ScheduledNotification.objects.filter(
-            title=notification.title,
-            body=notification.body,
+            content=notification.content_id,
             scheduled_at=notification.scheduled_at,
             fcm_token=notification.fcm_token
         )
@@ -93,8 +92,7 @@ def clean_duplicates():
     
     for notification in ScheduledNotification.objects.all():
         similar = ScheduledNotification.objects.filter(
-            title=notification.title,
-            body=notification.body,
+            content=notification.content_id,
             scheduled_at=notification.scheduled_at,
             fcm_token=notification.fcm_token
         ).order_by('created_at')
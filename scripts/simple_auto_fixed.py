@@ -17,6 +17,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webNotificationDjango.settings'
 django.setup()
 
 from django.core.management import call_command
+from django.db import close_old_connections
 from django.utils import timezone
 from home.models import ScheduledNotification
 
@@ -33,6 +34,9 @@ try:
         now = timezone.now()
         print(f"\n🔄 Run #{count} at {now.strftime('%H:%M:%S')}")
         
+        # Recycle expired or broken connections like a request would
+        close_old_connections()
+        
         # Check for due notifications before sending
         due_notifications = ScheduledNotification.objects.filter(
             status='pending',